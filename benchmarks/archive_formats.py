@@ -0,0 +1,128 @@
+"""Compare throughput and size of archives produced by different pipes.
+
+Usage:
+
+    python benchmarks/archive_formats.py [--items N] [--size MB] [--random PCT]
+
+Every ticket type is produced from the same set of in-memory items. Part of
+items contains random data, that cannot be compressed, and the rest is
+text-like. Wall time and CPU time(including compression threads) are
+reported for every type.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import os
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncIterable
+
+from fpx import compression, pipes, transport
+from fpx.config import _defaults
+
+MB = 1024**2
+
+
+class MemoryTransport(transport.Transport):
+    def __init__(self, details: transport.ItemDetails, data: bytes):
+        super().__init__(details)
+        self.data = data
+
+    async def get(
+        self,
+        url: str,
+        headers: dict[str, Any],
+        timeout: int,
+    ) -> tuple[AsyncIterable[bytes], str | None, str]:
+        async def content():
+            for idx in range(0, len(self.data), transport.CHUNK_SIZE):
+                yield self.data[idx : idx + transport.CHUNK_SIZE]
+
+        return content(), "application/octet-stream", self.details.name
+
+    async def info(self, url: str, headers: dict[str, Any], timeout: int):
+        return transport.ItemInfo(
+            self.details.path,
+            self.details.name,
+            len(self.data),
+            "application/octet-stream",
+        )
+
+
+def make_items(count: int, size: int, random: int) -> dict[str, bytes]:
+    words = b" ".join(
+        f"line {idx}: the quick brown fox jumps over the lazy dog".encode()
+        for idx in range(size // 50)
+    )
+    return {
+        f"http://example.com/file-{idx}": (
+            os.urandom(size) if idx * 100 < count * random else words[:size]
+        )
+        for idx in range(count)
+    }
+
+
+async def produce(type: str, options: dict[str, Any], items: dict[str, bytes]):
+    config = SimpleNamespace(**_defaults())
+    ctx = SimpleNamespace(memory_budget=None)
+    request = SimpleNamespace(app=SimpleNamespace(config=config, ctx=ctx))
+    request.app.ctx.executor = None
+    ticket = SimpleNamespace(
+        id="benchmark",
+        type=type,
+        items=list(items),
+        options=options,
+        checksums={},
+        probes=None,
+        created_at=datetime.datetime(2000, 1, 1),
+    )
+
+    def choose(request: Any, item: str, byte_range: Any = None):
+        return MemoryTransport(transport.ItemDetails.from_str(item), items[item])
+
+    transport.choose = choose
+    total = 0
+    async with pipes.Pipe.choose(ticket, request) as pipe:  # type: ignore
+        async for chunk in pipe.chunks():
+            total += len(chunk)
+
+    compression.shutdown_executor(request.app)  # type: ignore
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=16, help="number of items")
+    parser.add_argument("--size", type=int, default=8, help="item size, MB")
+    parser.add_argument("--random", type=int, default=50, help="random items, %%")
+    args = parser.parse_args()
+
+    items = make_items(args.items, args.size * MB, args.random)
+    source = sum(map(len, items.values())) / MB
+
+    variants = [
+        ("zip", "zip", {}),
+        ("zip deflated", "zip", {"compression": "deflated"}),
+        ("zip auto", "zip", {"compression": "auto"}),
+        ("tar", "tar", {}),
+        ("tar.gz", "tar.gz", {}),
+    ]
+    if compression.zstandard:
+        variants.append(("tar.zst", "tar.zst", {}))
+
+    for name, type, options in variants:
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        size = asyncio.run(produce(type, options, items)) / MB
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        print(  # noqa: T201
+            f"{name:>13}: {source / wall:8.1f} MB/s, {cpu:6.2f}s CPU,"
+            f" {size:8.1f} MB ({size / source:6.1%})",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Compare HTTP/1.1 and HTTP/2 downloads of many items from the same origin.
+
+Usage:
+
+    python benchmarks/http2_upstream.py [--items N] [--size KB] [--latency MS]
+        [--window N]
+
+Requires `h2` package(`http2` extra). Local server responds to every
+request after the given latency, using HTTP/1.1 or HTTP/2 with prior
+knowledge(h2c), depending on the connection preface. Items are downloaded
+by `HttpxTransport` in the ticket order, while up to `window` items are
+prefetched, just like ZipPipe does. Throughput and number of connections
+opened by the client are reported for every protocol.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Any
+
+import h2.config
+import h2.connection
+import h2.events
+import httpx
+
+from fpx import pipes, transport
+from fpx.config import _defaults
+from fpx.transport.http_httpx import HttpxTransport
+
+KB = 1024
+MB = 1024**2
+PREFACE = b"PRI * HTTP/2.0"
+
+
+class Server:
+    def __init__(self, payload: bytes, latency: float):
+        self.payload = payload
+        self.latency = latency
+        self.connections = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        data = await reader.read(64 * KB)
+        try:
+            if data.startswith(PREFACE):
+                await self.serve_h2(reader, writer, data)
+            else:
+                await self.serve_h1(reader, writer, data)
+
+        except ConnectionError:
+            pass
+
+        finally:
+            writer.close()
+
+    async def serve_h1(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        data: bytes,
+    ):
+        while True:
+            while b"\r\n\r\n" not in data:
+                chunk = await reader.read(64 * KB)
+                if not chunk:
+                    return
+                data += chunk
+
+            _head, data = data.split(b"\r\n\r\n", 1)
+            await asyncio.sleep(self.latency)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\ncontent-type: application/octet-stream\r\n"
+                b"content-length: %d\r\n\r\n" % len(self.payload),
+            )
+            writer.write(self.payload)
+            await writer.drain()
+
+    async def serve_h2(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        data: bytes,
+    ):
+        conn = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False, header_encoding="utf-8"),
+        )
+        conn.initiate_connection()
+        window = asyncio.Event()
+        streams: dict[int, asyncio.Task[None]] = {}
+
+        try:
+            while data:
+                for event in conn.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        streams[event.stream_id] = asyncio.ensure_future(
+                            self.respond(conn, writer, window, event.stream_id),
+                        )
+                    elif isinstance(event, h2.events.WindowUpdated):
+                        window.set()
+                    elif isinstance(event, h2.events.StreamReset):
+                        streams.pop(event.stream_id).cancel()
+
+                writer.write(conn.data_to_send())
+                await writer.drain()
+                data = await reader.read(64 * KB)
+
+        finally:
+            for task in streams.values():
+                task.cancel()
+
+    async def respond(
+        self,
+        conn: h2.connection.H2Connection,
+        writer: asyncio.StreamWriter,
+        window: asyncio.Event,
+        stream_id: int,
+    ):
+        """Send payload, respecting flow-control window of the client."""
+        await asyncio.sleep(self.latency)
+        conn.send_headers(
+            stream_id,
+            [
+                (":status", "200"),
+                ("content-type", "application/octet-stream"),
+                ("content-length", str(len(self.payload))),
+            ],
+        )
+        offset = 0
+        while offset < len(self.payload):
+            size = min(
+                conn.local_flow_control_window(stream_id),
+                conn.max_outbound_frame_size,
+                len(self.payload) - offset,
+            )
+            if size <= 0:
+                window.clear()
+                await window.wait()
+                continue
+
+            conn.send_data(stream_id, self.payload[offset : offset + size])
+            offset += size
+            writer.write(conn.data_to_send())
+            await writer.drain()
+
+        conn.end_stream(stream_id)
+        writer.write(conn.data_to_send())
+        await writer.drain()
+
+
+async def download(
+    url: str,
+    items: int,
+    window: int,
+    http2: bool,
+) -> tuple[int, float]:
+    config = SimpleNamespace(**_defaults())
+    ctx = SimpleNamespace(memory_budget=None)
+    request = SimpleNamespace(app=SimpleNamespace(config=config, ctx=ctx))
+    urls = [f"{url}/file-{idx}" for idx in range(items)]
+    total = 0
+
+    async with httpx.AsyncClient(http1=not http2, http2=http2) as client:
+
+        def choose(request: Any, item: str, byte_range: Any = None):
+            return HttpxTransport(transport.ItemDetails.from_str(item), client=client)
+
+        transport.choose = choose
+        prefetcher = pipes._Prefetcher(request, urls, window, 2)  # type: ignore
+        start = time.perf_counter()
+        try:
+            async for _item, tp in prefetcher:
+                async for chunk in tp[2]:
+                    total += len(chunk)
+        finally:
+            prefetcher.close()
+
+        return total, time.perf_counter() - start
+
+
+async def compare(args: argparse.Namespace):
+    server = Server(b"x" * args.size * KB, args.latency / 1000)
+    listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}"
+
+    async with listener:
+        for name, http2 in [("HTTP/1.1", False), ("HTTP/2", True)]:
+            server.connections = 0
+            total, wall = await download(url, args.items, args.window, http2)
+            print(  # noqa: T201
+                f"{name:>8}: {total / MB / wall:8.1f} MB/s, {wall:6.2f}s,"
+                f" {server.connections:4} connections",
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=200, help="number of items")
+    parser.add_argument("--size", type=int, default=512, help="item size, KB")
+    parser.add_argument("--latency", type=int, default=20, help="latency, ms")
+    parser.add_argument("--window", type=int, default=16, help="prefetched items")
+    asyncio.run(compare(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Measure throughput and peak memory of the buffer used by ZipPipe.
+
+Usage:
+
+    python benchmarks/stream_buffer.py [--size MB] [--entry KB] [--flush N]
+
+ZIP archive with entries of the given size is written into the buffer and
+buffer is drained every N entries, just like ZipPipe does between yielding
+chunks. Legacy implementation, that concatenated bytes, is measured as well
+for comparison.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import time
+import tracemalloc
+from io import RawIOBase
+from typing import Any, Callable
+from zipfile import ZipFile, ZipInfo
+
+from fpx.pipes import _Stream
+
+MB = 1024**2
+
+
+class LegacyStream(RawIOBase):
+    def __init__(self):
+        self._buffer = b""
+
+    def writable(self):
+        return True
+
+    def write(self, b: Any):
+        self._buffer += b
+        return len(b)
+
+    def get(self):
+        chunk = self._buffer
+        self._buffer = b""
+        return chunk
+
+
+def archive(stream: Any, total: int, entry: int, flush: int) -> int:
+    payload = os.urandom(entry)
+    produced = 0
+    with ZipFile(stream, mode="w") as zf:
+        for idx in range(total // entry):
+            info = ZipInfo(f"entry-{idx}", (2000, 1, 1, 0, 0, 0))
+            with zf.open(info, mode="w", force_zip64=True) as dest:
+                dest.write(payload)
+
+            if idx % flush == 0:
+                produced += len(stream.get())
+
+    return produced + len(stream.get())
+
+
+def measure(factory: Callable[[], Any], total: int, entry: int, flush: int):
+    tracemalloc.start()
+    start = time.perf_counter()
+    produced = archive(factory(), total, entry, flush)
+    elapsed = time.perf_counter() - start
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    megabytes = produced / MB
+    return megabytes / elapsed, peak / 1024 / megabytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=64, help="archive size, MB")
+    parser.add_argument("--entry", type=int, default=4, help="entry size, KB")
+    parser.add_argument("--flush", type=int, default=256, help="entries per get()")
+    args = parser.parse_args()
+
+    total = args.size * MB
+    entry = args.entry * 1024
+
+    for name, factory in [("legacy", LegacyStream), ("fragments", _Stream)]:
+        speed, overhead = measure(factory, total, entry, args.flush)
+        print(  # noqa: T201
+            f"{name:>10}: {speed:8.1f} MB/s, {overhead:8.1f} KB peak memory per MB",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ from sanic.worker.loader import AppLoader
 
 from fpx.types import App
 
-from . import exception, middleware, route
+from . import compression, exception, middleware, queue, route, transport
 from .config import FpxConfig
 from .context import Context
 
@@ -41,6 +41,12 @@ def make_app() -> Sanic[FpxConfig, Context]:
     route.add_routes(app)
     exception.add_handlers(app)
 
+    app.main_process_start(queue.allocate_shared)
+    app.before_server_start(transport.open_clients)
+    app.add_task(transport.report_upstream_stats)
+    app.after_server_stop(transport.close_clients)
+    app.after_server_stop(compression.shutdown_executor)
+
     return app
 
 
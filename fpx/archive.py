@@ -0,0 +1,273 @@
+"""Streaming archive writers.
+
+ZipFile from the standard library compresses data itself and has no control
+over the layout of the archive. Writer defined here produces only ZIP
+structures, while entry content is compressed by the caller, so compression
+can be moved out of the event loop.
+
+Every entry is written with data descriptor and ZIP64 extensions, so sizes
+and checksums are not required in advance and archive can be written into
+non-seekable stream.
+
+TAR archive has no central directory and its structures do not depend on
+the content, apart from size of the entry. Only headers and padding are
+produced here, and the caller is responsible for the content.
+
+"""
+from __future__ import annotations
+
+import dataclasses
+import struct
+import tarfile
+from typing import Any, Iterable, Tuple
+
+from typing_extensions import TypeAlias
+
+DateTime: TypeAlias = Tuple[int, int, int, int, int, int]
+
+STORED = 0
+DEFLATED = 8
+
+_VERSION = 45  # ZIP64 support
+_FLAG_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_UNIX = 3
+_MAX = 0xFFFFFFFF
+_MAX_COUNT = 0xFFFF
+
+_local_header = struct.Struct("<4s2B4HL2L2H")
+_local_extra = struct.Struct("<2H2Q")
+_descriptor = struct.Struct("<4sL2Q")
+_central_header = struct.Struct("<4s4B4HL2L5H2L")
+_central_extra = struct.Struct("<2H3Q")
+_end64 = struct.Struct("<4sQ2H2L4Q")
+_locator64 = struct.Struct("<4sLQL")
+_end = struct.Struct("<4s4H2LH")
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+TAR_END = bytes(TAR_BLOCK_SIZE * 2)
+
+
+@dataclasses.dataclass
+class Entry:
+    name: bytes
+    flags: int
+    method: int
+    date_time: DateTime
+    offset: int
+    crc: int = 0
+    size: int = 0
+    compressed_size: int = 0
+
+
+def _encode_name(name: str) -> tuple[bytes, int]:
+    try:
+        return name.encode("ascii"), 0
+    except UnicodeEncodeError:
+        return name.encode("utf8"), _FLAG_UTF8
+
+
+def _dos_date_time(date_time: DateTime) -> tuple[int, int]:
+    year, month, day, hour, minute, second = date_time
+    date = (max(year, 1980) - 1980) << 9 | month << 5 | day
+    time = hour << 11 | minute << 5 | second // 2
+    return date, time
+
+
+class ZipWriter:
+    """Write ZIP structures into file-like object.
+
+    Example:
+        >>> writer = ZipWriter(stream)
+        >>> entry = writer.start("hello.txt", (2000, 1, 1, 0, 0, 0), STORED)
+        >>> writer.write(b"hello")
+        >>> writer.finish(entry, zlib.crc32(b"hello"), 5)
+        >>> writer.close()
+    """
+
+    def __init__(self, fileobj: Any):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.entries: list[Entry] = []
+
+    def _write(self, data: bytes):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def start(self, name: str, date_time: DateTime, method: int) -> Entry:
+        """Write local header of the entry."""
+        encoded, flags = _encode_name(name)
+        entry = Entry(
+            encoded,
+            flags | _FLAG_DESCRIPTOR,
+            method,
+            date_time,
+            self.offset,
+        )
+        date, time = _dos_date_time(date_time)
+        extra = _local_extra.pack(1, _local_extra.size - 4, 0, 0)
+
+        self._write(
+            _local_header.pack(
+                b"PK\x03\x04",
+                _VERSION,
+                0,
+                entry.flags,
+                method,
+                time,
+                date,
+                0,
+                _MAX,
+                _MAX,
+                len(encoded),
+                len(extra),
+            )
+            + encoded
+            + extra,
+        )
+        return entry
+
+    def write(self, data: bytes):
+        """Write compressed content of the current entry."""
+        if data:
+            self._write(data)
+
+    def skip(self, size: int):
+        """Move forward without writing content of the current entry.
+
+        File-like object must implement `skip(size)` method as well.
+        """
+        self.fileobj.skip(size)
+        self.offset += size
+
+    def finish(self, entry: Entry, crc: int, size: int):
+        """Write data descriptor of the entry.
+
+        Compressed size of the entry is computed from the amount of data
+        written since the local header.
+        """
+        entry.crc = crc
+        entry.size = size
+        entry.compressed_size = self.offset - entry.offset - local_header_size(
+            len(entry.name),
+        )
+        self._write(
+            _descriptor.pack(b"PK\x07\x08", crc, entry.compressed_size, size),
+        )
+        self.entries.append(entry)
+
+    def close(self, comment: bytes = b""):
+        """Write central directory."""
+        start = self.offset
+        for entry in self.entries:
+            date, time = _dos_date_time(entry.date_time)
+            extra = _central_extra.pack(
+                1,
+                _central_extra.size - 4,
+                entry.size,
+                entry.compressed_size,
+                entry.offset,
+            )
+            self._write(
+                _central_header.pack(
+                    b"PK\x01\x02",
+                    _VERSION,
+                    _UNIX,
+                    _VERSION,
+                    0,
+                    entry.flags,
+                    entry.method,
+                    time,
+                    date,
+                    entry.crc,
+                    _MAX,
+                    _MAX,
+                    len(entry.name),
+                    len(extra),
+                    0,
+                    0,
+                    0,
+                    0o600 << 16,
+                    _MAX,
+                )
+                + entry.name
+                + extra,
+            )
+
+        size = self.offset - start
+        count = len(self.entries)
+        end64 = self.offset
+        self._write(
+            _end64.pack(
+                b"PK\x06\x06",
+                _end64.size - 12,
+                _VERSION,
+                _VERSION,
+                0,
+                0,
+                count,
+                count,
+                size,
+                start,
+            )
+            + _locator64.pack(b"PK\x06\x07", 0, end64, 1)
+            + _end.pack(
+                b"PK\x05\x06",
+                0,
+                0,
+                min(count, _MAX_COUNT),
+                min(count, _MAX_COUNT),
+                min(size, _MAX),
+                min(start, _MAX),
+                len(comment),
+            )
+            + comment,
+        )
+
+
+def local_header_size(name_length: int) -> int:
+    """Size of the local header of the entry."""
+    return _local_header.size + name_length + _local_extra.size
+
+
+def entry_header_size(name: str) -> int:
+    """Size of the local header of the entry with the given name."""
+    encoded, _flags = _encode_name(name)
+    return local_header_size(len(encoded))
+
+
+def stored_entry_size(name: str, size: int) -> int:
+    """Size of the stored entry, including its header and data descriptor."""
+    return entry_header_size(name) + size + _descriptor.size
+
+
+def stored_archive_size(entries: Iterable[tuple[str, int]], comment: bytes) -> int:
+    """Size of the archive that contains only stored entries.
+
+    Writer does not depend on the content of entries, so size of the archive
+    can be computed from names and sizes of entries.
+    """
+    total = _end64.size + _locator64.size + _end.size + len(comment)
+    for name, size in entries:
+        encoded, _flags = _encode_name(name)
+        total += stored_entry_size(name, size)
+        total += _central_header.size + len(encoded) + _central_extra.size
+
+    return total
+
+
+def tar_header(name: str, size: int, mtime: int) -> bytes:
+    """Header of the regular file in TAR archive.
+
+    PAX format is used, so names of any length and encoding are allowed.
+    """
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+
+def tar_padding(size: int) -> bytes:
+    """Zeros that complete the last block of the TAR entry of the given size."""
+    return bytes(-size % TAR_BLOCK_SIZE)
@@ -0,0 +1,332 @@
+"""On-disk cache.
+
+Every cached value is a file inside the cache directory, named after the
+key. Access time of the file is updated on every hit and the least recently
+used files are removed by the executor when total size of the cache exceeds
+the limit.
+Modification time of the file is the moment it was cached and it's used to
+expire outdated values.
+
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import IO, Any, AsyncIterable, Callable, Mapping
+
+from fpx.types import App
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024**2
+
+# response headers kept together with cached upstream content
+_kept_headers = (
+    "content-disposition",
+    "content-length",
+    "content-type",
+    "etag",
+    "last-modified",
+)
+
+
+def make_key(*parts: Any) -> str:
+    """Compute cache key from JSON-serializable parts."""
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True).encode("utf8"),
+    ).hexdigest()
+
+
+class DiskCache:
+    def __init__(self, path: str, max_size: int, ttl: int):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        os.makedirs(path, exist_ok=True)
+
+        # total size of files, known after the first scan of the directory,
+        # and size of files stored since the beginning of the last scan
+        self._size: int | None = None
+        self._unscanned = 0
+        self._eviction: asyncio.Future[None] | None = None
+
+    def location(self, key: str) -> str:
+        return os.path.join(self.path, key)
+
+    def get(self, key: str) -> str | None:
+        """Path to the cached file, if it exists and not expired."""
+        path = self.location(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        now = time.time()
+        if self.ttl and stat.st_mtime + self.ttl < now:
+            log.debug("Cached %s is expired", key)
+            self.remove(key)
+            return None
+
+        os.utime(path, (now, stat.st_mtime))
+        return path
+
+    def open(self, key: str) -> CachedResponse | None:
+        """Cached file that starts with headers, if it's available."""
+        path = self.get(key)
+        if not path:
+            return None
+
+        try:
+            fileobj = open(path, "rb")  # noqa: SIM115
+        except FileNotFoundError:
+            return None
+
+        try:
+            return CachedResponse(fileobj)
+        except ValueError:
+            log.warning("Drop corrupted cached file %s", path)
+            fileobj.close()
+            self.remove(key)
+
+        return None
+
+    def remove(self, key: str):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.location(key))
+
+    async def store(
+        self,
+        key: str,
+        content: AsyncIterable[bytes],
+        is_valid: Callable[[], bool] = lambda: True,
+        header: bytes = b"",
+    ) -> AsyncIterable[bytes]:
+        """Pass content through, saving it into the cache.
+
+        Content is written into temporary file and it's moved into the cache
+        only when content is consumed completely and `is_valid` returns
+        true. Optional `header` is written before the content.
+        """
+        loop = asyncio.get_running_loop()
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        size = len(header)
+        try:
+            with os.fdopen(fd, "wb") as dest:
+                dest.write(header)
+                async for chunk in content:
+                    await loop.run_in_executor(None, dest.write, chunk)
+                    size += len(chunk)
+                    yield chunk
+
+            if is_valid():
+                os.replace(tmp, self.location(key))
+                log.debug("Cached %s", key)
+                self._added(size)
+
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp)
+
+    def _added(self, size: int):
+        """Start eviction when new file may exceed the size limit.
+
+        Directory is scanned only when the size is unknown or exceeds the
+        limit, and only one scan runs at a time.
+        """
+        self._unscanned += size
+        if self._size is not None and self._size + self._unscanned <= self.max_size:
+            return
+
+        if self._eviction is None or self._eviction.done():
+            self._eviction = asyncio.ensure_future(self.evict())
+
+    async def evict(self):
+        """Remove least recently used files until cache fits size limit."""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._unscanned = 0
+            self._size = await loop.run_in_executor(None, self._evict)
+            if self._size + self._unscanned <= self.max_size:
+                break
+
+    def _evict(self) -> int:
+        files: list[tuple[float, int, str]] = []
+        total = 0
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith(".tmp-"):
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_atime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        files.sort()
+        for _atime, size, path in files:
+            if total <= self.max_size:
+                break
+
+            log.debug("Evict %s from cache", path)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+
+        return total
+
+
+async def read(
+    fd: int,
+    start: int,
+    end: int,
+    chunk_size: int = CHUNK_SIZE,
+) -> AsyncIterable[bytes]:
+    """Read inclusive range of bytes from the file, outside of event loop."""
+    loop = asyncio.get_running_loop()
+    offset = start
+    while offset <= end:
+        chunk = await loop.run_in_executor(
+            None,
+            os.pread,
+            fd,
+            min(chunk_size, end + 1 - offset),
+            offset,
+        )
+        if not chunk:
+            break
+
+        offset += len(chunk)
+        yield chunk
+
+
+class CachedResponse:
+    """Upstream response or generated archive stored in the cache.
+
+    The first line of the file is JSON with response headers, followed by
+    the body. File is opened immediately, so it remains readable even if
+    it's evicted in the meantime.
+    """
+
+    def __init__(self, fileobj: IO[bytes]):
+        self.fileobj = fileobj
+        line = fileobj.readline()
+        self.headers: dict[str, str] = json.loads(line)
+        self.offset = len(line)
+        self.size = os.fstat(fileobj.fileno()).st_size - self.offset
+
+    def conditions(self) -> dict[str, str]:
+        """Headers of the conditional request that revalidates response."""
+        conditions: dict[str, str] = {}
+        if etag := self.headers.get("etag"):
+            conditions["if-none-match"] = etag
+        if modified := self.headers.get("last-modified"):
+            conditions["if-modified-since"] = modified
+
+        return conditions
+
+    def content(
+        self,
+        byte_range: tuple[int, int] | None = None,
+    ) -> AsyncIterable[bytes]:
+        start, end = byte_range or (0, self.size - 1)
+        return read(
+            self.fileobj.fileno(),
+            self.offset + start,
+            self.offset + min(end, self.size - 1),
+        )
+
+    async def close(self):
+        self.fileobj.close()
+
+
+class ResponseCache:
+    """Cache of upstream responses that can be revalidated.
+
+    Response is identified by URL and request headers. Only responses with
+    `ETag` or `Last-Modified` header are cached, because every use of the
+    cached response requires conditional request to upstream.
+    """
+
+    def __init__(self, disk: DiskCache):
+        self.disk = disk
+
+    def lookup(self, url: str, headers: Mapping[str, Any]) -> CachedResponse | None:
+        return self.disk.open(make_key(url, dict(headers)))
+
+    def is_cacheable(self, headers: Mapping[str, str], size: int | None) -> bool:
+        if not (headers.get("etag") or headers.get("last-modified")):
+            return False
+
+        if "no-store" in headers.get("cache-control", ""):
+            return False
+
+        if headers.get("vary", "").strip() == "*":
+            return False
+
+        return size is None or size <= self.disk.max_size
+
+    def store(
+        self,
+        url: str,
+        headers: Mapping[str, Any],
+        response_headers: Mapping[str, str],
+        content: AsyncIterable[bytes],
+        size: int | None,
+    ) -> AsyncIterable[bytes]:
+        """Pass content through, saving it together with response headers.
+
+        When `size` is known, content of different size is not cached.
+        """
+        kept = {
+            name: response_headers[name]
+            for name in _kept_headers
+            if name in response_headers
+        }
+        received = 0
+
+        async def counted():
+            nonlocal received
+            async for chunk in content:
+                received += len(chunk)
+                yield chunk
+
+        return self.disk.store(
+            make_key(url, dict(headers)),
+            counted(),
+            lambda: size is None or size == received,
+            json.dumps(kept).encode("utf8") + b"\n",
+        )
+
+
+def archive_cache(app: App) -> DiskCache | None:
+    """Cache of generated archives of the current worker, if it's enabled."""
+    path = app.config.FPX_ARCHIVE_CACHE_DIR
+    if not path:
+        return None
+
+    if app.ctx.archive_cache is None:
+        app.ctx.archive_cache = DiskCache(
+            path,
+            app.config.FPX_ARCHIVE_CACHE_SIZE,
+            app.config.FPX_ARCHIVE_CACHE_TTL,
+        )
+
+    return app.ctx.archive_cache
+
+
+def upstream_cache(app: App) -> ResponseCache | None:
+    """Cache of upstream responses of the current worker, if it's enabled."""
+    path = app.config.FPX_UPSTREAM_CACHE_DIR
+    if not path:
+        return None
+
+    if app.ctx.upstream_cache is None:
+        app.ctx.upstream_cache = ResponseCache(
+            DiskCache(path, app.config.FPX_UPSTREAM_CACHE_SIZE, 0),
+        )
+
+    return app.ctx.upstream_cache
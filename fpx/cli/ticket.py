@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Optional
 
 import click
@@ -34,3 +35,17 @@ def drop(app: Sanic, all: bool, id: Optional[str] = None):
         q.delete()
     click.secho("Done", fg="green")
     sess.commit()
+
+
+@ticket.command()
+@click.pass_obj
+def clean(app: Sanic):
+    """Remove expired tickets."""
+    sess = app.ctx.db_session()
+    count = (
+        sess.query(Ticket)
+        .filter(Ticket.expires_at < datetime.utcnow())
+        .delete(synchronize_session=False)
+    )
+    sess.commit()
+    click.secho(f"Removed {count} tickets", fg="green")
@@ -0,0 +1,321 @@
+"""Compression of archive entries.
+
+Compression is CPU-bound, so it never happens inside the event loop.
+Content is split into blocks and every block is deflated by the executor
+independently from the others, similar to pigz. Blocks are flushed to the
+byte boundary and use the tail of the previous block as a dictionary, so
+their concatenation is a valid deflate stream.
+
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import os
+import struct
+import zlib
+from collections import Counter, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any
+
+from fpx.types import App
+
+from . import archive
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+WINDOW_SIZE = 32 * 1024
+SAMPLE_SIZE = 4 * 1024
+
+# gzip member header without file name and modification time
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+# bits per byte. Data above this limit is either compressed or encrypted
+ENTROPY_LIMIT = 7.5
+
+methods: dict[str, int | None] = {
+    "stored": archive.STORED,
+    "deflated": archive.DEFLATED,
+    "auto": None,
+}
+
+compressed_types = {
+    "application/gzip",
+    "application/pdf",
+    "application/vnd.rar",
+    "application/x-7z-compressed",
+    "application/x-bzip2",
+    "application/x-rar-compressed",
+    "application/x-xz",
+    "application/zip",
+    "application/zstd",
+}
+compressed_type_prefixes = ("image/", "video/", "audio/")
+compressible_types = {"image/bmp", "image/svg+xml", "audio/wav", "audio/x-wav"}
+
+compressed_extensions = {
+    ".7z",
+    ".aac",
+    ".avi",
+    ".bz2",
+    ".docx",
+    ".flac",
+    ".gif",
+    ".gz",
+    ".heic",
+    ".jar",
+    ".jpeg",
+    ".jpg",
+    ".m4a",
+    ".mkv",
+    ".mov",
+    ".mp3",
+    ".mp4",
+    ".ogg",
+    ".pdf",
+    ".png",
+    ".pptx",
+    ".rar",
+    ".tgz",
+    ".webm",
+    ".webp",
+    ".xlsx",
+    ".xz",
+    ".zip",
+    ".zst",
+}
+
+
+def _workers(app: App) -> int:
+    return app.config.FPX_COMPRESSION_WORKERS or os.cpu_count() or 1
+
+
+def get_executor(app: App) -> Executor:
+    """Executor used for compression by the current worker."""
+    if app.ctx.executor is None:
+        workers = _workers(app)
+        if app.config.FPX_COMPRESSION_EXECUTOR == "process":
+            app.ctx.executor = ProcessPoolExecutor(workers)
+        else:
+            app.ctx.executor = ThreadPoolExecutor(workers, "fpx-compression")
+
+    return app.ctx.executor
+
+
+def shutdown_executor(app: App):
+    if app.ctx.executor is not None:
+        app.ctx.executor.shutdown(wait=False)
+        app.ctx.executor = None
+
+
+def _deflate(data: bytes, level: int, zdict: bytes, final: bool) -> bytes:
+    # negative wbits produce raw deflate stream without zlib header
+    if zdict:
+        compressor = zlib.compressobj(
+            level,
+            zlib.DEFLATED,
+            -zlib.MAX_WBITS,
+            zdict=zdict,
+        )
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH,
+    )
+
+
+class Compressor:
+    """Pass data through without compression."""
+
+    method = archive.STORED
+
+    async def compress(self, data: bytes) -> bytes:
+        """Accept content and return compressed data that is ready."""
+        return data
+
+    async def flush(self) -> bytes:
+        """Return the rest of compressed data."""
+        return b""
+
+
+class DeflateCompressor(Compressor):
+    """Deflate content in parallel blocks.
+
+    Up to `workers` blocks are compressed simultaneously. When all of them
+    are busy, `compress` waits for the oldest block, so producer cannot
+    outrun executor.
+    """
+
+    method = archive.DEFLATED
+
+    def __init__(
+        self,
+        executor: Executor,
+        level: int,
+        block_size: int,
+        workers: int,
+    ):
+        self.executor = executor
+        self.level = level
+        self.block_size = block_size
+        self.workers = max(workers, 1)
+        self._buffer: list[bytes] = []
+        self._buffered = 0
+        self._zdict = b""
+        self._blocks: deque[asyncio.Future[bytes]] = deque()
+
+    def _submit(self, final: bool):
+        block = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+
+        loop = asyncio.get_running_loop()
+        self._blocks.append(
+            loop.run_in_executor(
+                self.executor,
+                _deflate,
+                block,
+                self.level,
+                self._zdict,
+                final,
+            ),
+        )
+        self._zdict = block[-WINDOW_SIZE:]
+
+    async def compress(self, data: bytes) -> bytes:
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.block_size:
+            self._submit(False)
+
+        output: list[bytes] = []
+        while self._blocks and (
+            len(self._blocks) >= self.workers or self._blocks[0].done()
+        ):
+            output.append(await self._blocks.popleft())
+
+        return b"".join(output)
+
+    async def flush(self) -> bytes:
+        self._submit(True)
+        output = [await block for block in self._blocks]
+        self._blocks.clear()
+        return b"".join(output)
+
+
+class GzipCompressor(DeflateCompressor):
+    """Deflate content in parallel blocks and wrap it into gzip member."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._started = False
+        self._crc = 0
+        self._size = 0
+
+    def _with_header(self, output: bytes) -> bytes:
+        if self._started:
+            return output
+
+        self._started = True
+        return _GZIP_HEADER + output
+
+    async def compress(self, data: bytes) -> bytes:
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        return self._with_header(await super().compress(data))
+
+    async def flush(self) -> bytes:
+        trailer = struct.pack("<2L", self._crc, self._size & 0xFFFFFFFF)
+        return self._with_header(await super().flush()) + trailer
+
+
+class ZstdCompressor(Compressor):
+    """Compress content with zstd.
+
+    zstd splits content into jobs and compresses them using its own threads,
+    so calls are only moved out of the event loop. Compression context
+    cannot be sent to another process, so the default executor is used.
+    """
+
+    def __init__(self, level: int, workers: int):
+        self._compressor = zstandard.ZstdCompressor(
+            level=level,
+            threads=workers,
+        ).compressobj()
+
+    async def compress(self, data: bytes) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._compressor.compress, data)
+
+    async def flush(self) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._compressor.flush)
+
+
+def entropy(sample: bytes) -> float:
+    """Shannon entropy of the sample in bits per byte."""
+    if not sample:
+        return 0.0
+
+    total = len(sample)
+    return -sum(
+        count / total * math.log2(count / total)
+        for count in Counter(sample).values()
+    )
+
+
+def choose_method(content_type: str | None, name: str, sample: bytes) -> int:
+    """Decide whether entry benefits from compression.
+
+    Media files, PDFs and archives are already compressed, which is detected
+    using upstream content type and filename. Other content is compressed
+    unless the beginning of it looks random.
+    """
+    if content_type:
+        mime = content_type.split(";")[0].strip().lower()
+        if mime in compressed_types or (
+            mime.startswith(compressed_type_prefixes)
+            and mime not in compressible_types
+        ):
+            return archive.STORED
+
+    _root, ext = os.path.splitext(name)
+    if ext.lower() in compressed_extensions:
+        return archive.STORED
+
+    if entropy(sample[:SAMPLE_SIZE]) > ENTROPY_LIMIT:
+        return archive.STORED
+
+    return archive.DEFLATED
+
+
+def make_compressor(app: App, method: int, level: int) -> Compressor:
+    if method == archive.DEFLATED:
+        return DeflateCompressor(
+            get_executor(app),
+            level,
+            app.config.FPX_COMPRESSION_BLOCK_SIZE,
+            _workers(app),
+        )
+
+    return Compressor()
+
+
+def make_gzip_compressor(app: App, level: int) -> Compressor:
+    return GzipCompressor(
+        get_executor(app),
+        level,
+        app.config.FPX_COMPRESSION_BLOCK_SIZE,
+        _workers(app),
+    )
+
+
+def make_zstd_compressor(app: App, level: int) -> Compressor:
+    return ZstdCompressor(level, _workers(app))
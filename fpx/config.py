@@ -3,7 +3,7 @@
 from __future__ import annotations
 
 import logging
-from typing import Any, Literal
+from typing import Any
 
 from sanic.config import Config
 from sanic.exceptions import LoadFileException
@@ -31,15 +31,68 @@ def _defaults() -> dict[str, Any]:
         "JWT_ALGORITHM": "HS256",
         "FPX_LOG_LEVEL": "INFO",
         "FPX_NO_QUEUE": True,
+        "FPX_QUEUE_BACKEND": "memory",
+        "FPX_QUEUE_LEASE": 60,
+        "FPX_QUEUE_POLL_INTERVAL": 5,
+        "FPX_QUEUE_NOTIFY_INTERVAL": 0.5,
+        "FPX_QUEUE_CAPACITY": 4096,
+        "FPX_TICKET_TTL": 0,
+        "FPX_TICKET_PROBE": False,
+        "FPX_TICKET_PROBE_CONCURRENCY": 16,
         "FPX_TRANSPORT": "aiohttp",
+        "FPX_TRANSPORTS": {},
+        "FPX_TRANSPORT_RULES": {},
+        "FPX_FILE_ROOTS": [],
         "FPX_PIPE_SILLY_STREAM": True,
+        "FPX_ZIP_PREFETCH": 4,
+        "FPX_ZIP_PREFETCH_LIMIT": 16,
+        "FPX_ZIP_PREFETCH_BUFFER": 2,
+        "FPX_ZIP_COMPRESSION": "stored",
+        "FPX_ZIP_CONTENT_LENGTH": False,
+        "FPX_ARCHIVE_CACHE_DIR": None,
+        "FPX_ARCHIVE_CACHE_SIZE": 10 * 1024**3,
+        "FPX_ARCHIVE_CACHE_TTL": 24 * 60 * 60,
+        "FPX_UPSTREAM_CACHE_DIR": None,
+        "FPX_UPSTREAM_CACHE_SIZE": 10 * 1024**3,
+        "FPX_TAR_GZIP_LEVEL": 6,
+        "FPX_TAR_ZSTD_LEVEL": 3,
+        "FPX_OUTPUT_CHUNK_SIZE": 256 * 1024,
+        "FPX_DUPLICATE_BUFFER_SIZE": 8 * 1024**2,
+        "FPX_MEMORY_BUDGET": 0,
+        "FPX_HTTP_POOL_SIZE": 100,
+        "FPX_HTTP_POOL_SIZE_PER_HOST": 0,
+        "FPX_HTTP_KEEPALIVE": 30,
+        "FPX_HTTP_DNS_CACHE_TTL": 300,
+        "FPX_HTTP2": False,
+        "FPX_HTTP2_BUFFER_SIZE": 8 * 1024**2,
+        "FPX_HTTP2_DISK_BUFFER_SIZE": 256 * 1024**2,
+        "FPX_UPSTREAM_LIMIT": 0,
+        "FPX_UPSTREAM_HOST_LIMIT": 0,
+        "FPX_UPSTREAM_HOST_LIMITS": {},
+        "FPX_UPSTREAM_STATS_INTERVAL": 0,
+        "FPX_UPSTREAM_RETRIES": 3,
+        "FPX_UPSTREAM_RETRY_BACKOFF": 1.0,
+        "FPX_UPSTREAM_TIMEOUT": 24 * 60 * 60,
+        "FPX_UPSTREAM_CONNECT_TIMEOUT": 30,
+        "FPX_UPSTREAM_TTFB_TIMEOUT": 0,
+        "FPX_UPSTREAM_IDLE_TIMEOUT": 300,
+        "FPX_UPSTREAM_STALL_RATE": 0,
+        "FPX_UPSTREAM_STALL_PERIOD": 60,
+        "FPX_PARALLEL_THRESHOLD": 0,
+        "FPX_PARALLEL_CONNECTIONS": 4,
+        "FPX_PARALLEL_SEGMENT_SIZE": 8 * 1024**2,
+        "FPX_OUTPUT_LATENCY": 0.05,
+        "FPX_ZIP_COMPRESSION_LEVEL": 6,
+        "FPX_COMPRESSION_EXECUTOR": "thread",
+        "FPX_COMPRESSION_WORKERS": None,
+        "FPX_COMPRESSION_BLOCK_SIZE": 1024**2,
     }
 
 
 class FpxConfig(Config):
     """Configuration for Sanic app object."""
 
-    FPX_TRANSPORT: Literal["aiohttp", "httpx"]
+    FPX_TRANSPORT: str
 
     def __init__(self):
         super().__init__()
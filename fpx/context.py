@@ -5,22 +5,40 @@ This module defines object available as `request.app.ctx` during HTTP requests.
 """
 from __future__ import annotations
 
-from collections import deque
+from concurrent.futures import Executor
 from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
 
 from sqlalchemy.orm import Session as AlchemySession
 from sqlalchemy.orm.scoping import ScopedSession
 
 from .model import Client, Session
 
+if TYPE_CHECKING:
+    import aiohttp
+    import httpx
+
+    from .cache import DiskCache, ResponseCache
+    from .queue import DownloadQueue, Notifier
+    from .transport import MemoryBudget, Transport, UpstreamLimits
+
 
 @dataclass
 class Context:
-    download_queue: deque[str] = field(default_factory=deque)
-    active_downloads: list[str] = field(default_factory=list)
+    download_queue: DownloadQueue | None = None
+    queue_notifier: Notifier | None = None
     sessionmaker: ScopedSession[AlchemySession] = Session
     client: Client | None = None
     db: AlchemySession = None  # type: ignore
+    executor: Executor | None = None
+    aiohttp_session: aiohttp.ClientSession | None = None
+    httpx_client: httpx.AsyncClient | None = None
+    upstream_limits: UpstreamLimits | None = None
+    memory_budget: MemoryBudget | None = None
+    archive_cache: DiskCache | None = None
+    upstream_cache: ResponseCache | None = None
+    transports: set[type[Transport]] = field(default_factory=set)
+    azure_clients: dict[str, aiohttp.ClientSession] = field(default_factory=dict)
 
     def db_session(self):
         return self.sessionmaker()
@@ -14,6 +14,7 @@ class FpxError(Exception):
     def __init__(self, details, *args):
         super().__init__(*args)
         self._details = details
+        self._headers: dict[str, str] = {}
 
 
 class NotFoundError(FpxError):
@@ -36,6 +37,14 @@ class RequestError(FpxError):
     _status = 400
 
 
+class RangeError(FpxError):
+    _status = 416
+
+    def __init__(self, details, size: int, *args):
+        super().__init__(details, *args)
+        self._headers = {"content-range": f"bytes */{size}"}
+
+
 class ConfigError(FpxError):
     pass
 
@@ -43,10 +52,15 @@ class ConfigError(FpxError):
 class TransportError(FpxError):
     pass
 
+
 class UrlNotAvailableError(TransportError):
     pass
 
 
+class SizeMismatchError(TransportError):
+    pass
+
+
 async def handle_validation_error(request: Request, err: HandleValidationError):
     """Convert validation error into JSON response."""
     exc = err.exc
@@ -57,7 +71,11 @@ async def handle_validation_error(request: Request, err: HandleValidationError):
 
 async def handle_fpx_error(request: Request, err: NotFoundError):
     """Convert arbitrary FPX error into JSON response."""
-    return response.json({"errors": err._details}, status=err._status)
+    return response.json(
+        {"errors": err._details},
+        status=err._status,
+        headers=err._headers,
+    )
 
 
 def add_handlers(app: App):
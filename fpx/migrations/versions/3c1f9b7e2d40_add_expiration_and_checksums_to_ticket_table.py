@@ -0,0 +1,31 @@
+"""add expires_at and checksums columns to ticket table
+
+Revision ID: 3c1f9b7e2d40
+Revises: ac8a8750d3e2
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3c1f9b7e2d40"
+down_revision = "ac8a8750d3e2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "tickets",
+        sa.Column("expires_at", sa.DateTime, nullable=True),
+    )
+    op.add_column(
+        "tickets",
+        sa.Column("checksums", sa.JSON, nullable=False, server_default="{}"),
+    )
+
+
+def downgrade():
+    op.drop_column("tickets", "checksums")
+    op.drop_column("tickets", "expires_at")
@@ -0,0 +1,35 @@
+"""create download_slots and download_waiters tables
+
+Revision ID: 5b7d2e9c4a13
+Revises: 8d4e6a1f0b52
+Create Date: 2026-10-18 16:41:09.273514
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5b7d2e9c4a13"
+down_revision = "8d4e6a1f0b52"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "download_slots",
+        sa.Column("number", sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column("ticket_id", sa.String, unique=True, nullable=False),
+        sa.Column("expires_at", sa.DateTime, nullable=False),
+    )
+    op.create_table(
+        "download_waiters",
+        sa.Column("ticket_id", sa.String, primary_key=True),
+        sa.Column("joined_at", sa.DateTime, nullable=False),
+        sa.Column("expires_at", sa.DateTime, nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("download_waiters")
+    op.drop_table("download_slots")
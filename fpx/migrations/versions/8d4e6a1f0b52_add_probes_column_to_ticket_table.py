@@ -0,0 +1,26 @@
+"""add probes column to ticket table
+
+Revision ID: 8d4e6a1f0b52
+Revises: 3c1f9b7e2d40
+Create Date: 2026-10-18 14:03:27.518240
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8d4e6a1f0b52"
+down_revision = "3c1f9b7e2d40"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "tickets",
+        sa.Column("probes", sa.JSON, nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_column("tickets", "probes")
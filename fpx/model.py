@@ -4,7 +4,7 @@ import json
 import secrets
 import uuid
 from datetime import datetime
-from typing import Any, Dict, Iterable
+from typing import Any, Dict, Iterable, List, Optional
 
 from sqlalchemy import JSON, Text
 from sqlalchemy.orm import (
@@ -55,6 +55,19 @@ class Ticket(Base):
     options: Mapped[Dict[str, Any]] = mapped_column(nullable=False, default=dict)
     is_available: Mapped[bool] = mapped_column(default=False)
     created_at: Mapped[datetime] = mapped_column(default=datetime.utcnow())
+    expires_at: Mapped[Optional[datetime]] = mapped_column(default=None)
+    checksums: Mapped[Dict[str, Any]] = mapped_column(nullable=False, default=dict)
+
+    # details of items collected when ticket was generated. Unavailable
+    # items are represented by `None`
+    probes: Mapped[Optional[List[Optional[Dict[str, Any]]]]] = mapped_column(
+        JSON,
+        default=None,
+    )
+
+    @property
+    def is_expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at < datetime.utcnow()
 
     @property
     def items(self) -> Iterable[str | dict[str, Any]]:
@@ -73,3 +86,21 @@ class Ticket(Base):
             data["id"] = self.id
 
         return data
+
+
+class QueueSlot(Base):
+    """Download slot, held by the ticket until the lease expires."""
+
+    __tablename__ = "download_slots"
+    number: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    ticket_id: Mapped[str] = mapped_column(unique=True, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(nullable=False)
+
+
+class QueueWaiter(Base):
+    """Ticket waiting for a download slot."""
+
+    __tablename__ = "download_waiters"
+    ticket_id: Mapped[str] = mapped_column(primary_key=True)
+    joined_at: Mapped[datetime] = mapped_column(nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(nullable=False)
@@ -1,28 +1,44 @@
 from __future__ import annotations
 
 import abc
+import asyncio
+import calendar
+import contextlib
+import hashlib
+import json
 import logging
 import os
-import time
+import sys
+import tempfile
+import zlib
+from collections import Counter, deque
 from io import RawIOBase
-from typing import AsyncIterable, cast, Any
-from zipfile import ZipFile, ZipInfo
+from typing import IO, Any, AsyncIterable, AsyncIterator, Callable, Iterable, cast
 
-import httpx
 from typing_extensions import Self
 
 from fpx import exception
 from fpx.model import Ticket
-from fpx.types import Request
+from fpx.types import App, Request
 
-from . import transport
+from . import archive, cache, compression, transport
 
 log = logging.getLogger(__name__)
 
+COMMENT = b"Written by FPX"
+_DONE = object()
+
 
 class _Stream(RawIOBase):
+    """Write-only stream that accumulates data until `get` is called.
+
+    Written data is kept as a list of fragments and joined once per `get`
+    call, so buffering cost is linear in the size of the data. When only one
+    fragment is pending, it's returned as is, without copying.
+    """
+
     def __init__(self):
-        self._buffer = b""
+        self._chunks: list[bytes] = []
         self._size = 0
 
     def writable(self):
@@ -32,12 +48,22 @@ class _Stream(RawIOBase):
         if self.closed:
             msg = "Stream was closed!"
             raise ValueError(msg)
-        self._buffer += b
+
+        # mutable buffers can be reused by the writer, so they are copied
+        if not isinstance(b, bytes):
+            b = bytes(b)
+
+        if b:
+            self._chunks.append(b)
         return len(b)
 
     def get(self):
-        chunk = self._buffer
-        self._buffer = b""
+        chunks = self._chunks
+        if not chunks:
+            return b""
+
+        self._chunks = []
+        chunk = chunks[0] if len(chunks) == 1 else b"".join(chunks)
         self._size += len(chunk)
         return chunk
 
@@ -45,6 +71,350 @@ class _Stream(RawIOBase):
         return self._size
 
 
+async def _with_head(
+    content: AsyncIterable[bytes],
+    size: int,
+) -> AsyncIterable[bytes]:
+    """Merge small chunks at the beginning of content into one of `size` bytes."""
+    head: list[bytes] = []
+    buffered = 0
+    async for chunk in content:
+        if buffered >= size:
+            yield chunk
+            continue
+
+        head.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield b"".join(head)
+
+    if buffered < size and head:
+        yield b"".join(head)
+
+
+async def _exact_size(
+    content: AsyncIterable[bytes],
+    size: int,
+    name: str,
+) -> AsyncIterable[bytes]:
+    """Verify that content has expected size."""
+    total = 0
+    async for chunk in content:
+        total += len(chunk)
+        if total > size:
+            break
+        yield chunk
+
+    if total != size:
+        msg = f"{name} has {total} bytes instead of {size}"
+        log.error("Content size mismatch: %s", msg)
+        raise exception.SizeMismatchError({"size": msg})
+
+
+def _log_failure(err: Exception, name: str):
+    # httpx is imported only when its transport is used
+    httpx = sys.modules.get("httpx")
+    if isinstance(err, TimeoutError) or (
+        httpx and isinstance(err, httpx.TimeoutException)
+    ):
+        log.exception("TimeoutError while writing %s. Move to the next file", name)
+
+    elif httpx and isinstance(err, httpx.ReadError):
+        log.exception("Read error from file %s. Move to the next file", name)
+
+    else:
+        log.exception("Unexpected error from file %s. Move to the next file", name)
+
+
+class _Window(RawIOBase):
+    """Pass through only the inclusive range of bytes into the stream."""
+
+    def __init__(self, stream: _Stream, start: int, end: int):
+        self.stream = stream
+        self.start = start
+        self.end = end
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b: Any):
+        size = len(b)
+        first = max(self.start - self.position, 0)
+        last = min(self.end + 1 - self.position, size)
+        if first < last:
+            self.stream.write(b if (first, last) == (0, size) else b[first:last])
+
+        self.position += size
+        return size
+
+    def skip(self, size: int):
+        self.position += size
+
+
+class _Spool:
+    """Copy of the content, shared by duplicated items.
+
+    Content is kept in memory until it exceeds `max_size` or the memory
+    budget, and moved into temporary file afterwards. Copy is released when
+    every duplicate has read it.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        users: int,
+        budget: transport.MemoryBudget | None = None,
+    ):
+        self.users = users
+        self.done = asyncio.Event()
+        self.available: bool | None = None
+        self.complete = False
+        self.name = ""
+        self.content_type: str | None = None
+        self._file = transport.SpooledBuffer(max_size, budget)
+
+    async def write(self, data: bytes):
+        await self._file.write(data)
+
+    async def content(self) -> AsyncIterable[bytes]:
+        loop = asyncio.get_running_loop()
+        offset = 0
+        while chunk := await loop.run_in_executor(
+            None,
+            self._file.read,
+            offset,
+            transport.CHUNK_SIZE,
+        ):
+            offset += len(chunk)
+            yield chunk
+
+    def release(self):
+        self.users -= 1
+        if self.users <= 0:
+            self.close()
+
+    def close(self):
+        self._file.close()
+
+
+class _Prefetcher:
+    """Fetch upcoming items in background while the current one is consumed.
+
+    At most `window` items are downloaded simultaneously. Every item keeps up
+    to `buffer` chunks in memory, so slow consumer applies backpressure to
+    upstreams. Items are produced in the original order.
+
+    Buffered chunks draw from the memory budget of the worker. Item that is
+    consumed right now never waits for memory, while prefetched items wait
+    until memory is released.
+
+    Optional `ranges` contains byte range for every item, when only part of
+    the item is required.
+
+    Items with the same URL, headers and range are downloaded only once.
+    Content of the first item is copied into spool and duplicates are
+    produced from it. If the first item was not downloaded completely,
+    duplicate is downloaded from upstream.
+
+    Optional `on_received` is called with every downloaded item and details
+    of its response.
+    """
+
+    def __init__(
+        self,
+        request: Request,
+        items: Iterable[Any],
+        window: int,
+        buffer: int,
+        ranges: Iterable[tuple[int, int] | None] = (),
+        *,
+        on_received: Callable[[Any, transport.ItemInfo], None] | None = None,
+    ):
+        self.request = request
+        self.window = max(window, 1)
+        self.buffer = max(buffer, 1)
+        self.budget = transport.memory_budget(request.app)
+        self.on_received = on_received
+
+        items = list(items)
+        ranges = list(ranges)
+        ranges += [None] * (len(items) - len(ranges))
+        keys = [self._key(item, byte_range) for item, byte_range in zip(items, ranges)]
+        self._copies = Counter(keys)
+        self._items = iter(zip(items, ranges, keys))
+        self._spools: dict[str, _Spool] = {}
+        self._pending: deque[tuple[Any, asyncio.Queue[Any], asyncio.Task[None]]]
+        self._pending = deque()
+
+    def _key(self, item: Any, byte_range: tuple[int, int] | None) -> str:
+        details = transport.make_details(item)
+        return json.dumps([details.source_key(), byte_range])
+
+    def _schedule(self):
+        while len(self._pending) < self.window:
+            item, byte_range, key = next(self._items, (_DONE, None, ""))
+            if item is _DONE:
+                return
+
+            queue: asyncio.Queue[Any] = asyncio.Queue(self.buffer)
+            if spool := self._spools.get(key):
+                fetch = self._replay(item, byte_range, queue, spool)
+            elif self._copies[key] > 1:
+                spool = _Spool(
+                    self.request.app.config.FPX_DUPLICATE_BUFFER_SIZE,
+                    self._copies[key] - 1,
+                    self.budget,
+                )
+                self._spools[key] = spool
+                fetch = self._fetch(item, byte_range, queue, spool)
+            else:
+                fetch = self._fetch(item, byte_range, queue)
+
+            self._pending.append((item, queue, asyncio.ensure_future(fetch)))
+
+    async def _fetch(
+        self,
+        item: Any,
+        byte_range: tuple[int, int] | None,
+        queue: asyncio.Queue[Any],
+        spool: _Spool | None = None,
+    ):
+        try:
+            source = await transport.choose(self.request, item, byte_range)
+            async with source as tp:
+                if tp and source.received and self.on_received:
+                    self.on_received(item, source.received)
+
+                if spool:
+                    spool.available = tp is not None
+
+                await queue.put(tp)
+                if tp:
+                    if spool:
+                        _path, spool.name, _content, spool.content_type = tp
+
+                    async for chunk in tp[2]:
+                        if spool:
+                            await spool.write(chunk)
+                        await self._put(queue, chunk)
+
+                    if spool:
+                        spool.complete = True
+
+        except Exception as err:  # noqa: BLE001
+            await queue.put(err)
+
+        finally:
+            if spool:
+                spool.done.set()
+
+        await queue.put(_DONE)
+
+    async def _replay(
+        self,
+        item: Any,
+        byte_range: tuple[int, int] | None,
+        queue: asyncio.Queue[Any],
+        spool: _Spool,
+    ):
+        """Produce duplicated item from the copy of the first one."""
+        try:
+            await spool.done.wait()
+            if not spool.complete:
+                if spool.available is False:
+                    await queue.put(None)
+                    await queue.put(_DONE)
+                else:
+                    log.debug("Copy of %s is incomplete, download it", item)
+                    await self._fetch(item, byte_range, queue)
+                return
+
+            log.debug("Use local copy of %s", item)
+            details = transport.make_details(item)
+            await queue.put(
+                (details.path, details.name or spool.name, None, spool.content_type),
+            )
+            try:
+                async for chunk in spool.content():
+                    await self._put(queue, chunk)
+            except Exception as err:  # noqa: BLE001
+                await queue.put(err)
+
+            await queue.put(_DONE)
+
+        finally:
+            spool.release()
+
+    async def _put(self, queue: asyncio.Queue[Any], chunk: bytes):
+        await self.budget.acquire(len(chunk), queue)
+        try:
+            await queue.put(chunk)
+        except BaseException:
+            self.budget.release(len(chunk))
+            raise
+
+    def _drain(self, queue: asyncio.Queue[Any]):
+        """Drop chunks that will not be consumed and release their memory."""
+        while not queue.empty():
+            chunk = queue.get_nowait()
+            if isinstance(chunk, bytes):
+                self.budget.release(len(chunk))
+
+    async def _content(self, queue: asyncio.Queue[Any]) -> AsyncIterable[bytes]:
+        while True:
+            chunk = await queue.get()
+            if chunk is _DONE:
+                return
+
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            self.budget.release(len(chunk))
+            yield chunk
+
+    async def __aiter__(self) -> AsyncIterator[tuple[Any, Any]]:
+        """Produce pairs of item and transport details in the ticket order.
+
+        Transport details have the same format as the result of
+        `Transport.__aenter__`, but content is read from the local buffer.
+        """
+        self._schedule()
+        while self._pending:
+            item, queue, task = self._pending[0]
+            self.budget.prefer(queue)
+            tp = await queue.get()
+            if isinstance(tp, Exception):
+                raise tp
+
+            if tp:
+                path, name, _content, content_type = tp
+                yield item, (path, name, self._content(queue), content_type)
+            else:
+                yield item, None
+
+            # consumer is not interested in the rest of the item
+            if not task.done():
+                task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+            self._drain(queue)
+            self.budget.forget(queue)
+            self._pending.popleft()
+            self._schedule()
+
+    def close(self):
+        for _item, queue, task in self._pending:
+            task.cancel()
+            self._drain(queue)
+            self.budget.forget(queue)
+        self._pending.clear()
+
+        for spool in self._spools.values():
+            spool.close()
+
+
 class Pipe(abc.ABC):
     _content_type = "application/octet-stream"
     _filename = "download"
@@ -52,7 +422,19 @@ class Pipe(abc.ABC):
     @classmethod
     def choose(cls, ticket: Ticket, request: Request):
         if ticket.type == "zip":
-            pipe = ZipPipe(ticket, request)
+            archives = cache.archive_cache(request.app)
+            key = ZipPipe.cache_key(ticket, request.app)
+            if archives and key and (path := archives.get(key)):
+                log.debug("Serve ticket %s from cache %s", ticket.id, path)
+                pipe = CachedPipe(ticket, request, key)
+            else:
+                pipe = ZipPipe(ticket, request)
+        elif ticket.type == "tar":
+            pipe = TarPipe(ticket, request)
+        elif ticket.type == "tar.gz":
+            pipe = TarGzPipe(ticket, request)
+        elif ticket.type == "tar.zst" and compression.zstandard:
+            pipe = TarZstPipe(ticket, request)
         elif ticket.type == "stream":
             if request.app.config.FPX_PIPE_SILLY_STREAM:
                 pipe = SillyStreamPipe(ticket, request)
@@ -67,6 +449,10 @@ class Pipe(abc.ABC):
     def __init__(self, ticket: Ticket, request: Request):
         self.ticket = ticket
         self.request = request
+        self.budget = transport.memory_budget(request.app)
+
+        # stored probes of items, by source of the item
+        self._probed: dict[str, dict[str, Any]] | None = None
 
     async def __aenter__(self) -> Self:
         return self
@@ -74,12 +460,91 @@ class Pipe(abc.ABC):
     async def __aexit__(self, *args: Any):
         return
 
+    def prefetch(self) -> int:
+        """Number of items downloaded simultaneously."""
+        config = self.request.app.config
+        size = self.ticket.options.get("prefetch", config.FPX_ZIP_PREFETCH)
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            log.warning("Ignore invalid prefetch size: %s", size)
+            size = config.FPX_ZIP_PREFETCH
+
+        return min(max(size, 1), config.FPX_ZIP_PREFETCH_LIMIT)
+
+    async def probe(self) -> list[transport.ItemInfo | None]:
+        """Details of ticket items.
+
+        Details collected during generation of the ticket are used when
+        they are available.
+        """
+        items = list(self.ticket.items)
+        probes = self.ticket.probes
+        if probes is not None and len(probes) == len(items):
+            return [transport.ItemInfo.from_dict(p) if p else None for p in probes]
+
+        return await transport.probe_many(self.request, items, self.prefetch())
+
+    def verify_probe(self, item: Any, received: transport.ItemInfo):
+        """Forget stored probes when upstream reports different details.
+
+        Current download is not interrupted, but the next one probes items
+        again, so size and ETag of the output follow the changed item.
+        """
+        probes = self.ticket.probes
+        if not probes or len(probes) != len(self.ticket.items):
+            return
+
+        if self._probed is None:
+            self._probed = {
+                transport.make_details(stored).source_key(): probe
+                for stored, probe in zip(self.ticket.items, probes)
+                if probe
+            }
+
+        probe = self._probed.get(transport.make_details(item).source_key())
+        if not probe:
+            return
+
+        for name in ["size", "etag"]:
+            expected, actual = probe.get(name), getattr(received, name)
+            if expected is not None and actual is not None and expected != actual:
+                log.warning(
+                    "Stored %s of %s is outdated: %s instead of %s",
+                    name,
+                    item,
+                    expected,
+                    actual,
+                )
+                self.ticket.probes = None
+                return
+
     def content_type(self):
         return self._content_type
 
     def filename(self):
         return self._filename
 
+    def content_length(self) -> int | None:
+        """Size of the output, if it's known in advance."""
+        return None
+
+    def etag(self) -> str | None:
+        """Identifier of the output, if pipe supports byte ranges."""
+        return None
+
+    def select_range(self, start: int, end: int):
+        """Produce only inclusive range of bytes from the output."""
+        raise NotImplementedError
+
+    async def local_file(self) -> tuple[IO[bytes], int, int] | None:
+        """Opened local file and inclusive range of its bytes that make the output.
+
+        Such output can be sent without reading file by the application.
+        Caller closes the file.
+        """
+        return None
+
     @abc.abstractmethod
     async def chunks(self) -> AsyncIterable[bytes]:
         yield b""
@@ -95,66 +560,627 @@ class ZipPipe(Pipe):
         if name:
             self._filename = name
 
+        self._method, self._level = self.compression(self.ticket, self.request.app)
+
+        # pairs of ticket item and its details. Details are available only
+        # when sizes of all entries are known.
+        self._layout: list[tuple[Any, transport.ItemInfo | None]] = [
+            (item, None) for item in self.ticket.items
+        ]
+        self._sized = False
+        self._etag: str | None = None
+        self._range: tuple[int, int] | None = None
+        self._failures = 0
+        if self._method == archive.STORED and self.ticket.options.get(
+            "content_length",
+            self.request.app.config.FPX_ZIP_CONTENT_LENGTH,
+        ):
+            await self._plan()
+
         return self
 
+    @classmethod
+    def compression(cls, ticket: Ticket, app: App) -> tuple[int | None, int]:
+        """Compression method and level of archive entries.
+
+        Method is `None` when it's chosen for every entry individually.
+        """
+        config = app.config
+        name = ticket.options.get("compression", config.FPX_ZIP_COMPRESSION)
+        if name not in compression.methods:
+            log.warning("Ignore unknown compression method: %s", name)
+            name = config.FPX_ZIP_COMPRESSION
+
+        level = ticket.options.get(
+            "compression_level",
+            config.FPX_ZIP_COMPRESSION_LEVEL,
+        )
+        if not isinstance(level, int) or not 0 <= level <= 9:  # noqa: PLR2004
+            log.warning("Ignore invalid compression level: %s", level)
+            level = config.FPX_ZIP_COMPRESSION_LEVEL
+
+        return compression.methods[name], level
+
+    async def _plan(self):
+        """Collect sizes of all entries before streaming."""
+        items = list(self.ticket.items)
+        infos = await self.probe()
+
+        layout: list[tuple[Any, transport.ItemInfo | None]] = []
+        for item, info in zip(items, infos):
+            if info is None:
+                log.warning("Skip unavailable item %s", item)
+                self._failures += 1
+                continue
+
+            if info.size is None:
+                log.info("Size of %s is unknown, content length is not set", item)
+                return
+
+            layout.append((item, info))
+
+        self._layout = layout
+        self._sized = True
+
+        # validators of items change the archive even when sizes are the same
+        digest = hashlib.sha1(  # noqa: S324
+            json.dumps(
+                [
+                    self.ticket.id,
+                    self._date_time(),
+                    self._entries(),
+                    [info.etag for _item, info in layout],
+                ],
+            ).encode(),
+        )
+        self._etag = f'"{digest.hexdigest()}"'
+
+    def _entries(self) -> list[tuple[str, int]]:
+        """Names and sizes of entries in the sized archive."""
+        return [
+            (os.path.join(info.path, info.name), cast(int, info.size))
+            for _item, info in self._layout
+            if info
+        ]
+
+    def content_length(self) -> int | None:
+        if not self._sized:
+            return None
+
+        if self._range:
+            start, end = self._range
+            return end - start + 1
+
+        return archive.stored_archive_size(self._entries(), COMMENT)
+
+    def etag(self) -> str | None:
+        return self._etag
+
+    def select_range(self, start: int, end: int):
+        self._range = (start, end)
+
+    def _date_time(self) -> archive.DateTime:
+        # entries share the same timestamp, so the archive is reproducible
+        return cast(archive.DateTime, self.ticket.created_at.timetuple()[:6])
+
+    def _known_checksums(self) -> dict[str, int]:
+        """Checksums of entries computed by previous downloads."""
+        checksums = self.ticket.checksums or {}
+        if checksums.get("etag") != self.etag():
+            return {}
+
+        return checksums.get("crc", {})
+
+    def _remember_checksums(self, checksums: dict[str, int]):
+        # JSON column must be reassigned to be saved
+        self.ticket.checksums = {"etag": self.etag(), "crc": checksums}
+
+    def _start_entry(
+        self,
+        writer: archive.ZipWriter,
+        name: str,
+        content_type: str | None,
+        sample: bytes,
+    ) -> tuple[archive.Entry, compression.Compressor]:
+        method = self._method
+        if method is None:
+            method = compression.choose_method(content_type, name, sample)
+
+        compressor = compression.make_compressor(self.request.app, method, self._level)
+        entry = writer.start(name, self._date_time(), compressor.method)
+        return entry, compressor
+
+    @classmethod
+    def cache_key(cls, ticket: Ticket, app: App) -> str | None:
+        """Key of the archive in cache, if archive can be cached.
+
+        Options that do not affect the content of the archive are ignored.
+        Compression is resolved against config, so archives built with
+        different defaults do not share the key.
+        """
+        options = dict(ticket.options)
+        if not options.pop("cache", True):
+            return None
+
+        for name in ["filename", "prefetch"]:
+            options.pop(name, None)
+
+        method, level = cls.compression(ticket, app)
+        options["compression"] = method
+        options["compression_level"] = None if method == archive.STORED else level
+
+        return cache.make_key(ticket.type, ticket.items, options)
+
     async def chunks(self) -> AsyncIterable[bytes]:
-        stream = cast(Any, _Stream())
-        with ZipFile(stream, mode="w") as zf:
-            for item in self.ticket.items:
-                async with transport.choose(self.request, item) as tp:
+        if self._sized:
+            output = self._sized_chunks()
+        else:
+            output = self._streamed_chunks()
+
+        archives = cache.archive_cache(self.request.app)
+        key = self.cache_key(self.ticket, self.request.app)
+        if archives and key and not self._range:
+            # incomplete archive is not cached. ETag is kept, so cached
+            # archive is a valid continuation of the interrupted download
+            output = archives.store(
+                key,
+                output,
+                lambda: not self._failures,
+                json.dumps({"etag": self.etag()}).encode() + b"\n",
+            )
+
+        async for chunk in output:
+            yield chunk
+
+    def _plan_range(self, start: int, end: int) -> list[tuple[int, int] | None | bool]:
+        """Decide which part of every entry must be downloaded.
+
+        Result contains `False` for entries that can be skipped, `None` for
+        entries downloaded completely and a byte range for partial entries.
+
+        Content is required when it overlaps with the range. Checksum is
+        required when data descriptor or central directory overlaps with the
+        range. Unknown checksum can be computed only from the whole content.
+        """
+        checksums = self._known_checksums()
+        entries = self._entries()
+        central = sum(archive.stored_entry_size(name, size) for name, size in entries)
+
+        plan: list[tuple[int, int] | None | bool] = []
+        offset = 0
+        for idx, (name, size) in enumerate(entries):
+            data = offset + archive.entry_header_size(name)
+            offset += archive.stored_entry_size(name, size)
+
+            needs_data = size > 0 and data <= end and data + size > start
+            needs_crc = (data + size <= end and offset > start) or central <= end
+            known = size == 0 or str(idx) in checksums
+            first = max(start, data) - data
+            last = min(end, data + size - 1) - data
+
+            if not needs_data and (known or not needs_crc):
+                plan.append(False)
+            elif not known or (first, last) == (0, size - 1):
+                # checksum is recomputed whenever the whole content is sent
+                plan.append(None)
+            else:
+                plan.append((first, last))
+
+        return plan
+
+    async def _sized_chunks(self) -> AsyncIterable[bytes]:
+        """Produce content of the archive with the known layout.
+
+        When range is selected, only the required parts of entries are
+        downloaded.
+        """
+        start, end = self._range or (0, cast(int, self.content_length()) - 1)
+        stream = _Stream()
+        writer = archive.ZipWriter(_Window(stream, start, end))
+        checksums = dict(self._known_checksums())
+
+        plan = self._plan_range(start, end)
+        required = [
+            (item, part)
+            for (item, _info), part in zip(self._layout, plan)
+            if part is not False
+        ]
+        prefetcher = _Prefetcher(
+            self.request,
+            [item for item, _part in required],
+            self.prefetch(),
+            self.request.app.config.FPX_ZIP_PREFETCH_BUFFER,
+            [cast("tuple[int, int] | None", part) for _item, part in required],
+            on_received=self.verify_probe,
+        )
+        fetched = prefetcher.__aiter__()
+
+        try:
+            for idx, ((name, size), part) in enumerate(zip(self._entries(), plan)):
+                if writer.offset > end:
+                    break
+
+                entry = writer.start(name, self._date_time(), archive.STORED)
+                crc = checksums.get(str(idx), 0)
+                if part is False:
+                    writer.skip(size)
+                else:
+                    item, tp = await fetched.__anext__()
                     if not tp:
-                        log.warning("Skip item %s", item)
-                        continue
-                    path, name, content, _resp = tp
+                        raise exception.UrlNotAvailableError({"url": item})
 
-                    entry = os.path.join(path, name)
-                    log.debug("Add entry to ZIP archive: %s", entry)
-                    z_info = ZipInfo(entry, time.gmtime()[:6])
-                    with zf.open(z_info, mode="w", force_zip64=True) as dest:
-                        try:
-                            total = 0
-                            async for chunk in content:
-                                dest.write(chunk)
-                                total += len(chunk)
-                                log.debug(
-                                    "+Chunk. %sMB(%sKB) of %s are added to the archive",
-                                    total // 1024 // 1024,
-                                    total // 1024,
-                                    name,
-                                )
-                                yield stream.get()
-
-                        except (TimeoutError, httpx.TimeoutException):
-                            log.exception(
-                                "TimeoutError while writing %s. Move to the next file",
-                                z_info,
-                            )
+                    content = tp[2]
+                    if part is None:
+                        log.debug("Add entry to ZIP archive: %s", name)
+                        crc = 0
+                        async for chunk in _exact_size(content, size, name):
+                            crc = zlib.crc32(chunk, crc)
+                            writer.write(chunk)
+                            if output := stream.get():
+                                yield output
 
-                        except httpx.ReadError:
-                            log.exception(
-                                "Read error from file %s. Move to the next file",
-                                name,
-                            )
+                        checksums[str(idx)] = crc
+
+                    else:
+                        first, last = cast("tuple[int, int]", part)
+                        log.debug("Add %s-%s bytes of %s", first, last, name)
+                        writer.skip(first)
+                        async for chunk in _exact_size(content, last - first + 1, name):
+                            writer.write(chunk)
+                            if output := stream.get():
+                                yield output
+                        writer.skip(size - last - 1)
+
+                writer.finish(entry, crc, size)
 
-                        except Exception:
-                            log.exception(
-                                "Unexpected error from file %s. Move to the next file",
-                                name,
+            else:
+                writer.close(COMMENT)
+
+            yield stream.get()
+        finally:
+            prefetcher.close()
+            # checksums are saved once, even when the client is gone
+            self._remember_checksums(checksums)
+
+    async def _streamed_chunks(self) -> AsyncIterable[bytes]:
+        stream = _Stream()
+        writer = archive.ZipWriter(stream)
+        prefetcher = _Prefetcher(
+            self.request,
+            self.ticket.items,
+            self.prefetch(),
+            self.request.app.config.FPX_ZIP_PREFETCH_BUFFER,
+        )
+        try:
+            async for item, tp in prefetcher:
+                if not tp:
+                    log.warning("Skip item %s", item)
+                    self._failures += 1
+                    continue
+                path, name, content, content_type = tp
+
+                entry_name = os.path.join(path, name)
+                log.debug("Add entry to ZIP archive: %s", entry_name)
+                if self._method is None:
+                    content = _with_head(content, compression.SAMPLE_SIZE)
+
+                # entry is started on the first chunk, because compression
+                # method may depend on content
+                entry = compressor = None
+                total = 0
+                crc = 0
+                try:
+                    async for chunk in content:
+                        if entry is None:
+                            entry, compressor = self._start_entry(
+                                writer,
+                                entry_name,
+                                content_type,
+                                chunk,
                             )
 
-            zf.comment = b"Written by FPX"
-        yield stream.get()
+                        crc = zlib.crc32(chunk, crc)
+                        total += len(chunk)
+                        writer.write(await compressor.compress(chunk))
+                        log.debug(
+                            "+Chunk. %sMB(%sKB) of %s are added to the archive",
+                            total // 1024 // 1024,
+                            total // 1024,
+                            name,
+                        )
+                        if output := stream.get():
+                            yield output
+
+                except Exception as err:  # noqa: BLE001
+                    _log_failure(err, entry_name)
+                    self._failures += 1
+
+                if entry is None or compressor is None:
+                    entry, compressor = self._start_entry(
+                        writer,
+                        entry_name,
+                        content_type,
+                        b"",
+                    )
+
+                writer.write(await compressor.flush())
+                writer.finish(entry, crc, total)
+
+            writer.close(COMMENT)
+            yield stream.get()
+        finally:
+            prefetcher.close()
+
+
+class CachedPipe(Pipe):
+    """Serve previously generated archive from cache."""
+
+    _content_type = "application/zip"
+    _filename = "collection.zip"
+
+    def __init__(self, ticket: Ticket, request: Request, key: str):
+        super().__init__(ticket, request)
+        self.key = key
+        self._range: tuple[int, int] | None = None
+
+    async def __aenter__(self):
+        name = self.ticket.options.get("filename")
+        if name:
+            self._filename = name
+
+        archives = cast(cache.DiskCache, cache.archive_cache(self.request.app))
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, archives.open, self.key)
+        if cached is None:
+            raise exception.NotFoundError({"id": "Cached archive is removed"})
+
+        self._cached = cached
+        return self
+
+    async def __aexit__(self, *args: Any):
+        await self._cached.close()
+
+    def content_length(self) -> int | None:
+        if self._range:
+            start, end = self._range
+            return end - start + 1
+
+        return self._cached.size
+
+    def etag(self) -> str | None:
+        # archive streamed without ETag is identified by the cache key
+        return self._cached.headers.get("etag") or f'"{self.key}"'
+
+    def select_range(self, start: int, end: int):
+        self._range = (start, end)
+
+    async def chunks(self) -> AsyncIterable[bytes]:
+        async for chunk in self._cached.content(self._range):
+            yield chunk
+
+
+class TarPipe(Pipe):
+    """Stream items as TAR archive.
+
+    TAR header contains size of the entry, so sizes of items are requested
+    before streaming. Item with unknown size is downloaded into temporary
+    file before it's added to the archive.
+    """
+
+    _content_type = "application/x-tar"
+    _filename = "collection.tar"
+
+    async def __aenter__(self):
+        name = self.ticket.options.get("filename")
+        if name:
+            self._filename = name
+
+        return self
+
+    def compressor(self) -> compression.Compressor:
+        """Compressor applied to the whole archive."""
+        return compression.Compressor()
+
+    def level(self, default: int, limit: int) -> int:
+        level = self.ticket.options.get("compression_level", default)
+        if not isinstance(level, int) or not 0 <= level <= limit:
+            log.warning("Ignore invalid compression level: %s", level)
+            level = default
 
+        return level
+
+    def _mtime(self) -> int:
+        return calendar.timegm(self.ticket.created_at.utctimetuple())
+
+    async def _entries(self) -> AsyncIterable[bytes]:
+        """Produce uncompressed content of the archive."""
+        items = list(self.ticket.items)
+        infos = iter(await self.probe())
+        prefetcher = _Prefetcher(
+            self.request,
+            items,
+            self.prefetch(),
+            self.request.app.config.FPX_ZIP_PREFETCH_BUFFER,
+            on_received=self.verify_probe,
+        )
+        try:
+            async for item, tp in prefetcher:
+                info = next(infos)
+                if not tp:
+                    log.warning("Skip item %s", item)
+                    continue
+                path, name, content, _content_type = tp
+
+                entry_name = os.path.join(path, name)
+                log.debug("Add entry to TAR archive: %s", entry_name)
+                if info and info.size is not None:
+                    size = info.size
+                    yield archive.tar_header(entry_name, size, self._mtime())
+                    async for chunk in _exact_size(content, size, entry_name):
+                        yield chunk
+
+                else:
+                    with tempfile.TemporaryFile() as dest:
+                        try:
+                            size = await self._spool(content, dest)
+                        except Exception as err:  # noqa: BLE001
+                            _log_failure(err, entry_name)
+                            continue
+
+                        yield archive.tar_header(entry_name, size, self._mtime())
+                        async for chunk in cache.read(dest.fileno(), 0, size - 1):
+                            yield chunk
+
+                yield archive.tar_padding(size)
+
+            yield archive.TAR_END
+        finally:
+            prefetcher.close()
+
+    async def _spool(self, content: AsyncIterable[bytes], dest: Any) -> int:
+        """Save content into file and return its size."""
+        loop = asyncio.get_running_loop()
+        size = 0
+        async for chunk in content:
+            await loop.run_in_executor(None, dest.write, chunk)
+            size += len(chunk)
+
+        await loop.run_in_executor(None, dest.flush)
+        return size
+
+    async def chunks(self) -> AsyncIterable[bytes]:
+        compressor = self.compressor()
+        async for chunk in self._entries():
+            if output := await compressor.compress(chunk):
+                yield output
+
+        yield await compressor.flush()
+
+
+class TarGzPipe(TarPipe):
+    _content_type = "application/gzip"
+    _filename = "collection.tar.gz"
+
+    def compressor(self) -> compression.Compressor:
+        app = self.request.app
+        return compression.make_gzip_compressor(
+            app,
+            self.level(app.config.FPX_TAR_GZIP_LEVEL, 9),
+        )
+
+
+class TarZstPipe(TarPipe):
+    _content_type = "application/zstd"
+    _filename = "collection.tar.zst"
+
+    def compressor(self) -> compression.Compressor:
+        app = self.request.app
+        return compression.make_zstd_compressor(
+            app,
+            self.level(app.config.FPX_TAR_ZSTD_LEVEL, 22),
+        )
+
+
+class BaseStreamPipe(Pipe):
+    """Stream content of the single item.
+
+    Size and ETag of the content are taken from the upstream response, so
+    client can request a range of bytes. Range is fetched from upstream or,
+    if upstream ignores ranges, cut from the whole content.
+    """
 
-class SillyStreamPipe(Pipe):
     def __init__(self, ticket: Ticket, request: Request):
         super().__init__(ticket, request)
         self._content_type = None
         self._filename = None
+        self._info: transport.ItemInfo | None = None
+        self._range: tuple[int, int] | None = None
+
+    def _wanted(self) -> tuple[int, int] | None:
+        """Inclusive range of bytes sent to the client, if size is known."""
+        if not self._info or self._info.size is None:
+            return None
+
+        return self._range or (0, self._info.size - 1)
+
+    def content_length(self) -> int | None:
+        if wanted := self._wanted():
+            start, end = wanted
+            return end - start + 1
+
+        return None
+
+    def etag(self) -> str | None:
+        etag = self._info and self._info.etag
+        # weak validators cannot be used for ranges
+        if etag and not etag.startswith("W/"):
+            return etag
+
+        return None
+
+    def select_range(self, start: int, end: int):
+        self._range = (start, end)
 
+    async def local_file(self) -> tuple[IO[bytes], int, int] | None:
+        items = list(self.ticket.items)
+        wanted = self._wanted()
+        if len(items) != 1 or not wanted or not self._info:
+            return None
+
+        details = transport.make_details(items[0])
+        if details.url_type is not transport.UrlType.File:
+            return None
+
+        source = transport.FileTransport(
+            details,
+            self.request.app.config.FPX_FILE_ROOTS,
+        )
+        loop = asyncio.get_running_loop()
+        fileobj, info = await loop.run_in_executor(
+            None,
+            source.open_with_info,
+            details.url,
+        )
+        # file is opened again, so it must be the same file that was probed
+        if info.etag != self._info.etag:
+            log.debug("%s changed after probe, read it as usual", fileobj.name)
+            await loop.run_in_executor(None, fileobj.close)
+            return None
+
+        return (fileobj, *wanted)
+
+    async def _fetch(self, item: Any) -> AsyncIterable[bytes]:
+        """Download selected range or the whole content from upstream."""
+        source = await transport.choose(self.request, item, self._range)
+        async with source as tp:
+            if not tp:
+                raise exception.UrlNotAvailableError({"url": item})
+
+            # parts of different versions must not be mixed
+            received = source.received
+            etag = self.etag()
+            if self._range and etag and (not received or received.etag != etag):
+                msg = f"{self._filename} was modified"
+                log.error("Content changed during download: %s", msg)
+                raise exception.TransportError({"etag": msg})
+
+            async for chunk in tp[2]:
+                yield chunk
+
+    def _exact(self, content: AsyncIterable[bytes]) -> AsyncIterable[bytes]:
+        """Make sure that content matches Content-Length of the response."""
+        length = self.content_length()
+        if length is None:
+            return content
+
+        return _exact_size(content, length, self._filename or "content")
+
+
+class SillyStreamPipe(BaseStreamPipe):
     async def __aenter__(self):
         for item in self.ticket.items:
-            async with transport.choose(self.request, item) as tp:
+            source = await transport.choose(self.request, item)
+            async with source as tp:
                 if not tp:
                     log.warning("Skip item %s", item)
                     continue
@@ -163,25 +1189,25 @@ class SillyStreamPipe(Pipe):
 
                 self._filename = name
                 self._content_type = content_type
+                self._info = source.received
                 break
         return self
 
     async def chunks(self) -> AsyncIterable[bytes]:
         for item in self.ticket.items:
-            async with transport.choose(self.request, item) as tp:
-                if not tp:
-                    log.warning("Skip item %s", item)
-                    continue
-                _path, _name, content, _resp = tp
-                async for chunk in content:
+            try:
+                async for chunk in self._exact(self._fetch(item)):
                     yield chunk
+            except exception.UrlNotAvailableError:
+                log.warning("Skip item %s", item)
+                continue
 
 
-class StreamPipe(Pipe):
+class StreamPipe(BaseStreamPipe):
     def __init__(self, ticket: Ticket, request: Request):
         super().__init__(ticket, request)
-        self._content_type = None
-        self._filename = None
+        self._item: Any = None
+        self._content: AsyncIterable[bytes] | None = None
 
     async def __aenter__(self):
         self._gen = self._crawl_file()
@@ -196,20 +1222,76 @@ class StreamPipe(Pipe):
         async for _ in self._gen:
             pass
 
+    def _with_client_range(self, item: Any) -> Any:
+        """Forward single range requested by the client to upstream."""
+        header = self.request.headers.get("range", "")
+        if not header.startswith("bytes=") or "," in header:
+            return item
+
+        headers = {"range": header}
+        if if_range := self.request.headers.get("if-range"):
+            headers["if-range"] = if_range
+
+        if isinstance(item, str):
+            return {"url": item, "headers": headers}
+
+        return dict(item, headers=dict(item.get("headers") or {}, **headers))
+
     async def chunks(self) -> AsyncIterable[bytes]:
-        async for chunk in self._content:
+        content = self._content
+        if content is None:
+            return
+
+        info = self._info
+        wanted = self._wanted()
+        if info and wanted:
+            start, end = wanted
+            first, last = info.byte_range or (0, cast(int, info.size) - 1)
+            if first <= start and end <= last:
+                if (start, end) != (first, last):
+                    log.debug("Cut %s-%s bytes of %s", start, end, self._filename)
+                    content = transport.slice_content(
+                        content,
+                        start - first,
+                        end - first,
+                    )
+            else:
+                log.debug("Upstream sent %s-%s bytes, refetch", first, last)
+                content = self._refetch()
+
+            content = self._exact(content)
+
+        elif info and info.byte_range:
+            # size is unknown, so only the whole content can be sent
+            content = self._refetch()
+
+        async for chunk in content:
             yield cast(bytes, chunk)
 
+    async def _refetch(self) -> AsyncIterable[bytes]:
+        # the first response holds connection slot, that may be required by
+        # the next request
+        await self._gen.aclose()
+        async for chunk in self._fetch(self._item):
+            yield chunk
+
     async def _crawl_file(self):
         for item in self.ticket.items:
-            async with transport.choose(self.request, item) as tp:
-                if not tp:
-                    log.warning("Skip item %s", item)
-                    continue
-                _path, name, content, content_type = tp
+            forwarded = self._with_client_range(item)
+            candidates = [item] if forwarded is item else [forwarded, item]
+            for candidate in candidates:
+                source = await transport.choose(self.request, candidate)
+                async with source as tp:
+                    if not tp:
+                        log.warning("Skip item %s", candidate)
+                        continue
+                    _path, name, content, content_type = tp
+                    self._item = item
+                    self._info = source.received
 
-                async def crawler(content: Any = content):
-                    async for chunk in content:
-                        yield chunk
+                    async def crawler(content: Any = content):
+                        async for chunk in content:
+                            yield chunk
 
-                yield name, content_type, crawler
+                    yield name, content_type, crawler
+                break
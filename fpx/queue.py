@@ -0,0 +1,595 @@
+"""Queue of tickets waiting for download slots.
+
+Number of simultaneous downloads is limited by `SIMULTANEOURS_DOWNLOADS_LIMIT`.
+Ticket waits in the queue until a slot is free, takes the slot and holds it
+while its content is downloaded. Every waiting ticket and every slot has a
+lease, renewed by the worker that serves the ticket. When worker crashes,
+its leases expire and other tickets move forward.
+
+Backends differ in the scope of the queue: `memory` serves a single worker,
+`shared` serves all workers of the host and `database` serves all workers
+that use the same database.
+
+"""
+from __future__ import annotations
+
+import abc
+import asyncio
+import contextlib
+import ctypes
+import importlib
+import logging
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from fpx import utils
+from fpx.exception import ConfigError
+from fpx.model import QueueSlot, QueueWaiter
+from fpx.types import App
+
+log = logging.getLogger(__name__)
+
+# backends shipped with FPX. Other backends are specified as `module:attribute`
+backends = {
+    "memory": "fpx.queue:MemoryQueue",
+    "shared": "fpx.queue:SharedMemoryQueue",
+    "database": "fpx.queue:DatabaseQueue",
+}
+
+
+class DownloadQueue(abc.ABC):
+    """Waiting tickets and download slots.
+
+    Position of the ticket is the number of tickets ahead of it minus the
+    number of free slots, so negative position means that the ticket can
+    take a slot. Ticket that is not waiting is placed after the last one.
+    """
+
+    @classmethod
+    def create(cls, app: App) -> DownloadQueue:
+        """Queue of the worker."""
+        config = app.config
+        return cls(config.SIMULTANEOURS_DOWNLOADS_LIMIT, config.FPX_QUEUE_LEASE)
+
+    def __init__(self, limit: int, lease: float):
+        self.limit = limit
+
+        # number of seconds waiting ticket or slot is kept without renewal
+        self.lease = lease
+
+    @abc.abstractmethod
+    async def join(self, id: str) -> bool:
+        """Add ticket to the end of the queue, unless it's already waiting."""
+
+    @abc.abstractmethod
+    async def leave(self, id: str):
+        """Remove ticket from the queue."""
+
+    @abc.abstractmethod
+    async def position(self, id: str) -> int:
+        """Position of the ticket."""
+
+    @abc.abstractmethod
+    async def acquire(self, id: str) -> bool:
+        """Take a free slot, if it's the turn of the ticket.
+
+        Ticket leaves the queue when it takes a slot. Ticket that already
+        holds a slot keeps it.
+        """
+
+    @abc.abstractmethod
+    async def start(self, id: str):
+        """Take a slot for the download of the ticket, if any slot is free.
+
+        Downloads are never blocked, so download that does not fit into the
+        limit goes on without a slot.
+        """
+
+    @abc.abstractmethod
+    async def release(self, id: str):
+        """Free the slot of the ticket."""
+
+    @abc.abstractmethod
+    async def renew(self, id: str):
+        """Extend leases of the ticket."""
+
+    async def positions(self, ids: Iterable[str]) -> dict[str, int]:
+        """Positions of multiple tickets."""
+        return {id: await self.position(id) for id in ids}
+
+    async def renew_many(self, ids: Iterable[str]):
+        """Extend leases of multiple tickets."""
+        for id in ids:
+            await self.renew(id)
+
+
+class MemoryQueue(DownloadQueue):
+    """Queue of the current worker."""
+
+    def __init__(self, limit: int, lease: float):
+        super().__init__(limit, lease)
+
+        # tickets mapped to expiration time of their leases. Waiting tickets
+        # are kept in order of arrival
+        self.waiting: dict[str, float] = {}
+        self.slots: dict[str, float] = {}
+
+        # number of tickets ahead of every waiting ticket. Rebuilt on demand
+        # after the order of waiting tickets changes
+        self._index: dict[str, int] | None = None
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator[None]:
+        """Context of the operation that reads or changes the queue."""
+        self._expire()
+        yield
+
+    def _expire(self):
+        now = time.time()
+        for entries in (self.waiting, self.slots):
+            for id in [id for id, expires in entries.items() if expires < now]:
+                log.warning("Lease of %s in download queue expired", id)
+                del entries[id]
+                self._index = None
+
+    def _position(self, id: str) -> int:
+        if self._index is None:
+            self._index = {id: idx for idx, id in enumerate(self.waiting)}
+
+        ahead = self._index.get(id, len(self.waiting))
+        return ahead + len(self.slots) - self.limit
+
+    def _unqueue(self, id: str):
+        if self.waiting.pop(id, None) is not None:
+            self._index = None
+
+    async def join(self, id: str) -> bool:
+        with self.locked():
+            if id in self.waiting:
+                return False
+
+            # new ticket goes to the end, so existing index remains valid
+            if self._index is not None:
+                self._index[id] = len(self.waiting)
+            self.waiting[id] = time.time() + self.lease
+            return True
+
+    async def leave(self, id: str):
+        with self.locked():
+            self._unqueue(id)
+
+    async def position(self, id: str) -> int:
+        with self.locked():
+            return self._position(id)
+
+    async def positions(self, ids: Iterable[str]) -> dict[str, int]:
+        with self.locked():
+            return {id: self._position(id) for id in ids}
+
+    async def acquire(self, id: str) -> bool:
+        with self.locked():
+            if id not in self.slots and self._position(id) >= 0:
+                return False
+
+            self._unqueue(id)
+            self.slots[id] = time.time() + self.lease
+            return True
+
+    async def start(self, id: str):
+        with self.locked():
+            if id in self.slots or len(self.slots) < self.limit:
+                self.slots[id] = time.time() + self.lease
+            else:
+                log.debug("No free download slot for %s", id)
+
+    async def release(self, id: str):
+        with self.locked():
+            self.slots.pop(id, None)
+
+    async def renew(self, id: str):
+        await self.renew_many([id])
+
+    async def renew_many(self, ids: Iterable[str]):
+        with self.locked():
+            expires = time.time() + self.lease
+            for id in ids:
+                for entries in (self.waiting, self.slots):
+                    if id in entries:
+                        entries[id] = expires
+
+
+class _Entry(ctypes.Structure):
+    _fields_ = [
+        ("ticket", ctypes.c_char * 64),
+        ("kind", ctypes.c_byte),
+        ("expires", ctypes.c_double),
+    ]
+
+
+_EMPTY = 0
+_WAITING = 1
+_SLOT = 2
+
+
+class SharedMemoryQueue(MemoryQueue):
+    """Queue shared by workers of the same host.
+
+    Entries live in shared memory, allocated by the main process. They are
+    copied into the worker under the lock for every operation, so time of
+    the operation is proportional to the number of entries. When there are
+    more than `FPX_QUEUE_CAPACITY` entries, the last waiting tickets are
+    dropped.
+    """
+
+    @classmethod
+    def create(cls, app: App) -> DownloadQueue:
+        config = app.config
+
+        # single-process server has no shared context
+        entries = getattr(app.shared_ctx, "fpx_download_queue", None)
+        if entries is None:
+            entries = cls.allocate(config.FPX_QUEUE_CAPACITY)
+
+        return cls(
+            config.SIMULTANEOURS_DOWNLOADS_LIMIT,
+            config.FPX_QUEUE_LEASE,
+            entries,
+        )
+
+    @staticmethod
+    def allocate(capacity: int) -> Any:
+        return multiprocessing.Array(_Entry, capacity)
+
+    def __init__(self, limit: int, lease: float, entries: Any):
+        super().__init__(limit, lease)
+        self.entries = entries
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator[None]:
+        with self.entries.get_lock():
+            self._load()
+            self._expire()
+            yield
+            self._store()
+
+    def _load(self):
+        self.waiting = {}
+        self.slots = {}
+        self._index = None
+        for entry in self.entries.get_obj():
+            if entry.kind == _WAITING:
+                self.waiting[entry.ticket.decode()] = entry.expires
+            elif entry.kind == _SLOT:
+                self.slots[entry.ticket.decode()] = entry.expires
+
+    def _store(self):
+        stored = [(id, _SLOT, expires) for id, expires in self.slots.items()]
+        stored += [(id, _WAITING, expires) for id, expires in self.waiting.items()]
+        entries = self.entries.get_obj()
+        if len(stored) > len(entries):
+            log.error(
+                "Download queue is full, %s tickets are dropped",
+                len(stored) - len(entries),
+            )
+
+        for idx, entry in enumerate(entries):
+            if idx < len(stored):
+                id, entry.kind, entry.expires = stored[idx]
+                entry.ticket = id.encode()
+            else:
+                entry.kind = _EMPTY
+
+
+class DatabaseQueue(DownloadQueue):
+    """Queue shared by all workers that use the same database.
+
+    Slot is a row with unique number below the limit. Slot is taken by
+    insertion of such row, so only one of the competing workers succeeds.
+    """
+
+    @classmethod
+    def create(cls, app: App) -> DownloadQueue:
+        config = app.config
+        return cls(
+            config.SIMULTANEOURS_DOWNLOADS_LIMIT,
+            config.FPX_QUEUE_LEASE,
+            app.ctx.sessionmaker.session_factory,
+        )
+
+    def __init__(self, limit: int, lease: float, sessions: Callable[[], Session]):
+        super().__init__(limit, lease)
+
+        # sessions are independent from the session of the request, so
+        # changes of the queue are committed immediately
+        self.sessions = sessions
+
+    def _expires(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease)
+
+    def _expire(self, db: Session):
+        now = datetime.utcnow()
+        db.execute(delete(QueueWaiter).where(QueueWaiter.expires_at < now))
+        db.execute(delete(QueueSlot).where(QueueSlot.expires_at < now))
+        db.commit()
+
+    def _position(self, db: Session, id: str) -> int:
+        ahead = select(func.count()).select_from(QueueWaiter)
+        if waiter := db.get(QueueWaiter, id):
+            ahead = ahead.where(
+                or_(
+                    QueueWaiter.joined_at < waiter.joined_at,
+                    and_(
+                        QueueWaiter.joined_at == waiter.joined_at,
+                        QueueWaiter.ticket_id < id,
+                    ),
+                ),
+            )
+
+        busy = select(func.count()).select_from(QueueSlot)
+        return (db.scalar(ahead) or 0) + (db.scalar(busy) or 0) - self.limit
+
+    def _renew_slot(self, db: Session, id: str) -> bool:
+        result = db.execute(
+            update(QueueSlot)
+            .where(QueueSlot.ticket_id == id)
+            .values(expires_at=self._expires()),
+        )
+        db.commit()
+        return bool(result.rowcount)  # type: ignore
+
+    def _take_slot(self, db: Session, id: str) -> bool:
+        busy = set(db.scalars(select(QueueSlot.number)))
+        for number in range(self.limit):
+            if number in busy:
+                continue
+
+            db.add(QueueSlot(number=number, ticket_id=id, expires_at=self._expires()))
+            try:
+                db.commit()
+            except IntegrityError:
+                # slot was taken by another worker in the meantime
+                db.rollback()
+            else:
+                return True
+
+        return False
+
+    async def join(self, id: str) -> bool:
+        with self.sessions() as db:
+            self._expire(db)
+            db.add(
+                QueueWaiter(
+                    ticket_id=id,
+                    joined_at=datetime.utcnow(),
+                    expires_at=self._expires(),
+                ),
+            )
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                return False
+
+        return True
+
+    async def leave(self, id: str):
+        with self.sessions() as db:
+            db.execute(delete(QueueWaiter).where(QueueWaiter.ticket_id == id))
+            db.commit()
+
+    async def position(self, id: str) -> int:
+        with self.sessions() as db:
+            self._expire(db)
+            return self._position(db, id)
+
+    async def positions(self, ids: Iterable[str]) -> dict[str, int]:
+        with self.sessions() as db:
+            self._expire(db)
+            busy = db.scalar(select(func.count()).select_from(QueueSlot)) or 0
+            order = db.scalars(
+                select(QueueWaiter.ticket_id).order_by(
+                    QueueWaiter.joined_at,
+                    QueueWaiter.ticket_id,
+                ),
+            )
+            index = {id: idx for idx, id in enumerate(order)}
+
+        return {id: index.get(id, len(index)) + busy - self.limit for id in ids}
+
+    async def acquire(self, id: str) -> bool:
+        with self.sessions() as db:
+            self._expire(db)
+            if self._renew_slot(db, id):
+                return True
+
+            if self._position(db, id) >= 0 or not self._take_slot(db, id):
+                return False
+
+            db.execute(delete(QueueWaiter).where(QueueWaiter.ticket_id == id))
+            db.commit()
+            return True
+
+    async def start(self, id: str):
+        with self.sessions() as db:
+            self._expire(db)
+            if not self._renew_slot(db, id) and not self._take_slot(db, id):
+                log.debug("No free download slot for %s", id)
+
+    async def release(self, id: str):
+        with self.sessions() as db:
+            db.execute(delete(QueueSlot).where(QueueSlot.ticket_id == id))
+            db.commit()
+
+    async def renew(self, id: str):
+        await self.renew_many([id])
+
+    async def renew_many(self, ids: Iterable[str]):
+        ids = list(ids)
+        with self.sessions() as db:
+            expires = self._expires()
+            for model in (QueueWaiter, QueueSlot):
+                db.execute(
+                    update(model)
+                    .where(model.ticket_id.in_(ids))
+                    .values(expires_at=expires),
+                )
+            db.commit()
+
+
+def download_queue(app: App) -> DownloadQueue:
+    """Download queue of the current worker."""
+    if app.ctx.download_queue is None:
+        name = app.config.FPX_QUEUE_BACKEND
+        module, sep, attr = backends.get(name, name).partition(":")
+        if not sep:
+            raise ConfigError({"queue": f"Unknown queue backend: {name}"})
+
+        factory = getattr(importlib.import_module(module), attr)
+        app.ctx.download_queue = factory.create(app)
+
+    return app.ctx.download_queue
+
+
+class Notifier:
+    """Reports positions to all tickets waiting in the current worker.
+
+    Changes of the queue are coalesced: notifier waits `interval` seconds
+    after the first change, then gets positions of all waiting tickets from
+    the queue at once and reports only the changed ones. Ticket whose turn
+    has come is reported on every update, so it can retry taking a slot.
+    Changes made by other workers are noticed every `poll` seconds.
+
+    Notifier listens to download signals only while there are waiting
+    tickets.
+    """
+
+    def __init__(self, queue: DownloadQueue, interval: float, poll: float):
+        self.queue = queue
+        self.interval = interval
+        self.poll = poll
+
+        self.waiters: dict[str, Callable[[int], Awaitable[Any]]] = {}
+        self.reported: dict[str, int] = {}
+        self.changed = asyncio.Event()
+        self.task: asyncio.Future[None] | None = None
+        self.renewed = 0.0
+
+    def subscribe(self, id: str, callback: Callable[[int], Awaitable[Any]]):
+        """Report positions of the ticket to the callback."""
+        self.waiters[id] = callback
+        if self.task is None or self.task.done():
+            utils.on_download_started.connect(self.notify)
+            utils.on_download_completed.connect(self.notify)
+            self.task = asyncio.ensure_future(self.run())
+
+    def unsubscribe(self, id: str):
+        """Stop reporting positions of the ticket."""
+        self.waiters.pop(id, None)
+        self.reported.pop(id, None)
+        if not self.waiters:
+            self.changed.set()
+
+    def notify(self, sender: Any, **kwargs: Any):
+        """Schedule update of positions."""
+        self.changed.set()
+
+    async def run(self):
+        try:
+            while self.waiters:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.changed.wait(), self.poll)
+
+                await asyncio.sleep(self.interval)
+                self.changed.clear()
+                try:
+                    await self.update()
+                except Exception:
+                    log.exception("Cannot update positions in download queue")
+        finally:
+            utils.on_download_started.disconnect(self.notify)
+            utils.on_download_completed.disconnect(self.notify)
+
+    async def update(self):
+        """Report positions of waiting tickets."""
+        ids = list(self.waiters)
+        if not ids:
+            return
+
+        now = time.monotonic()
+        if now - self.renewed > self.queue.lease / 3:
+            await self.queue.renew_many(ids)
+            self.renewed = now
+
+        positions = await self.queue.positions(ids)
+        await asyncio.gather(
+            *(
+                self._report(id, position)
+                for id, position in positions.items()
+                if position < 0 or self.reported.get(id) != position
+            ),
+        )
+
+    async def _report(self, id: str, position: int):
+        callback = self.waiters.get(id)
+        if callback is None:
+            return
+
+        self.reported[id] = position
+        try:
+            await callback(position)
+        except Exception:
+            log.exception("Cannot report position of %s", id)
+
+
+def notifier(app: App) -> Notifier:
+    """Notifier of tickets waiting in the current worker."""
+    if app.ctx.queue_notifier is None:
+        queue = download_queue(app)
+        config = app.config
+        app.ctx.queue_notifier = Notifier(
+            queue,
+            config.FPX_QUEUE_NOTIFY_INTERVAL,
+            min(config.FPX_QUEUE_POLL_INTERVAL, queue.lease / 3),
+        )
+
+    return app.ctx.queue_notifier
+
+
+def allocate_shared(app: App):
+    """Allocate memory of the shared queue in the main process."""
+    if app.config.FPX_QUEUE_BACKEND == "shared":
+        app.shared_ctx.fpx_download_queue = SharedMemoryQueue.allocate(
+            app.config.FPX_QUEUE_CAPACITY,
+        )
+
+
+async def keep_alive(queue: DownloadQueue, id: str):
+    """Renew leases of the ticket until cancelled."""
+    while True:
+        await asyncio.sleep(queue.lease / 3)
+        try:
+            await queue.renew(id)
+        except Exception:
+            log.exception("Cannot renew lease of %s", id)
+
+
+@contextlib.asynccontextmanager
+async def active_download(app: App, id: str) -> AsyncIterator[None]:
+    """Hold download slot of the ticket while its content is sent."""
+    queue = download_queue(app)
+    await queue.start(id)
+    utils.on_download_started.send(id)
+    renewal = asyncio.ensure_future(keep_alive(queue, id))
+    try:
+        yield
+
+    finally:
+        renewal.cancel()
+        await queue.release(id)
+        utils.on_download_completed.send(id)
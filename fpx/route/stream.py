@@ -4,7 +4,7 @@ import jwt
 from sanic import Blueprint
 from webargs_sanic.sanicparser import use_kwargs
 
-from fpx import exception, pipes, schema, utils
+from fpx import exception, pipes, queue, schema, utils
 from fpx.model import Client, Ticket
 
 stream = Blueprint("stream", url_prefix="/stream")
@@ -37,18 +37,19 @@ async def url(request: pipes.Request, url, client):
     db.commit()
 
     db.refresh(ticket)
-    response = await request.respond()
 
     async with pipes.Pipe.choose(ticket, request) as pipe:
-        response.content_type = details.get("content-type", pipe.content_type())
-        filename = pipe.filename()
-        response.headers["content-disposition"] = f'attachment; filename="{filename}"'
-        response.headers.update(details.get("response_headers", {}))
+        status, headers = utils.download_headers(request, pipe)
+        headers.update(details.get("response_headers", {}))
+        response = await request.respond(
+            status=status,
+            headers=headers,
+            content_type=details.get("content-type", pipe.content_type()),
+        )
 
-        with utils.ActiveDownload(request.app.ctx.active_downloads, id):
+        async with queue.active_download(request.app, ticket.id):
             db.delete(ticket)
             db.commit()
-            async for chunk in pipe.chunks():
-                await response.send(chunk)
+            await utils.send_output(request, response, pipe)
 
     await response.eof()
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
-import asyncio
 import json
 import logging
+from datetime import datetime, timedelta
 from typing import Any
 
 from sanic import Blueprint, response
@@ -11,7 +11,7 @@ from sanic.server.websockets.impl import WebsocketImplProtocol
 from sqlalchemy.orm.query import Query
 from webargs_sanic.sanicparser import use_kwargs
 
-from fpx import exception, schema, utils
+from fpx import exception, queue, schema, transport, utils
 from fpx.model import Ticket
 from fpx.pipes import Pipe
 from fpx.types import Request
@@ -44,14 +44,27 @@ async def generate(
     items: Any,
     options: dict[str, Any],
 ) -> response.HTTPResponse:
+    config = request.app.config
     ticket = Ticket(type=type, items=items, options=options)
-    if request.app.config.FPX_NO_QUEUE:
+    if config.FPX_NO_QUEUE:
         ticket.is_available = True
 
+    if options.get("probe", config.FPX_TICKET_PROBE):
+        infos = await transport.probe_many(
+            request,
+            items,
+            config.FPX_TICKET_PROBE_CONCURRENCY,
+        )
+        ticket.probes = [info.for_json() if info else None for info in infos]
+
     request.ctx.db.add(ticket)
     request.ctx.db.commit()
 
-    return response.json(ticket.for_json(include_id=True))
+    data = ticket.for_json(include_id=True)
+    if ticket.probes is not None:
+        data["probes"] = ticket.probes
+
+    return response.json(data)
 
 
 @ticket.route("/<id>/download")
@@ -59,6 +72,11 @@ async def download(request: Request, id: str):
     db = request.ctx.db
     ticket = db.get(Ticket, id)
 
+    if ticket is not None and ticket.is_expired:
+        db.delete(ticket)
+        db.commit()
+        ticket = None
+
     if ticket is None:
         raise exception.NotFoundError({"id": "Ticket not found"})
 
@@ -67,24 +85,38 @@ async def download(request: Request, id: str):
             {"access": "You must wait untill download is available"},
         )
 
-    response = await request.respond()
-    if not response:
-        raise ValueError("response")
-
     async with Pipe.choose(ticket, request) as pipe:
-        response.content_type = pipe.content_type()
         filename = pipe.filename()
-        response.headers["content-disposition"] = f'attachment; filename="{filename}"'
+        status, headers = utils.download_headers(request, pipe)
+        response = await request.respond(
+            status=status,
+            headers=headers,
+            content_type=pipe.content_type(),
+        )
+        if not response:
+            raise ValueError("response")
+
         log.info(
             "Prepare for streaming %s using %s pipe",
             filename,
             type(pipe).__name__,
         )
-        with utils.ActiveDownload(request.app.ctx.active_downloads, id):
-            db.delete(ticket)
+        ttl = request.app.config.FPX_TICKET_TTL
+        async with queue.active_download(request.app, id):
+            if not ttl:
+                db.delete(ticket)
+            elif ticket.expires_at is None:
+                ticket.expires_at = datetime.utcnow() + timedelta(seconds=ttl)
             db.commit()
-            async for chunk in pipe.chunks():
-                await response.send(chunk)
+
+            try:
+                await utils.send_output(request, response, pipe)
+            finally:
+                # keep checksums computed during download for resumption. The
+                # session is closed by middleware once the response starts
+                if ttl:
+                    db.add(ticket)
+                    db.commit()
 
     await response.eof()
 
@@ -92,57 +124,50 @@ async def download(request: Request, id: str):
 @ticket.websocket("/<id>/wait")
 async def wait(request: Request, ws: WebsocketImplProtocol, id: str):
     db = request.ctx.db
-    q = request.app.ctx.download_queue
-    active = request.app.ctx.active_downloads
+    q = queue.download_queue(request.app)
     ticket = db.get(Ticket, id)
     if ticket is None:
         raise exception.NotFoundError({"id": "Ticket not found"})
 
-    def _position():
-        offset = q.index(id) if id in q else len(q)
-        return offset + len(active) - request.app.config.SIMULTANEOURS_DOWNLOADS_LIMIT
+    async def send_position(position: int) -> bool:
+        """Report position, taking a slot when it's the turn of the ticket."""
+        if position < 0 and not ticket.is_available and await q.acquire(id):
+            ticket.is_available = True
+            db.commit()
 
-    async def send_position(position: int):
         await ws.send(
             json.dumps(
                 {"position": position, "available": ticket.is_available},
             ),
         )
+        return ticket.is_available
 
-    position = _position()
-    if position < 0:
-        ticket.is_available = True
-        db.commit()
-    await send_position(position)
-    if ticket.is_available:
+    if await send_position(await q.position(id)):
         log.debug("Ticket %s is already available. Closing connection", id)
         await ws.close(reason="available")
         return
 
-    if id in q:
-        log.debug("%s already in queue as position %s: %s", id, q.index(id), q)
+    if not await q.join(id):
+        log.debug("%s already in queue as position %s", id, await q.position(id))
         await ws.send(json.dumps({"error": "Already waiting"}))
         log.debug("Closing connection")
         await ws.close(reason="aleready in queue")
         return
 
-    @utils.on_download_started.connect
-    @utils.on_download_completed.connect
-    async def download_listener(sender: Any, **kwargs: Any):
-        position = _position()
-        if position < 0:
-            ticket.is_available = True
-            db.commit()
-        await send_position(position)
-        if ticket.is_available:
-            await ws.close(reason="available")
+    log.debug("Appended %s to download queue", id)
 
-    q.append(id)
-    log.debug("Appended %s to download queue: %s", id, q)
+    async def follow(position: int):
+        try:
+            if await send_position(position):
+                await ws.close(reason="available")
+        except WebsocketClosed:
+            pass
 
+    notifier = queue.notifier(request.app)
+    notifier.subscribe(id, follow)
     try:
         await ws.wait_for_connection_lost(timeout=3600)
-    except (WebsocketClosed, asyncio.CancelledError):
-        q.remove(id)
-        log.debug("Removed %s from download queue: %s", id, q)
-        raise
+    finally:
+        notifier.unsubscribe(id)
+        await q.leave(id)
+        log.debug("Removed %s from download queue", id)
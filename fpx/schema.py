@@ -5,6 +5,8 @@ import json
 
 from marshmallow import Schema, ValidationError, fields, validate, validates_schema
 
+from . import compression
+
 
 class Base64Json(fields.Field):
     """Converts JSON-cmpatible structure into base64-encoded json string."""
@@ -68,7 +70,7 @@ class TicketIndex(Schema):
 
 class TicketGenerate(Schema):
     type = fields.Str(
-        validate=validate.OneOf(["zip", "stream"]),
+        validate=validate.OneOf(["zip", "tar", "tar.gz", "tar.zst", "stream"]),
         load_default="zip",
     )
     items = Base64Json(required=True, metadata={"fpx_expect": list})
@@ -88,3 +90,12 @@ class TicketGenerate(Schema):
                     ],
                 },
             )
+
+        if data["type"] == "tar.zst" and compression.zstandard is None:
+            raise ValidationError(
+                {
+                    "type": [
+                        "Ticket with the type `tar.zst` requires `zstandard` package",
+                    ],
+                },
+            )
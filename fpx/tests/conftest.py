@@ -23,8 +23,8 @@ def rmock_aiohttp():
     """Response factory for aiohttp."""
     with aioresponses() as r:
 
-        def mock(url, body="", headers=None):
-            r.add(url=url, body=body, headers=headers)
+        def mock(url, body="", headers=None, method="GET", status=200):
+            r.add(url=url, body=body, headers=headers, method=method, status=status)
 
         yield mock
 
@@ -33,8 +33,14 @@ def rmock_aiohttp():
 def rmock_httpx(httpx_mock):
     """Response factory for httpx."""
 
-    def mock(url, body="", headers=None):
-        httpx_mock.add_response(url=url, content=body, headers=headers)
+    def mock(url, body="", headers=None, method="GET", status=200):
+        httpx_mock.add_response(
+            url=url,
+            content=body,
+            headers=headers,
+            method=method,
+            status_code=status,
+        )
 
     return mock
 
@@ -1,3 +1,5 @@
+import os
+
 import jwt
 import pytest
 
@@ -47,3 +49,61 @@ def test_valid_jwt(test_client, url_for, client, rmock, faker):
     assert resp.status == 200
     assert resp.content == body
     assert resp.content_type == content_type
+
+
+@pytest.mark.usefixtures("all_transports")
+@pytest.mark.parametrize("silly", [True, False])
+def test_range(test_client, url_for, client, rmock, faker, silly):
+    test_client.app.config.FPX_PIPE_SILLY_STREAM = silly
+    url = faker.uri()
+    body = faker.binary(length=1000)
+    headers = {"etag": '"v1"', "content-length": str(len(body))}
+
+    for _ in range(2 if silly else 1):
+        rmock(url, body=body, headers=headers)
+
+    encoded = jwt.encode(
+        {"url": url},
+        client.id,
+        algorithm=test_client.app.config.JWT_ALGORITHM,
+    )
+    _, resp = test_client.get(
+        url_for("stream.url", url=encoded, client=client.name),
+        headers={"range": "bytes=10-19", "if-range": '"v1"'},
+    )
+
+    assert resp.status == 206
+    assert resp.content == body[10:20]
+    assert resp.headers["content-range"] == f"bytes 10-19/{len(body)}"
+    assert resp.headers["etag"] == '"v1"'
+
+
+@pytest.mark.parametrize("silly", [True, False])
+def test_local_file(test_client, url_for, client, tmp_path, silly):
+    test_client.app.config.FPX_PIPE_SILLY_STREAM = silly
+    test_client.app.config.FPX_FILE_ROOTS = [str(tmp_path)]
+    body = os.urandom(100000)
+    path = tmp_path / "data.bin"
+    path.write_bytes(body)
+
+    encoded = jwt.encode(
+        {"url": path.as_uri()},
+        client.id,
+        algorithm=test_client.app.config.JWT_ALGORITHM,
+    )
+    url = url_for("stream.url", url=encoded, client=client.name)
+
+    _, resp = test_client.get(url)
+    assert resp.status == 200
+    assert resp.content == body
+
+    _, resp = test_client.get(
+        url,
+        headers={"range": "bytes=10-19"},
+    )
+    assert resp.status == 206
+    assert resp.content == body[10:20]
+
+    _, resp = test_client.get(url, headers={"range": f"bytes={len(body)}-"})
+    assert resp.status == 416
+    assert resp.headers["content-range"] == f"bytes */{len(body)}"
@@ -1,13 +1,15 @@
 import base64
 import json
 import os
+import tarfile
 from io import BytesIO
 from typing import Callable
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZipFile
 from sanic_testing.testing import SanicTestClient
 
 import pytest
 
+from fpx import compression
 from fpx import model as m
 
 UrlFor = Callable[..., str]
@@ -162,6 +164,19 @@ class TestGenerate:
         assert resp.status == 422
         assert set(resp.json["errors"]["json"].keys()) == {"type"}
 
+    def test_zst_ticket_without_zstandard(
+        self, test_client: SanicTestClient, url_for: UrlFor, client, monkeypatch
+    ):
+        monkeypatch.setattr(compression, "zstandard", None)
+        payload = {"type": "tar.zst", "items": ["http://google.com"]}
+        _, resp = test_client.post(
+            url_for("ticket.generate"),
+            headers={"authorize": client.id},
+            json=payload,
+        )
+        assert resp.status == 422
+        assert set(resp.json["errors"]["json"].keys()) == {"type"}
+
     def test_valid_raw_payload(
         self, test_client: SanicTestClient, url_for: UrlFor, client, db
     ):
@@ -177,6 +192,32 @@ class TestGenerate:
         assert ticket.items == payload["items"]
         assert ticket.type == payload["type"]
 
+    @pytest.mark.usefixtures("all_transports")
+    def test_probe(
+        self, test_client: SanicTestClient, url_for: UrlFor, client, db, faker, rmock
+    ):
+        good = f"{faker.uri().rstrip('/')}/good.txt"
+        bad = f"{faker.uri().rstrip('/')}/bad.txt"
+        rmock(good, headers={"content-length": "5"}, method="HEAD")
+        rmock(bad, method="HEAD", status=404)
+        rmock(bad, status=404)
+
+        payload = {"items": [good, bad], "options": {"probe": True}}
+        _, resp = test_client.post(
+            url_for("ticket.generate"),
+            headers={"authorize": client.id},
+            json=payload,
+        )
+        assert resp.status == 200
+
+        good_probe, bad_probe = resp.json["probes"]
+        assert good_probe["name"] == "good.txt"
+        assert good_probe["size"] == 5
+        assert bad_probe is None
+
+        ticket: m.Ticket = db.query(m.Ticket).filter_by(id=resp.json["id"]).one()
+        assert ticket.probes == resp.json["probes"]
+
 
 @pytest.mark.usefixtures("all_transports")
 class TestDownload:
@@ -213,6 +254,380 @@ class TestDownload:
             name = os.path.basename(url.rstrip("/"))
             assert z.read(name) == f"hello world, {url}".encode()
 
+    @pytest.mark.parametrize("prefetch", [1, 3, 100])
+    def test_download_keeps_order(
+        self,
+        prefetch,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+    ):
+        urls = [f"{faker.uri().rstrip('/')}/file-{idx}" for idx in range(7)]
+        for url in urls:
+            rmock(url=url, body=f"hello world, {url}")
+
+        ticket = ticket_factory(
+            content=json.dumps(urls),
+            options={"prefetch": prefetch},
+            is_available=True,
+        )
+        _, resp = test_client.get(url_for("ticket.download", id=ticket.id))
+
+        assert resp.status == 200
+        z = ZipFile(BytesIO(resp.content))
+        assert z.namelist() == [os.path.basename(url) for url in urls]
+
+    def test_download_with_memory_budget(
+        self,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+    ):
+        # every chunk exceeds the budget, so items are buffered one by one
+        test_client.app.config.FPX_MEMORY_BUDGET = 10
+        urls = [f"{faker.uri().rstrip('/')}/file-{idx}" for idx in range(7)]
+        for url in urls:
+            rmock(url=url, body=f"hello world, {url}")
+
+        ticket = ticket_factory(
+            content=json.dumps(urls),
+            options={"prefetch": 4},
+            is_available=True,
+        )
+        _, resp = test_client.get(url_for("ticket.download", id=ticket.id))
+
+        assert resp.status == 200
+        z = ZipFile(BytesIO(resp.content))
+        for url in urls:
+            assert z.read(os.path.basename(url)) == f"hello world, {url}".encode()
+        assert test_client.app.ctx.memory_budget.used == 0
+
+    def test_download_segmented_with_single_slot(
+        self,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+    ):
+        config = test_client.app.config
+        config.FPX_UPSTREAM_HOST_LIMIT = 1
+        config.FPX_PARALLEL_THRESHOLD = 100
+        config.FPX_PARALLEL_SEGMENT_SIZE = 100
+        base = faker.uri().rstrip("/")
+        urls = [f"{base}/file-{idx}" for idx in range(3)]
+        body = b"x" * 1000
+        rmock(
+            url=urls[0],
+            body=body,
+            headers={
+                "accept-ranges": "bytes",
+                "content-length": str(len(body)),
+                "etag": '"1"',
+            },
+        )
+        for url in urls[1:]:
+            rmock(url=url, body=f"hello world, {url}")
+
+        # the only slot of the host is never shared with segments
+        ticket = ticket_factory(
+            content=json.dumps(urls),
+            options={"prefetch": 2},
+            is_available=True,
+        )
+        _, resp = test_client.get(url_for("ticket.download", id=ticket.id))
+
+        assert resp.status == 200
+        z = ZipFile(BytesIO(resp.content))
+        assert z.read("file-0") == body
+        for url in urls[1:]:
+            assert z.read(os.path.basename(url)) == f"hello world, {url}".encode()
+
+    def test_download_duplicates(
+        self,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+    ):
+        url = faker.uri()
+        body = f"hello world, {url}"
+        rmock(url=url, body=body)
+
+        items = [
+            {"url": url, "name": "first.txt"},
+            {"url": url, "name": "second.txt", "path": "copy"},
+        ]
+        ticket = ticket_factory(content=json.dumps(items), is_available=True)
+        _, resp = test_client.get(url_for("ticket.download", id=ticket.id))
+
+        assert resp.status == 200
+        z = ZipFile(BytesIO(resp.content))
+        assert z.namelist() == ["first.txt", "copy/second.txt"]
+        assert z.read("copy/second.txt") == body.encode()
+
+    @pytest.mark.parametrize("level", [1, 9])
+    def test_download_compressed(
+        self,
+        level,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+    ):
+        url = faker.uri()
+        rmock(url=url, body="hello world" * 1000)
+
+        ticket = ticket_factory(
+            content=json.dumps([url]),
+            options={"compression": "deflated", "compression_level": level},
+            is_available=True,
+        )
+        _, resp = test_client.get(url_for("ticket.download", id=ticket.id))
+
+        assert resp.status == 200
+        z = ZipFile(BytesIO(resp.content))
+        info = z.filelist[0]
+        assert info.compress_type == ZIP_DEFLATED
+        assert info.compress_size < info.file_size
+        assert z.read(info) == b"hello world" * 1000
+
+    def test_download_with_content_length(
+        self,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+    ):
+        urls = [f"{faker.uri().rstrip('/')}/file-{idx}" for idx in range(3)]
+        for url in urls:
+            body = f"hello world, {url}"
+            rmock(url, headers={"content-length": str(len(body))}, method="HEAD")
+            rmock(url, body=body)
+
+        ticket = ticket_factory(
+            content=json.dumps(urls),
+            options={"content_length": True},
+            is_available=True,
+        )
+        _, resp = test_client.get(url_for("ticket.download", id=ticket.id))
+
+        assert resp.status == 200
+        assert int(resp.headers["content-length"]) == len(resp.content)
+        z = ZipFile(BytesIO(resp.content))
+        assert z.namelist() == [os.path.basename(url) for url in urls]
+
+    def test_download_with_probes(
+        self,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+    ):
+        url = f"{faker.uri().rstrip('/')}/file.txt"
+        rmock(url, body="hello")
+
+        # items are not probed again, so HEAD request is not mocked
+        ticket = ticket_factory(
+            content=json.dumps([url]),
+            options={"content_length": True},
+            probes=[
+                {
+                    "path": "",
+                    "name": "file.txt",
+                    "size": 5,
+                    "content_type": "text/plain",
+                    "etag": None,
+                    "byte_range": None,
+                },
+            ],
+            is_available=True,
+        )
+        _, resp = test_client.get(url_for("ticket.download", id=ticket.id))
+
+        assert resp.status == 200
+        assert int(resp.headers["content-length"]) == len(resp.content)
+        z = ZipFile(BytesIO(resp.content))
+        assert z.read("file.txt") == b"hello"
+
+    def test_outdated_probes_are_dropped(
+        self,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+        db,
+    ):
+        test_client.app.config.FPX_TICKET_TTL = 3600
+        url = f"{faker.uri().rstrip('/')}/file.txt"
+        rmock(url, body="hello", headers={"etag": '"v2"'})
+
+        probe = {
+            "path": "",
+            "name": "file.txt",
+            "size": 5,
+            "content_type": "text/plain",
+            "etag": '"v1"',
+            "byte_range": None,
+        }
+        ticket = ticket_factory(
+            content=json.dumps([url]),
+            options={"content_length": True},
+            probes=[probe],
+            is_available=True,
+        )
+        _, resp = test_client.get(url_for("ticket.download", id=ticket.id))
+        assert resp.status == 200
+
+        db.expire_all()
+        stored: m.Ticket = db.query(m.Ticket).filter_by(id=ticket.id).one()
+        assert stored.probes is None
+
+    @pytest.mark.parametrize("type", ["tar", "tar.gz", "tar.zst"])
+    def test_download_tar(
+        self,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+        type: str,
+    ):
+        if type == "tar.zst":
+            zstandard = pytest.importorskip("zstandard")
+
+        urls = [f"{faker.uri().rstrip('/')}/file-{idx}" for idx in range(3)]
+        for url in urls:
+            body = f"hello world, {url}"
+            rmock(url, headers={"content-length": str(len(body))}, method="HEAD")
+            rmock(url, body=body)
+
+        ticket = ticket_factory(
+            type=type,
+            content=json.dumps(urls),
+            is_available=True,
+        )
+        _, resp = test_client.get(url_for("ticket.download", id=ticket.id))
+
+        assert resp.status == 200
+        content = resp.content
+        if type == "tar.zst":
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+            content = decompressor.decompress(content)
+
+        with tarfile.open(fileobj=BytesIO(content), mode="r:*") as tar:
+            for url, info in zip(urls, tar):
+                assert info.name == os.path.basename(url)
+                assert tar.extractfile(info).read() == f"hello world, {url}".encode()
+
+    def test_download_range(
+        self,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+        db,
+    ):
+        test_client.app.config.FPX_TICKET_TTL = 3600
+        url = faker.uri()
+        body = f"hello world, {url}"
+        for _ in range(2):
+            rmock(url, headers={"content-length": str(len(body))}, method="HEAD")
+            rmock(url, body=body)
+
+        ticket = ticket_factory(
+            content=json.dumps([url]),
+            options={"content_length": True},
+            is_available=True,
+        )
+        _, full = test_client.get(url_for("ticket.download", id=ticket.id))
+        assert full.status == 200
+        assert full.headers["accept-ranges"] == "bytes"
+
+        db.expire_all()
+        stored: m.Ticket = db.query(m.Ticket).filter_by(id=ticket.id).one()
+        assert stored.checksums["etag"] == full.headers["etag"]
+
+        _, partial = test_client.get(
+            url_for("ticket.download", id=ticket.id),
+            headers={"range": "bytes=10-", "if-range": full.headers["etag"]},
+        )
+        assert partial.status == 206
+        assert partial.content == full.content[10:]
+        assert partial.headers["content-range"] == (
+            f"bytes 10-{len(full.content) - 1}/{len(full.content)}"
+        )
+
+    def test_download_etag_follows_items(
+        self,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+    ):
+        test_client.app.config.FPX_TICKET_TTL = 3600
+        url = faker.uri()
+        body = f"hello world, {url}"
+        for version in ["v1", "v2"]:
+            headers = {"content-length": str(len(body)), "etag": f'"{version}"'}
+            rmock(url, headers=headers, method="HEAD")
+            rmock(url, body=body, headers=headers)
+
+        ticket = ticket_factory(
+            content=json.dumps([url]),
+            options={"content_length": True},
+            is_available=True,
+        )
+        _, first = test_client.get(url_for("ticket.download", id=ticket.id))
+        _, second = test_client.get(url_for("ticket.download", id=ticket.id))
+
+        assert first.content == second.content
+        assert first.headers["etag"] != second.headers["etag"]
+
+    def test_download_cached(
+        self,
+        test_client: SanicTestClient,
+        url_for: UrlFor,
+        ticket_factory,
+        faker,
+        rmock,
+        tmp_path,
+    ):
+        test_client.app.config.FPX_ARCHIVE_CACHE_DIR = str(tmp_path)
+        test_client.app.config.FPX_TICKET_TTL = 3600
+        url = faker.uri()
+        body = f"hello world, {url}"
+        rmock(url, headers={"content-length": str(len(body))}, method="HEAD")
+        rmock(url, body=body)
+
+        ticket = ticket_factory(
+            content=json.dumps([url]),
+            options={"content_length": True},
+            is_available=True,
+        )
+        _, full = test_client.get(url_for("ticket.download", id=ticket.id))
+        assert full.status == 200
+
+        # upstream is not contacted anymore
+        _, partial = test_client.get(
+            url_for("ticket.download", id=ticket.id),
+            headers={"range": "bytes=10-", "if-range": full.headers["etag"]},
+        )
+        assert partial.status == 206
+        assert partial.headers["etag"] == full.headers["etag"]
+        assert partial.content == full.content[10:]
+
     def test_download_stream(
         self,
         test_client: SanicTestClient,
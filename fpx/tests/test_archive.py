@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import gzip
+import os
+import tarfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from zipfile import ZipFile
+
+import pytest
+
+from fpx import archive, compression
+
+
+class TestZipWriter:
+    def test_empty(self):
+        stream = BytesIO()
+        archive.ZipWriter(stream).close(b"hello")
+
+        z = ZipFile(stream)
+        assert z.comment == b"hello"
+        assert z.filelist == []
+
+    @pytest.mark.parametrize("name", ["hello.txt", "dir/hello.txt", "привіт.txt"])
+    def test_stored(self, name: str):
+        stream = BytesIO()
+        content = b"hello world"
+        writer = archive.ZipWriter(stream)
+        entry = writer.start(name, (2000, 1, 2, 3, 4, 6), archive.STORED)
+        writer.write(content)
+        writer.finish(entry, zlib.crc32(content), len(content))
+        writer.close()
+
+        z = ZipFile(stream)
+        assert z.testzip() is None
+        assert z.read(name) == content
+
+        info = z.getinfo(name)
+        assert info.date_time == (2000, 1, 2, 3, 4, 6)
+        assert info.compress_type == archive.STORED
+
+
+def test_stored_archive_size():
+    entries = [("hello.txt", 10), ("dir/привіт.txt", 0), ("big", 1000)]
+    stream = BytesIO()
+    writer = archive.ZipWriter(stream)
+    for name, size in entries:
+        content = os.urandom(size)
+        entry = writer.start(name, (2000, 1, 1, 0, 0, 0), archive.STORED)
+        writer.write(content)
+        writer.finish(entry, zlib.crc32(content), size)
+    writer.close(b"comment")
+
+    assert archive.stored_archive_size(entries, b"comment") == len(stream.getvalue())
+
+
+@pytest.mark.parametrize("name", ["hello.txt", "привіт.txt", "dir/" + "x" * 200])
+@pytest.mark.parametrize("content", [b"", b"hello world", b"x" * 512])
+def test_tar(name: str, content: bytes):
+    stream = BytesIO()
+    stream.write(archive.tar_header(name, len(content), 946684800))
+    stream.write(content)
+    stream.write(archive.tar_padding(len(content)))
+    stream.write(archive.TAR_END)
+    stream.seek(0)
+
+    with tarfile.open(fileobj=stream) as tar:
+        info = tar.getmember(name)
+        assert info.mtime == 946684800
+        assert tar.extractfile(info).read() == content
+
+
+class TestDeflateCompressor:
+    @pytest.mark.parametrize("block_size", [1, 1000, 1024**2])
+    async def test_blocks_are_valid_stream(self, block_size: int):
+        content = b"hello world" * 10000 + os.urandom(1000)
+        with ThreadPoolExecutor(2) as executor:
+            compressor = compression.DeflateCompressor(executor, 6, block_size, 2)
+            result = b""
+            for idx in range(0, len(content), 777):
+                result += await compressor.compress(content[idx : idx + 777])
+            result += await compressor.flush()
+
+        assert zlib.decompress(result, -zlib.MAX_WBITS) == content
+
+    async def test_in_archive(self):
+        stream = BytesIO()
+        content = b"hello world" * 10000
+        writer = archive.ZipWriter(stream)
+        with ThreadPoolExecutor(2) as executor:
+            compressor = compression.DeflateCompressor(executor, 9, 1000, 2)
+            entry = writer.start("hello.txt", (2000, 1, 1, 0, 0, 0), compressor.method)
+            writer.write(await compressor.compress(content))
+            writer.write(await compressor.flush())
+
+        writer.finish(entry, zlib.crc32(content), len(content))
+        writer.close()
+
+        z = ZipFile(stream)
+        info = z.getinfo("hello.txt")
+        assert info.compress_type == archive.DEFLATED
+        assert info.compress_size < info.file_size
+        assert z.read("hello.txt") == content
+
+
+class TestGzipCompressor:
+    @pytest.mark.parametrize("content", [b"", b"hello world" * 10000])
+    async def test_valid_member(self, content: bytes):
+        with ThreadPoolExecutor(2) as executor:
+            compressor = compression.GzipCompressor(executor, 6, 1000, 2)
+            result = await compressor.compress(content)
+            result += await compressor.flush()
+
+        assert gzip.decompress(result) == content
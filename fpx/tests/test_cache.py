@@ -0,0 +1,96 @@
+import os
+import time
+
+import pytest
+
+from fpx import cache
+from fpx.model import Ticket
+from fpx.pipes import ZipPipe
+
+
+async def _content(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.fixture()
+def disk(tmp_path):
+    return cache.DiskCache(str(tmp_path), 100, 60)
+
+
+class TestDiskCache:
+    async def test_store(self, disk: cache.DiskCache):
+        chunks = [c async for c in disk.store("key", _content(b"hello", b"world"))]
+        assert chunks == [b"hello", b"world"]
+
+        path = disk.get("key")
+        assert path
+        with open(path, "rb") as src:
+            assert src.read() == b"helloworld"
+
+    async def test_invalid_content_is_not_stored(self, disk: cache.DiskCache):
+        async for _chunk in disk.store("key", _content(b"hello"), lambda: False):
+            pass
+
+        assert disk.get("key") is None
+        assert not os.listdir(disk.path)
+
+    async def test_expiration(self, disk: cache.DiskCache):
+        async for _chunk in disk.store("key", _content(b"hello")):
+            pass
+
+        expired = time.time() - disk.ttl - 1
+        os.utime(disk.location("key"), (expired, expired))
+        assert disk.get("key") is None
+        assert not os.path.exists(disk.location("key"))
+
+    async def test_eviction(self, disk: cache.DiskCache):
+        for key in ["a", "b"]:
+            async for _chunk in disk.store(key, _content(b"x" * 40)):
+                pass
+
+        old = time.time() - 10
+        os.utime(disk.location("a"), (old, old))
+        os.utime(disk.location("b"), (old - 1, old - 1))
+        assert disk.get("a")
+
+        async for _chunk in disk.store("c", _content(b"x" * 40)):
+            pass
+
+        assert disk._eviction
+        await disk._eviction
+        assert disk.get("a")
+        assert disk.get("b") is None
+        assert disk.get("c")
+
+
+def test_make_key():
+    assert cache.make_key({"a": 1, "b": 2}) == cache.make_key({"b": 2, "a": 1})
+    assert cache.make_key([1]) != cache.make_key([2])
+
+
+def test_archive_key_depends_on_compression(app):
+    ticket = Ticket(type="zip", content='["http://example.com"]', options={})
+    stored = ZipPipe.cache_key(ticket, app)
+
+    app.config.FPX_ZIP_COMPRESSION = "deflated"
+    deflated = ZipPipe.cache_key(ticket, app)
+    assert deflated != stored
+
+    app.config.FPX_ZIP_COMPRESSION_LEVEL = 1
+    fast = ZipPipe.cache_key(ticket, app)
+    assert fast != deflated
+
+    # explicit options equal to defaults produce the same archive
+    ticket.options = {"compression": "deflated", "compression_level": 1}
+    assert ZipPipe.cache_key(ticket, app) == fast
+
+
+def test_caches_are_shared_by_worker(app, tmp_path):
+    assert cache.archive_cache(app) is None
+    assert cache.upstream_cache(app) is None
+
+    app.config.FPX_ARCHIVE_CACHE_DIR = str(tmp_path / "archives")
+    app.config.FPX_UPSTREAM_CACHE_DIR = str(tmp_path / "upstream")
+    assert cache.archive_cache(app) is cache.archive_cache(app)
+    assert cache.upstream_cache(app) is cache.upstream_cache(app)
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from fpx import archive, compression
+
+
+class TestChooseMethod:
+    @pytest.mark.parametrize(
+        "content_type",
+        ["image/jpeg", "video/mp4", "application/pdf", "application/zip; q=1"],
+    )
+    def test_compressed_type(self, content_type: str):
+        assert (
+            compression.choose_method(content_type, "file", b"hello" * 100)
+            == archive.STORED
+        )
+
+    @pytest.mark.parametrize("name", ["photo.JPG", "movie.mp4", "data.tar.gz"])
+    def test_compressed_extension(self, name: str):
+        assert compression.choose_method(None, name, b"hello" * 100) == archive.STORED
+
+    def test_random_content(self):
+        sample = os.urandom(compression.SAMPLE_SIZE)
+        assert compression.choose_method(None, "file", sample) == archive.STORED
+
+    @pytest.mark.parametrize(
+        ("content_type", "name"),
+        [("text/csv", "data.csv"), ("image/svg+xml", "logo.svg"), (None, "file")],
+    )
+    def test_compressible(self, content_type: str | None, name: str):
+        assert (
+            compression.choose_method(content_type, name, b"hello" * 100)
+            == archive.DEFLATED
+        )
+
+
+def test_entropy():
+    assert compression.entropy(b"") == 0
+    assert compression.entropy(b"a" * 100) == 0
+    assert compression.entropy(b"ab" * 100) == 1
+    assert compression.entropy(bytes(range(256))) == 8
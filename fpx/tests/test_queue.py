@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from fpx import exception, queue, utils
+
+
+@pytest.fixture(params=["memory", "shared", "database"])
+def download_queue(request, app):
+    app.config.SIMULTANEOURS_DOWNLOADS_LIMIT = 1
+    app.config.FPX_QUEUE_BACKEND = request.param
+    return queue.download_queue(app)
+
+
+class TestDownloadQueue:
+    async def test_positions(self, download_queue):
+        assert await download_queue.position("a") == -1
+        assert await download_queue.join("a")
+        assert await download_queue.join("b")
+        assert not await download_queue.join("a")
+
+        assert await download_queue.position("a") == -1
+        assert await download_queue.position("b") == 0
+        assert await download_queue.position("c") == 1
+
+        await download_queue.leave("a")
+        assert await download_queue.position("b") == -1
+
+    async def test_positions_of_many(self, download_queue):
+        for id in "abcd":
+            await download_queue.join(id)
+        await download_queue.leave("b")
+
+        assert await download_queue.positions(["d", "a", "c", "e"]) == {
+            "a": -1,
+            "c": 0,
+            "d": 1,
+            "e": 2,
+        }
+        for id in "acde":
+            assert await download_queue.position(id) == (
+                await download_queue.positions([id])
+            )[id]
+
+    async def test_acquire(self, download_queue):
+        await download_queue.join("a")
+        await download_queue.join("b")
+        assert not await download_queue.acquire("b")
+        assert await download_queue.acquire("a")
+        assert await download_queue.acquire("a")
+
+        # ticket that holds slot is not waiting anymore
+        assert await download_queue.position("b") == 0
+        assert not await download_queue.acquire("b")
+
+        await download_queue.release("a")
+        assert await download_queue.acquire("b")
+
+    async def test_start(self, download_queue):
+        await download_queue.start("a")
+        await download_queue.start("b")
+        assert await download_queue.position("c") == 0
+
+        await download_queue.release("a")
+        assert await download_queue.position("c") == -1
+
+    async def test_lease(self, download_queue):
+        download_queue.lease = -1
+        await download_queue.join("a")
+        await download_queue.start("b")
+        assert await download_queue.position("c") == -1
+
+        download_queue.lease = 60
+        await download_queue.join("a")
+        await download_queue.start("b")
+        download_queue.lease = -1
+        await download_queue.renew("a")
+        await download_queue.renew("b")
+        assert await download_queue.position("c") == -1
+
+        download_queue.lease = 60
+        await download_queue.join("a")
+        await download_queue.start("b")
+        download_queue.lease = -1
+        await download_queue.renew_many(["a", "b"])
+        assert await download_queue.position("c") == -1
+
+
+async def test_shared_memory(app):
+    app.config.FPX_QUEUE_BACKEND = "shared"
+    queue.allocate_shared(app)
+    shared = queue.download_queue(app)
+
+    # queue of another worker
+    other = queue.SharedMemoryQueue(2, 60, app.shared_ctx.fpx_download_queue)
+    await shared.start("a")
+    await other.join("b")
+    assert await shared.position("b") == -1
+    assert await other.position("c") == 0
+
+
+def test_unknown_backend(app):
+    app.config.FPX_QUEUE_BACKEND = "unknown"
+    with pytest.raises(exception.ConfigError):
+        queue.download_queue(app)
+
+
+async def test_active_download(app):
+    app.config.SIMULTANEOURS_DOWNLOADS_LIMIT = 1
+    download_queue = queue.download_queue(app)
+
+    async with queue.active_download(app, "a"):
+        assert await download_queue.position("b") == 0
+        assert not await download_queue.acquire("b")
+
+    assert await download_queue.acquire("b")
+
+
+class TestNotifier:
+    @pytest.fixture()
+    def notifier(self, app):
+        app.config.SIMULTANEOURS_DOWNLOADS_LIMIT = 1
+        app.config.FPX_QUEUE_NOTIFY_INTERVAL = 0.01
+        return queue.notifier(app)
+
+    async def test_coalesced_updates(self, notifier):
+        reports = []
+
+        async def report(position):
+            reports.append(position)
+
+        await notifier.queue.start("a")
+        await notifier.queue.join("b")
+        notifier.subscribe("b", report)
+        for _ in range(10):
+            notifier.notify("a")
+        await asyncio.sleep(0.1)
+        assert reports == [0]
+
+        # unchanged position is not reported
+        notifier.notify("a")
+        await asyncio.sleep(0.1)
+        assert reports == [0]
+
+        await notifier.queue.release("a")
+        notifier.notify("a")
+        await asyncio.sleep(0.1)
+        assert reports[:2] == [0, -1]
+
+        notifier.unsubscribe("b")
+        await notifier.task
+
+    async def test_unsubscribe(self, notifier):
+        reports = []
+
+        async def report(position):
+            reports.append(position)
+
+        notifier.subscribe("a", report)
+        notifier.unsubscribe("a")
+        await asyncio.sleep(0.1)
+
+        assert not reports
+        assert notifier.task
+        assert notifier.task.done()
+        assert not utils.on_download_started.receivers
+
+    async def test_download_signals(self, app, notifier):
+        reports = []
+
+        async def report(position):
+            reports.append(position)
+
+        await notifier.queue.join("b")
+        notifier.subscribe("b", report)
+        async with queue.active_download(app, "a"):
+            await asyncio.sleep(0.1)
+            assert reports == [0]
+
+        await asyncio.sleep(0.1)
+        assert reports[:2] == [0, -1]
+
+        notifier.unsubscribe("b")
+        await notifier.task
@@ -1,8 +1,18 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import threading
+from types import SimpleNamespace
+
+import aiohttp
 import pytest
 
-from fpx import transport
+from fpx import cache, exception, transport
+from fpx.transport.http_httpx import StreamBuffer
 
 
 class TestAioHttpTransport:
@@ -26,6 +36,21 @@ class TestAioHttpTransport:
 
             assert result == bytes(f"hello world, {url}", "utf8")
 
+    async def test_shared_session(self, faker, rmock):
+        url: str = faker.uri()
+        rmock(url=url, body="hello")
+
+        async with aiohttp.ClientSession() as session:
+            async with transport.AioHttpTransport(
+                transport.ItemDetails.from_str(url),
+                client=session,
+            ) as tp:
+                assert tp is not None
+                _path, _name, content, _response = tp
+                assert b"".join([chunk async for chunk in content]) == b"hello"
+
+            assert not session.closed
+
 
 class TestHttpxTransport:
     @pytest.fixture()
@@ -45,3 +70,957 @@ class TestHttpxTransport:
                 result += chunk
 
             assert result == bytes(f"hello world, {url}", "utf8")
+
+
+class TestUpstreamCache:
+    @pytest.fixture()
+    def upstream(self, tmp_path):
+        return cache.ResponseCache(cache.DiskCache(str(tmp_path), 1024, 0))
+
+    async def _read(self, transport_name: str, url: str, upstream):
+        cls = {
+            "aiohttp": transport.AioHttpTransport,
+            "httpx": transport.HttpxTransport,
+        }[transport_name]
+        async with cls(transport.ItemDetails.from_str(url), upstream) as tp:
+            assert tp is not None
+            _path, _name, content, _content_type = tp
+            return b"".join([chunk async for chunk in content])
+
+    async def test_not_modified(self, faker, rmock, transport_name, upstream):
+        url: str = faker.uri()
+        rmock(url=url, body="hello", headers={"etag": '"1"'})
+        rmock(url=url, status=304)
+
+        assert await self._read(transport_name, url, upstream) == b"hello"
+        assert await self._read(transport_name, url, upstream) == b"hello"
+
+    async def test_without_validator(self, faker, rmock, transport_name, upstream):
+        url: str = faker.uri()
+        rmock(url=url, body="hello")
+
+        assert await self._read(transport_name, url, upstream) == b"hello"
+        assert not os.listdir(upstream.disk.path)
+
+
+@pytest.mark.usefixtures("all_transports")
+async def test_clients(app, transport_name):
+    await transport.open_clients(app)
+    if transport_name == "aiohttp":
+        assert app.ctx.aiohttp_session is not None
+    else:
+        assert app.ctx.httpx_client is not None
+
+    await transport.close_clients(app)
+    assert app.ctx.aiohttp_session is None
+    assert app.ctx.httpx_client is None
+
+
+@pytest.mark.usefixtures("all_transports")
+async def test_shared_clients_ignore_cookies(app, faker, rmock, transport_name):
+    url: str = faker.uri()
+    rmock(url=url, body="hello", headers={"set-cookie": "session=secret"})
+
+    await transport.open_clients(app)
+    try:
+        if transport_name == "aiohttp":
+            client = app.ctx.aiohttp_session
+            cls = transport.AioHttpTransport
+        else:
+            client = app.ctx.httpx_client
+            cls = transport.HttpxTransport
+
+        async with cls(transport.ItemDetails.from_str(url), None, client) as tp:
+            assert tp is not None
+            assert b"".join([chunk async for chunk in tp[2]]) == b"hello"
+
+        if transport_name == "aiohttp":
+            # mocked responses bypass the jar, so cookies are stored directly
+            client.cookie_jar.update_cookies({"session": "secret"})
+            assert not len(client.cookie_jar)
+        else:
+            assert not client.cookies
+    finally:
+        await transport.close_clients(app)
+
+
+class TestUpstreamLimits:
+    @pytest.fixture()
+    def transport_name(self):
+        return "aiohttp"
+
+    async def test_owners_take_turns(self):
+        semaphore = transport.FairSemaphore(1)
+        order: list[str] = []
+
+        async def use(owner: str):
+            await semaphore.acquire(owner)
+            order.append(owner)
+            await asyncio.sleep(0)
+            semaphore.release()
+
+        await semaphore.acquire("first")
+        tasks = [
+            asyncio.create_task(use(owner)) for owner in ["a", "a", "a", "b", "c"]
+        ]
+        await asyncio.sleep(0)
+        semaphore.release()
+        await asyncio.gather(*tasks)
+
+        assert order == ["a", "b", "c", "a", "a"]
+        assert semaphore.idle()
+        assert semaphore.waits == 5
+
+    async def test_cancelled_waiter(self):
+        semaphore = transport.FairSemaphore(1)
+        await semaphore.acquire("a")
+
+        task = asyncio.create_task(semaphore.acquire("b"))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        semaphore.release()
+        assert semaphore.idle()
+
+    async def test_host_patterns(self):
+        limits = transport.UpstreamLimits(0, 2, {"*.example.com": 1})
+        assert limits.limit_of("files.example.com") == 1
+        assert limits.limit_of("example.org") == 2
+
+        await limits.acquire("http://files.example.com/a", "a")
+        waiter = asyncio.create_task(
+            limits.acquire("http://files.example.com/b", "b"),
+        )
+        await limits.acquire("http://example.org/c", "c")
+        await asyncio.sleep(0)
+
+        stats = limits.stats()
+        assert stats["active"] == 2
+        assert stats["hosts"]["files.example.com"]["waiting"] == 1
+
+        limits.release("http://files.example.com/a")
+        await waiter
+        limits.release("http://files.example.com/b")
+        limits.release("http://example.org/c")
+
+        # counters of idle hosts are kept
+        stats = limits.stats()
+        assert stats["active"] == 0
+        assert stats["hosts"]["example.org"] == {
+            "limit": 2,
+            "active": 0,
+            "waiting": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+        }
+        assert stats["hosts"]["files.example.com"]["waits"] == 1
+        assert not limits.hosts
+
+    async def test_report(self, app, caplog, monkeypatch):
+        # migrations of the application disable existing loggers
+        monkeypatch.setattr(logging.getLogger("fpx.transport"), "disabled", False)
+        app.config.FPX_UPSTREAM_STATS_INTERVAL = 0.01
+        await transport.upstream_limits(app).acquire("http://example.com/a", "a")
+
+        with caplog.at_level(logging.INFO, "fpx.transport"):
+            task = asyncio.create_task(transport.report_upstream_stats(app))
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        assert "'example.com': {'limit': 0, 'active': 1" in caplog.text
+
+    async def test_try_acquire(self):
+        limits = transport.UpstreamLimits(3, 1)
+        assert limits.capacity("http://example.com/a") == 1
+        assert limits.capacity("http://example.org/a") == 1
+        assert transport.UpstreamLimits(3, 0).capacity("http://example.com") == 3
+        assert transport.UpstreamLimits(0, 0).capacity("http://example.com") == 0
+
+        assert limits.try_acquire("http://example.com/a")
+        assert not limits.try_acquire("http://example.com/b")
+        assert limits.total.active == 1
+
+        limits.release("http://example.com/a")
+        assert not limits.hosts
+
+    async def test_transport_releases_slot(self, faker, rmock):
+        url: str = faker.uri()
+        limits = transport.UpstreamLimits(1, 1)
+
+        for _ in range(2):
+            rmock(url=url, body="hello")
+            async with transport.AioHttpTransport(
+                transport.ItemDetails.from_str(url),
+                limits=limits,
+            ) as tp:
+                assert tp is not None
+                assert limits.total.active == 1
+
+        assert limits.total.idle()
+
+
+class TestResume:
+    @pytest.fixture()
+    def tp(self):
+        details = transport.ItemDetails.from_str("http://example.com/file.txt")
+        return transport.AioHttpTransport(details, retries=1, backoff=0)
+
+    async def _content(self, *chunks: bytes):
+        for chunk in chunks:
+            yield chunk
+        raise aiohttp.ClientPayloadError
+
+    async def _read(self, content):
+        return b"".join([chunk async for chunk in content])
+
+    async def test_resume(self, tp):
+        requests: list[dict[str, str]] = []
+
+        async def send(url, headers, timeout):
+            requests.append(headers)
+            return (
+                206,
+                {"content-range": "bytes 5-9/10", "etag": '"1"'},
+                _chunks(b"world"),
+            )
+
+        tp.send = send
+        content = tp.resumable(
+            self._content(b"hello"),
+            200,
+            {"content-length": "10", "etag": '"1"'},
+            10,
+        )
+        assert await self._read(content) == b"helloworld"
+        assert requests == [{"range": "bytes=5-9", "if-range": '"1"'}]
+
+    async def test_broken_response_is_closed(self, tp):
+        closed: list[bool] = []
+
+        async def close():
+            closed.append(True)
+
+        async def send(url, headers, timeout):
+            # connection of the failed response is released before retry
+            assert closed
+            return (
+                206,
+                {"content-range": "bytes 5-9/10", "etag": '"1"'},
+                _chunks(b"world"),
+            )
+
+        tp.send = send
+        tp.exit_callbacks.append(close)
+        content = tp.resumable(
+            tp.closing(self._content(b"hello"), close),
+            200,
+            {"content-length": "10", "etag": '"1"'},
+            10,
+        )
+        assert await self._read(content) == b"helloworld"
+        assert closed == [True]
+        assert close not in tp.exit_callbacks
+
+    @pytest.mark.parametrize(
+        ("status", "headers"),
+        [
+            (200, {"content-length": "10", "etag": '"2"'}),
+            (206, {"content-range": "bytes 5-9/10", "etag": '"2"'}),
+        ],
+    )
+    async def test_modified(self, tp, status, headers):
+        async def send(url, _headers, timeout):
+            return status, headers, _chunks(b"HELLOWORLD")
+
+        tp.send = send
+        content = tp.resumable(
+            self._content(b"hello"),
+            200,
+            {"content-length": "10", "etag": '"1"'},
+            10,
+        )
+        with pytest.raises(exception.TransportError) as err:
+            await self._read(content)
+
+        assert "etag" in err.value._details
+
+    async def test_without_validator(self, tp):
+        content = tp.resumable(self._content(b"hello"), 200, {}, 10)
+        with pytest.raises(aiohttp.ClientPayloadError):
+            await self._read(content)
+
+    async def test_attempts(self, tp):
+        async def send(url, headers, timeout):
+            headers = {"content-range": "bytes 5-9/10", "etag": '"1"'}
+            return 206, headers, self._content()
+
+        tp.send = send
+        content = tp.resumable(
+            self._content(b"hello"),
+            200,
+            {"content-length": "10", "etag": '"1"'},
+            10,
+        )
+        with pytest.raises(aiohttp.ClientPayloadError):
+            await self._read(content)
+
+
+class TestSegmented:
+    data = bytes(range(256)) * 4
+
+    @pytest.fixture()
+    def tp(self):
+        details = transport.ItemDetails.from_str("http://example.com/file.bin")
+        return transport.AioHttpTransport(
+            details,
+            connections=3,
+            threshold=100,
+            segment_size=100,
+        )
+
+    @pytest.fixture()
+    def headers(self):
+        return {
+            "accept-ranges": "bytes",
+            "content-length": str(len(self.data)),
+            "etag": '"1"',
+        }
+
+    async def _close(self):
+        pass
+
+    async def _read(self, content):
+        return b"".join([chunk async for chunk in content])
+
+    async def test_size(self, tp, headers):
+        assert tp.segmented_size(200, headers) == len(self.data)
+        assert tp.segmented_size(206, headers) is None
+        assert tp.segmented_size(200, dict(headers, etag="")) is None
+        assert tp.segmented_size(200, {**headers, "accept-ranges": "none"}) is None
+        assert tp.segmented_size(200, {**headers, "content-length": "150"}) is None
+
+        tp.details.byte_range = (0, 10)
+        assert tp.segmented_size(200, headers) is None
+
+    async def test_reassemble(self, tp, headers):
+        requests: list[str] = []
+
+        async def send(url, headers, timeout):
+            requests.append(headers["range"])
+            start, end = map(int, headers["range"][6:].split("-"))
+            await asyncio.sleep((len(self.data) - start) / 10000)
+            return (
+                206,
+                {
+                    "content-range": f"bytes {start}-{end}/{len(self.data)}",
+                    "etag": '"1"',
+                },
+                _chunks(self.data[start : end + 1]),
+            )
+
+        tp.send = send
+        content = tp.segmented(
+            _chunks(self.data[:50], self.data[50:]),
+            headers,
+            len(self.data),
+            10,
+            self._close,
+        )
+        assert b"".join([chunk async for chunk in content]) == self.data
+        assert sorted(requests) == [
+            "bytes=100-199",
+            "bytes=1000-1023",
+            "bytes=200-299",
+            "bytes=300-399",
+            "bytes=400-499",
+            "bytes=500-599",
+            "bytes=600-699",
+            "bytes=700-799",
+            "bytes=800-899",
+            "bytes=900-999",
+        ]
+
+    async def test_single_slot_of_host(self, tp, headers):
+        tp.limits = transport.UpstreamLimits(0, 1)
+        assert tp.segmented_size(200, headers) is None
+
+    async def test_slot_is_handed_over(self, tp, headers):
+        url = tp.details.url
+        tp.limits = transport.UpstreamLimits(0, 2)
+        await tp.acquire_slot()
+
+        # next items of the ticket take the rest of slots and wait for more
+        await tp.limits.acquire(url, tp.owner)
+        waiter = asyncio.create_task(tp.limits.acquire(url, tp.owner))
+
+        async def send(url, headers, timeout):
+            start, end = map(int, headers["range"][6:].split("-"))
+            return (
+                206,
+                {
+                    "content-range": f"bytes {start}-{end}/{len(self.data)}",
+                    "etag": '"1"',
+                },
+                _chunks(self.data[start : end + 1]),
+            )
+
+        tp.send = send
+        content = tp.segmented(
+            _chunks(self.data),
+            headers,
+            len(self.data),
+            10,
+            self._close,
+        )
+        assert await asyncio.wait_for(self._read(content), 1) == self.data
+        assert not waiter.done()
+        assert tp.limits.total.active == 2
+
+        await tp.release_slot()
+        await waiter
+
+    @pytest.mark.parametrize("status", [200, 206])
+    async def test_modified(self, tp, headers, status):
+        async def send(url, headers, timeout):
+            start, end = map(int, headers["range"][6:].split("-"))
+            if status == 200:
+                return status, {"etag": '"2"'}, _chunks(self.data)
+
+            return (
+                status,
+                {"content-range": f"bytes {start}-{end}/1024", "etag": '"2"'},
+                _chunks(self.data[start : end + 1]),
+            )
+
+        tp.send = send
+        content = tp.segmented(
+            _chunks(self.data),
+            headers,
+            len(self.data),
+            10,
+            self._close,
+        )
+        with pytest.raises(exception.TransportError) as err:
+            b"".join([chunk async for chunk in content])
+
+        assert "etag" in err.value._details
+
+
+class TestStreamBuffer:
+    async def test_read_ahead(self):
+        consumed = asyncio.Event()
+
+        async def content():
+            yield b"hello"
+            yield b" "
+            yield b"world"
+            consumed.set()
+
+        buffer = StreamBuffer(content(), 4)
+        # stream is read before anyone asks for its content
+        await asyncio.wait_for(consumed.wait(), 1)
+        assert b"".join([chunk async for chunk in buffer.content()]) == b"hello world"
+        await buffer.close()
+
+    async def test_error(self):
+        async def content():
+            yield b"hello"
+            raise ConnectionError
+
+        buffer = StreamBuffer(content(), 4)
+        received: list[bytes] = []
+        with pytest.raises(ConnectionError):
+            async for chunk in buffer.content():
+                received.append(chunk)
+
+        assert received == [b"hello"]
+        await buffer.close()
+
+    async def test_disk_limit(self):
+        produced: list[bytes] = []
+
+        async def content():
+            for chunk in [b"aaa", b"bbb", b"ccc", b"ddd"]:
+                produced.append(chunk)
+                yield chunk
+
+        buffer = StreamBuffer(content(), 2, 4)
+        await asyncio.sleep(0.1)
+        # stream waits once the file is full
+        assert produced == [b"aaa", b"bbb", b"ccc"]
+        assert buffer.size == 6
+
+        assert b"".join([chunk async for chunk in buffer.content()]) == (
+            b"aaabbbcccddd"
+        )
+        # file is emptied when everything it holds is consumed
+        assert buffer._base == 6
+        await buffer.close()
+
+
+class CustomTransport(transport.Transport):
+    pass
+
+
+class TestRegistry:
+    def _class(self, app, url: str):
+        return transport.transport_class(app, transport.make_details(url))
+
+    def test_lazy_import(self):
+        code = "import sys, fpx.app; print({'aiohttp', 'httpx'} & set(sys.modules))"
+        output = subprocess.check_output([sys.executable, "-c", code], text=True)
+        assert output.strip() == "set()"
+
+    def test_builtin(self, app):
+        assert self._class(app, "https://example.com/a") is transport.AioHttpTransport
+        assert self._class(app, "file:///tmp/a") is transport.FileTransport
+
+        app.config.FPX_TRANSPORT = "httpx"
+        assert self._class(app, "https://example.com/a") is transport.HttpxTransport
+
+    def test_rules(self, app):
+        app.config.FPX_TRANSPORT_RULES = {"https://files.example.com/*": "httpx"}
+        assert (
+            self._class(app, "https://files.example.com/a") is transport.HttpxTransport
+        )
+        assert self._class(app, "https://example.com/a") is transport.AioHttpTransport
+
+    async def test_custom(self, app):
+        app.config.FPX_TRANSPORTS = {"custom": f"{__name__}:CustomTransport"}
+        app.config.FPX_TRANSPORT_RULES = {"custom://*": "custom"}
+
+        tp = await transport.choose(SimpleNamespace(app=app), "custom://item")
+        assert isinstance(tp, CustomTransport)
+        assert tp.limits is transport.upstream_limits(app)
+
+    async def test_rule_clients(self, app):
+        app.config.FPX_TRANSPORT_RULES = {"https://files.example.com/*": "httpx"}
+        await transport.open_clients(app)
+        assert app.ctx.aiohttp_session is not None
+        assert app.ctx.httpx_client is None
+
+        request = SimpleNamespace(app=app)
+        first = await transport.choose(request, "https://files.example.com/a")
+        second = await transport.choose(request, "https://files.example.com/b")
+        assert first.client is not None
+        assert first.client is second.client is app.ctx.httpx_client
+
+        await transport.close_clients(app)
+        assert app.ctx.aiohttp_session is None
+        assert app.ctx.httpx_client is None
+
+    def test_unknown(self, app):
+        app.config.FPX_TRANSPORT = "missing"
+        with pytest.raises(exception.ConfigError):
+            self._class(app, "https://example.com/a")
+
+
+class TestStall:
+    def _tp(self, **timeouts: float):
+        details = transport.make_details(
+            {"url": "http://example.com/file.txt", "timeouts": timeouts},
+        )
+        return transport.AioHttpTransport(details, retries=1, backoff=0)
+
+    async def _content(self, *delays: float):
+        for delay in delays:
+            await asyncio.sleep(delay)
+            yield b"x"
+
+    async def _read(self, content):
+        return b"".join([chunk async for chunk in content])
+
+    def test_item_timeouts(self):
+        details = transport.make_details(
+            {"url": "http://example.com", "timeouts": {"idle": 5, "unknown": 1}},
+        )
+        tp = transport.AioHttpTransport(
+            details,
+            timeouts=transport.Timeouts(connect=3, idle=10),
+        )
+        assert tp.timeouts.connect == 3
+        assert tp.timeouts.idle == 5
+
+    async def test_idle(self):
+        tp = self._tp(idle=0.1)
+        assert await self._read(tp.watch(self._content(0, 0.05))) == b"xx"
+
+        with pytest.raises(transport.StallError):
+            await self._read(tp.watch(self._content(0, 0.3)))
+
+    async def test_partial_chunks(self):
+        tp = self._tp(idle=0.1)
+        received = 0
+
+        async def content():
+            nonlocal received
+            for _ in range(5):
+                await asyncio.sleep(0.05)
+                received += 1
+            yield b"xxxxx"
+
+        # upstream sends data, but chunk is not complete yet
+        assert await self._read(tp.watch(content(), lambda: received)) == b"xxxxx"
+
+    async def test_rate(self):
+        tp = self._tp(stall_rate=100, stall_period=0.2)
+        with pytest.raises(transport.StallError):
+            await self._read(tp.watch(self._content(*[0.05] * 10)))
+
+    async def test_slow_consumer(self):
+        tp = self._tp(idle=0.1, stall_rate=100, stall_period=0.1)
+        async for _chunk in tp.watch(self._content(0, 0, 0)):
+            await asyncio.sleep(0.2)
+
+    async def test_resume(self):
+        tp = self._tp(idle=0.1)
+
+        async def send(url, headers, timeout):
+            headers = {"content-range": "bytes 1-1/2", "etag": '"1"'}
+            return 206, headers, tp.watch(_chunks(b"y"))
+
+        tp.send = send
+        content = tp.resumable(
+            tp.watch(self._content(0, 1)),
+            200,
+            {"content-length": "2", "etag": '"1"'},
+            10,
+        )
+        assert await self._read(content) == b"xy"
+
+
+class TestMemoryBudget:
+    async def test_wait(self):
+        budget = transport.MemoryBudget(100)
+        await budget.acquire(60)
+        waiter = asyncio.ensure_future(budget.acquire(60))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        assert not budget.try_acquire(10)
+
+        budget.release(60)
+        await waiter
+        assert budget.used == 60
+
+    async def test_oversized(self):
+        budget = transport.MemoryBudget(100)
+        await budget.acquire(500)
+        assert budget.used == 500
+        assert not budget.try_acquire(1)
+
+    async def test_preferred(self):
+        budget = transport.MemoryBudget(100)
+        owner = object()
+        await budget.acquire(100)
+        waiter = asyncio.ensure_future(budget.acquire(10, owner))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        budget.prefer(owner)
+        await waiter
+        await budget.acquire(10, owner)
+        assert budget.used == 120
+
+        budget.forget(owner)
+        assert not budget.try_acquire(10)
+
+    async def test_cancelled_waiter(self):
+        budget = transport.MemoryBudget(100)
+        await budget.acquire(100)
+        waiter = asyncio.ensure_future(budget.acquire(10))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        budget.release(100)
+        assert budget.used == 0
+
+    async def test_spooled_buffer(self):
+        budget = transport.MemoryBudget(100)
+        buffer = transport.SpooledBuffer(10, budget)
+        await buffer.write(b"hello")
+        assert budget.used == 5
+        assert not buffer.on_disk
+
+        # content that exceeds the buffer goes to disk and frees memory
+        await buffer.write(b" world")
+        assert budget.used == 0
+        assert buffer.on_disk
+        assert buffer.read(0, 100) == b"hello world"
+        buffer.close()
+
+        buffer = transport.SpooledBuffer(10, budget)
+        await buffer.write(b"hello")
+        await buffer.write(b"!", reset=True)
+        assert budget.used == 1
+        assert buffer.read(0, 100) == b"!"
+        buffer.close()
+        assert budget.used == 0
+
+    async def test_spooled_buffer_over_budget(self):
+        budget = transport.MemoryBudget(100)
+        budget.charge(98)
+        buffer = transport.SpooledBuffer(10, budget)
+        await buffer.write(b"hello")
+
+        assert buffer.on_disk
+        assert budget.used == 98
+        assert buffer.read(0, 100) == b"hello"
+        buffer.close()
+
+    async def test_chunk_size(self):
+        budget = transport.MemoryBudget(100 * transport.CHUNK_SIZE)
+        details = transport.ItemDetails.from_str("http://example.com/file.bin")
+        tp = transport.AioHttpTransport(details, budget=budget)
+        assert tp.chunk_size() == transport.MIN_CHUNK_SIZE
+
+        tp.rate = 1024**2
+        assert tp.chunk_size() == 1024**2 * transport.CHUNK_TIME
+
+        tp.rate = 1
+        assert tp.chunk_size() == transport.MIN_CHUNK_SIZE
+
+        tp.rate = 100 * 1024**2
+        assert tp.chunk_size() == transport.CHUNK_SIZE
+
+        budget.charge(budget.limit - transport.CHUNK_SIZE)
+        assert tp.chunk_size() == transport.CHUNK_SIZE // transport.MEMORY_SHARE
+
+    async def test_chunked(self):
+        details = transport.ItemDetails.from_str("http://example.com/file.bin")
+        tp = transport.AioHttpTransport(details)
+        pieces = [b"x" * 100_000] * 20
+        chunks = [chunk async for chunk in tp.chunked(_chunks(*pieces))]
+
+        assert b"".join(chunks) == b"".join(pieces)
+        assert len(chunks) < len(pieces)
+        assert tp.rate > 0
+
+    async def test_slow_content_is_not_held(self):
+        details = transport.ItemDetails.from_str("http://example.com/file.bin")
+        tp = transport.AioHttpTransport(details)
+        loop = asyncio.get_running_loop()
+
+        async def content():
+            for _ in range(8):
+                await asyncio.sleep(0.1)
+                yield b"x" * 1024
+
+        started = loop.time()
+        delays: list[float] = []
+        chunks: list[bytes] = []
+        async for chunk in tp.chunked(content()):
+            delays.append(loop.time() - started)
+            chunks.append(chunk)
+
+        assert b"".join(chunks) == b"x" * 8 * 1024
+        assert len(chunks) > 1
+        assert delays[0] < 0.1 + transport.CHUNK_TIME + 0.1
+
+    async def test_segments(self):
+        data = bytes(range(256)) * 4
+        budget = transport.MemoryBudget(150)
+        details = transport.ItemDetails.from_str("http://example.com/file.bin")
+        tp = transport.AioHttpTransport(
+            details,
+            connections=4,
+            threshold=100,
+            segment_size=100,
+            budget=budget,
+        )
+        active = 0
+        peak = 0
+
+        async def send(url, headers, timeout):
+            nonlocal active, peak
+            start, end = map(int, headers["range"][6:].split("-"))
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            headers = {"content-range": f"bytes {start}-{end}/{len(data)}"}
+            return 206, dict(headers, etag='"1"'), _chunks(data[start : end + 1])
+
+        async def close():
+            pass
+
+        tp.send = send
+        content = tp.segmented(
+            _chunks(data),
+            {"content-length": str(len(data)), "etag": '"1"'},
+            len(data),
+            10,
+            close,
+        )
+        assert b"".join([chunk async for chunk in content]) == data
+        assert peak == 1
+        assert budget.used == 0
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+class TestFileTransport:
+    async def _read(self, url: str, roots: list[str], **headers: str):
+        details = transport.make_details({"url": url, "headers": headers})
+        assert details.url_type is transport.UrlType.File
+
+        source = transport.FileTransport(details, roots)
+        async with source as tp:
+            if tp is None:
+                return None
+            _path, _name, content, _content_type = tp
+            return b"".join([chunk async for chunk in content])
+
+    async def test_read(self, tmp_path):
+        path = tmp_path / "file.txt"
+        path.write_bytes(b"hello world")
+
+        assert await self._read(path.as_uri(), [str(tmp_path)]) == b"hello world"
+        assert (
+            await self._read(path.as_uri(), [str(tmp_path)], range="bytes=6-")
+            == b"world"
+        )
+
+    async def test_outside_of_roots(self, tmp_path):
+        root = tmp_path / "root"
+        root.mkdir()
+        path = tmp_path / "secret.txt"
+        path.write_bytes(b"secret")
+        (root / "link.txt").symlink_to(path)
+
+        assert await self._read(path.as_uri(), [str(root)]) is None
+        assert await self._read((root / "link.txt").as_uri(), [str(root)]) is None
+        assert await self._read((root / "missing").as_uri(), [str(root)]) is None
+        assert await self._read(root.as_uri(), [str(root)]) is None
+
+    async def test_probe(self, tmp_path):
+        path = tmp_path / "file.txt"
+        path.write_bytes(b"hello world")
+        details = transport.ItemDetails.from_str(path.as_uri())
+
+        info = await transport.FileTransport(details, [str(tmp_path)]).probe()
+        assert info is not None
+        assert info.name == "file.txt"
+        assert info.size == 11
+        assert info.content_type == "text/plain"
+
+    async def test_filesystem_is_not_accessed_by_loop(self, tmp_path, monkeypatch):
+        path = tmp_path / "file.txt"
+        path.write_bytes(b"hello world")
+        threads: list[int] = []
+        original = transport.FileTransport._open
+
+        def _open(self, url):
+            threads.append(threading.get_ident())
+            return original(self, url)
+
+        monkeypatch.setattr(transport.FileTransport, "_open", _open)
+        assert await self._read(path.as_uri(), [str(tmp_path)]) == b"hello world"
+
+        details = transport.ItemDetails.from_str(path.as_uri())
+        assert await transport.FileTransport(details, [str(tmp_path)]).probe()
+
+        assert len(threads) == 2
+        assert threading.get_ident() not in threads
+
+
+class TestAzureBlob:
+    data = bytes(range(256)) * 4
+
+    @pytest.fixture()
+    def tp(self):
+        pytest.importorskip("azure.storage.blob")
+        url = "https://acc.blob.core.windows.net/container/dir/file.bin"
+        details = transport.ItemDetails.from_str(url)
+        tp = transport.AzureBlobTransport(
+            details,
+            connections=3,
+            threshold=100,
+            segment_size=100,
+        )
+        tp.received = transport.ItemInfo(
+            details.path,
+            "file.bin",
+            len(self.data),
+            None,
+            '"1"',
+        )
+        return tp
+
+    def test_location(self):
+        assert transport._blob_location(
+            "https://acc.blob.core.windows.net/c/dir/a%20b.txt?sig=x&versionid=1",
+        ) == (
+            "https://acc.blob.core.windows.net",
+            "c",
+            "dir/a b.txt",
+            {"version_id": "1", "credential": "sig=x"},
+        )
+        with pytest.raises(ValueError):  # noqa: PT011
+            transport._blob_location("https://acc.blob.core.windows.net/c")
+
+    def test_path_style_location(self):
+        assert transport._blob_location(
+            "http://127.0.0.1:10000/devstoreaccount1/c/dir/a.txt?sig=x",
+        ) == (
+            "http://127.0.0.1:10000/devstoreaccount1",
+            "c",
+            "dir/a.txt",
+            {"credential": "sig=x"},
+        )
+        assert transport._blob_location(
+            "http://localhost:10000/devstoreaccount1/c/a.txt",
+        )[:3] == ("http://localhost:10000/devstoreaccount1", "c", "a.txt")
+        with pytest.raises(ValueError):  # noqa: PT011
+            transport._blob_location("http://127.0.0.1:10000/devstoreaccount1/c")
+
+    async def test_shared_clients(self, tp):
+        tp.clients = {}
+        first = tp.blob_client("https://acc.blob.core.windows.net/c/a.txt?sig=x")
+        second = tp.blob_client("https://acc.blob.core.windows.net/d/b.txt?sig=y")
+        await first.close()
+        await second.close()
+
+        # SAS token is not a part of the key, so sessions don't pile up
+        # when every ticket brings a new token
+        assert list(tp.clients) == ["https://acc.blob.core.windows.net"]
+        assert not tp.clients["https://acc.blob.core.windows.net"].closed
+        assert first.url == "https://acc.blob.core.windows.net/c/a.txt?sig=x"
+        assert second.url == "https://acc.blob.core.windows.net/d/b.txt?sig=y"
+        await tp.clients.popitem()[1].close()
+
+    async def test_segments(self, tp):
+        requests: list[tuple[int, int]] = []
+        data = self.data
+
+        class Stream:
+            def __init__(self, offset: int, length: int):
+                self.offset = offset
+                self.length = length
+
+            async def chunks(self):
+                await asyncio.sleep((len(data) - self.offset) / 10000)
+                middle = self.offset + self.length // 2
+                yield data[self.offset : middle]
+                if self.offset % 100 == 0:
+                    raise ConnectionError
+                yield data[middle : self.offset + self.length]
+
+        class Blob:
+            blob_name = "file.bin"
+
+            async def download_blob(self, offset, length, **kwargs):
+                assert kwargs["etag"] == '"1"'
+                requests.append((offset, length))
+                return Stream(offset, length)
+
+        content = tp.content_iterator(Blob())
+        assert b"".join([chunk async for chunk in content]) == self.data
+        assert sorted(requests)[:4] == [(0, 100), (50, 50), (100, 100), (150, 50)]
+        assert len(requests) == 22
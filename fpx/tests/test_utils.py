@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from fpx import exception, transport, utils
+
+
+class TestParseRange:
+    @pytest.mark.parametrize(
+        ("header", "expected"),
+        [
+            ("bytes=0-9", (0, 9)),
+            ("bytes=5-", (5, 99)),
+            ("bytes=-10", (90, 99)),
+            ("bytes=-1000", (0, 99)),
+            ("bytes=90-1000", (90, 99)),
+        ],
+    )
+    def test_valid(self, header, expected):
+        assert utils.parse_range(header, 100) == expected
+
+    @pytest.mark.parametrize(
+        "header",
+        ["items=0-9", "bytes=0-9,20-29", "bytes=9-0", "bytes=a-b", "bytes=10"],
+    )
+    def test_ignored(self, header):
+        assert utils.parse_range(header, 100) is None
+
+    @pytest.mark.parametrize("header", ["bytes=100-", "bytes=-0"])
+    def test_not_satisfiable(self, header):
+        with pytest.raises(exception.RangeError):
+            utils.parse_range(header, 100)
+
+
+async def _content(chunks: list[bytes], delay: float = 0):
+    for chunk in chunks:
+        await asyncio.sleep(delay)
+        yield chunk
+
+
+async def _coalesce(*args, **kwargs) -> list[bytes]:
+    return [chunk async for chunk in utils.coalesce(*args, **kwargs)]
+
+
+class TestCoalesce:
+    async def test_small_chunks_are_merged(self):
+        result = await _coalesce(_content([b"a"] * 10), 4, 1)
+        assert result == [b"aaaa", b"aaaa", b"aa"]
+
+    async def test_large_chunks_are_passed(self):
+        result = await _coalesce(_content([b"aaaaa", b"b", b"cccccc"]), 4, 1)
+        assert result == [b"aaaaa", b"bcccccc"]
+
+    async def test_disabled(self):
+        result = await _coalesce(_content([b"a"] * 3), 0, 1)
+        assert result == [b"a", b"a", b"a"]
+
+    async def test_latency(self):
+        result = await _coalesce(_content([b"a"] * 4, 0.03), 100, 0.04)
+        assert b"".join(result) == b"aaaa"
+        assert len(result) > 1
+
+    async def test_budget(self):
+        budget = transport.MemoryBudget(10)
+        used: list[int] = []
+
+        async def content():
+            for _ in range(3):
+                yield b"aa"
+                used.append(budget.used)
+
+        result = await _coalesce(content(), 4, 1, budget)
+        assert result == [b"aaaa", b"aa"]
+        assert used == [2, 0, 2]
+        assert budget.used == 0
+
+    async def test_exhausted_budget(self):
+        budget = transport.MemoryBudget(10)
+        budget.charge(8)
+        result = await _coalesce(_content([b"a"] * 3), 4, 1, budget)
+        assert result == [b"a", b"a", b"a"]
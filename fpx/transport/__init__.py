@@ -0,0 +1,1701 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import dataclasses
+import enum
+import fnmatch
+import functools
+import importlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from importlib.metadata import entry_points
+from typing import (
+    IO,
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Coroutine,
+    Iterable,
+    Mapping,
+    cast,
+)
+from urllib.parse import unquote, unquote_plus, urlparse
+
+from fpx import cache, utils
+from fpx.cache import CachedResponse, ResponseCache
+from fpx.exception import (
+    ConfigError,
+    RangeError,
+    SizeMismatchError,
+    TransportError,
+    UrlNotAvailableError,
+)
+from fpx.types import App, Request
+
+log = logging.getLogger(__name__)
+request_timeout = 24 * 60 * 60
+disposition_re = re.compile('filename="(.+)"')
+
+CHUNK_SIZE = 1024**2
+
+# chunks of upstream content are big enough to hold data received during
+# CHUNK_TIME seconds, but not bigger than CHUNK_SIZE and not bigger than
+# 1/MEMORY_SHARE of the free memory budget. Data is never held longer than
+# CHUNK_TIME seconds
+MIN_CHUNK_SIZE = 64 * 1024
+CHUNK_TIME = 0.25
+MEMORY_SHARE = 8
+
+
+class UrlType(enum.Enum):
+    Generic = enum.auto()
+    AzureBlob = enum.auto()
+    File = enum.auto()
+
+
+@dataclasses.dataclass
+class ItemDetails:
+    url: str
+    name: str
+
+    path: str = ""
+    headers: dict[str, Any] = dataclasses.field(default_factory=dict)
+    url_type = UrlType.Generic
+
+    # inclusive range of bytes, when only part of content is required
+    byte_range: tuple[int, int] | None = None
+
+    # overrides of upstream timeouts, e.g. `{"idle": 30}`
+    timeouts: dict[str, float] = dataclasses.field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, item: dict[str, Any]):
+        url = item["url"]
+
+        details = cls(
+            url,
+            item.get("name") or _name_from_url(url),
+        )
+
+        if path := item.get("path"):
+            details.path = path
+
+        if headers := item.get("headers"):
+            details.headers = headers
+
+        if timeouts := item.get("timeouts"):
+            known = {field.name for field in dataclasses.fields(Timeouts)}
+            details.timeouts = {
+                name: value
+                for name, value in timeouts.items()
+                if name in known and isinstance(value, (int, float))
+            }
+
+        return details
+
+    @classmethod
+    def from_str(cls, url: str):
+        return cls(
+            url,
+            _name_from_url(url),
+        )
+
+    def source_key(self) -> str:
+        """Identifier of the upstream content, shared by duplicated items."""
+        return json.dumps([self.url, self.headers], sort_keys=True)
+
+    def __post_init__(self):
+        try:
+            self.name = os.path.basename(
+                unquote_plus(unquote_plus(unquote_plus(self.name))),
+            )
+        except Exception:
+            log.exception("Cannot simplify name: %s", self.name)
+
+        self.url_type = _guess_url_type(self.url)
+
+
+@dataclasses.dataclass
+class Timeouts:
+    """Limits of upstream requests in seconds. Zero disables the limit.
+
+    `ttfb` limits time between request and response headers. `idle` limits
+    time without any data from upstream and download is considered stalled
+    when it receives less than `stall_rate` bytes per second during
+    `stall_period` seconds.
+    """
+
+    total: float = request_timeout
+    connect: float = 0
+    ttfb: float = 0
+    idle: float = 0
+    stall_rate: float = 0
+    stall_period: float = 60
+
+    @classmethod
+    def from_config(cls, config: Any):
+        return cls(
+            config.FPX_UPSTREAM_TIMEOUT,
+            config.FPX_UPSTREAM_CONNECT_TIMEOUT,
+            config.FPX_UPSTREAM_TTFB_TIMEOUT,
+            config.FPX_UPSTREAM_IDLE_TIMEOUT,
+            config.FPX_UPSTREAM_STALL_RATE,
+            config.FPX_UPSTREAM_STALL_PERIOD,
+        )
+
+
+class StallError(asyncio.TimeoutError):
+    """Upstream stopped sending data or sends it too slowly."""
+
+
+@dataclasses.dataclass
+class ItemInfo:
+    """Details of the item known before downloading its content."""
+
+    path: str
+    name: str
+    size: int | None
+    content_type: str | None
+    etag: str | None = None
+
+    # inclusive range of bytes in the response, when it contains only part
+    # of content
+    byte_range: tuple[int, int] | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]):
+        info = cls(**data)
+        if info.byte_range:
+            info.byte_range = cast("tuple[int, int]", tuple(info.byte_range))
+
+        return info
+
+    def for_json(self) -> dict[str, Any]:
+        return dataclasses.asdict(self)
+
+
+def make_details(item: dict[str, Any] | str) -> ItemDetails:
+    if isinstance(item, dict):
+        return ItemDetails.from_dict(item)
+
+    return ItemDetails.from_str(item)
+
+
+# transports shipped with FPX, as `module:attribute`
+builtin_transports = {
+    "aiohttp": "fpx.transport.http_aiohttp:AioHttpTransport",
+    "httpx": "fpx.transport.http_httpx:HttpxTransport",
+    "azure": "fpx.transport.azure_blob:AzureBlobTransport",
+    "file": "fpx.transport:FileTransport",
+}
+
+# transports used by default for special URLs
+_url_type_transports = {
+    UrlType.File: "file",
+    UrlType.AzureBlob: "azure",
+}
+
+# attributes of the package defined by lazily imported modules
+_lazy_attributes = {
+    "AioHttpTransport": "http_aiohttp",
+    "HttpxTransport": "http_httpx",
+    "AzureBlobTransport": "azure_blob",
+    "_blob_location": "azure_blob",
+}
+
+_loaded: dict[str, type[Transport]] = {}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _lazy_attributes:
+        module = importlib.import_module(f"{__name__}.{_lazy_attributes[name]}")
+        return getattr(module, name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@functools.lru_cache(maxsize=None)
+def plugin_transports() -> dict[str, str]:
+    """Transports registered by other packages via `fpx.transports` entry points."""
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        group = eps.select(group="fpx.transports")
+    else:
+        group = eps.get("fpx.transports", [])
+
+    return {ep.name: ep.value for ep in group}
+
+
+def registered_transports(app: App) -> dict[str, str]:
+    """All available transports, mapped to their import locations."""
+    return {
+        **builtin_transports,
+        **plugin_transports(),
+        **app.config.FPX_TRANSPORTS,
+    }
+
+
+def load_transport(app: App, name: str) -> type[Transport]:
+    """Import transport when it's used for the first time."""
+    target = registered_transports(app).get(name)
+    if not target:
+        raise ConfigError({"transport": f"Unknown transport: {name}"})
+
+    if target not in _loaded:
+        module, _sep, attr = target.partition(":")
+        _loaded[target] = getattr(importlib.import_module(module), attr)
+        log.debug("Loaded transport %s from %s", name, target)
+
+    return _loaded[target]
+
+
+def transport_class(app: App, details: ItemDetails) -> type[Transport]:
+    """Choose transport for the item.
+
+    Rules from `FPX_TRANSPORT_RULES` are checked first, in order. Then
+    `file://` and Azure URLs get their dedicated transports, unless
+    optional dependency is missing. Everything else uses `FPX_TRANSPORT`.
+    """
+    config = app.config
+    for pattern, name in config.FPX_TRANSPORT_RULES.items():
+        if fnmatch.fnmatchcase(details.url, pattern):
+            return load_transport(app, name)
+
+    if name := _url_type_transports.get(details.url_type):
+        try:
+            return load_transport(app, name)
+        except ImportError:
+            log.debug("Transport %s is not available for %s", name, details.url)
+
+    return load_transport(app, config.FPX_TRANSPORT)
+
+
+def transport_options(request: Request) -> dict[str, Any]:
+    """Options shared by transports of upstream requests."""
+    config = request.app.config
+    return {
+        "limits": upstream_limits(request.app),
+        "owner": id(request),
+        "retries": config.FPX_UPSTREAM_RETRIES,
+        "backoff": config.FPX_UPSTREAM_RETRY_BACKOFF,
+        "connections": config.FPX_PARALLEL_CONNECTIONS,
+        "threshold": config.FPX_PARALLEL_THRESHOLD,
+        "segment_size": config.FPX_PARALLEL_SEGMENT_SIZE,
+        "timeouts": Timeouts.from_config(config),
+        "budget": memory_budget(request.app),
+    }
+
+
+async def choose(
+    request: Request,
+    item: dict[str, Any] | str,
+    byte_range: tuple[int, int] | None = None,
+) -> Transport:
+    details = make_details(item)
+    details.byte_range = byte_range
+
+    factory = await use_transport(request.app, transport_class(request.app, details))
+    return factory.create(request, details)
+
+
+async def use_transport(app: App, factory: type[Transport]) -> type[Transport]:
+    """Open shared clients of transport, when worker uses it for the first time."""
+    if factory not in app.ctx.transports:
+        # mark transport before opening, so concurrent items don't open
+        # clients twice
+        app.ctx.transports.add(factory)
+        try:
+            await factory.open_clients(app)
+        except BaseException:
+            app.ctx.transports.discard(factory)
+            raise
+
+    return factory
+
+
+async def open_clients(app: App):
+    """Create HTTP clients shared by all transports of the worker.
+
+    Clients keep connections to upstreams alive and reuse them for
+    subsequent items. Only the default transport is opened here, clients of
+    other transports are created when the transport is chosen for the
+    first time.
+    """
+    await use_transport(app, load_transport(app, app.config.FPX_TRANSPORT))
+
+
+async def close_clients(app: App):
+    while app.ctx.transports:
+        await app.ctx.transports.pop().close_clients(app)
+
+
+class FairSemaphore:
+    """Semaphore that serves waiters of different owners in turns.
+
+    Waiters of the same owner are served in FIFO order, while owners take
+    turns, so a ticket with many items cannot starve other tickets. Zero
+    limit means that slots are never exhausted.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+
+        # number of slots that were not available immediately and total
+        # time spent waiting for them
+        self.waits = 0
+        self.wait_time = 0.0
+
+        self._waiters: OrderedDict[Any, deque[asyncio.Future[None]]] = OrderedDict()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    def idle(self) -> bool:
+        return not self.active and not self._waiters
+
+    def exhausted(self) -> bool:
+        return bool(self.limit) and self.active >= self.limit
+
+    def try_acquire(self) -> bool:
+        """Take a slot if it's free and nobody is waiting for it."""
+        if self._waiters or self.exhausted():
+            return False
+
+        self.active += 1
+        return True
+
+    async def acquire(self, owner: Any) -> float:
+        """Take a slot and return number of seconds spent waiting for it."""
+        if self.try_acquire():
+            return 0.0
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        waiter: asyncio.Future[None] = loop.create_future()
+        self._waiters.setdefault(owner, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # slot was granted right before cancellation
+                self.release()
+            else:
+                self._discard(owner, waiter)
+            raise
+
+        waited = loop.time() - started
+        self.waits += 1
+        self.wait_time += waited
+        return waited
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _discard(self, owner: Any, waiter: asyncio.Future[None]):
+        queue = self._waiters.get(owner)
+        if queue is None:
+            return
+
+        with contextlib.suppress(ValueError):
+            queue.remove(waiter)
+
+        if not queue:
+            del self._waiters[owner]
+
+    def _wake(self):
+        while self._waiters and not self.exhausted():
+            owner, queue = self._waiters.popitem(last=False)
+            waiter = queue.popleft()
+            if queue:
+                # the rest of waiters of the owner go to the end of the line
+                self._waiters[owner] = queue
+
+            if waiter.done():
+                continue
+
+            self.active += 1
+            waiter.set_result(None)
+
+
+class UpstreamLimits:
+    """Slots of connections to upstreams, shared by the whole worker.
+
+    Every request to upstream occupies a slot of its host and a slot of the
+    global limit. Limit of the host is taken from the first pattern in
+    `host_limits` that matches the hostname, or from `host_limit` if none of
+    them matches.
+
+    Semaphores of idle hosts are dropped, but their waits are kept for
+    statistics.
+    """
+
+    def __init__(
+        self,
+        limit: int,
+        host_limit: int,
+        host_limits: Mapping[str, int] | None = None,
+    ):
+        self.total = FairSemaphore(limit)
+        self.host_limit = host_limit
+        self.host_limits = dict(host_limits or {})
+        self.hosts: dict[str, FairSemaphore] = {}
+        # number of waits and time spent waiting by dropped semaphores
+        self.history: dict[str, tuple[int, float]] = {}
+
+    def limit_of(self, host: str) -> int:
+        for pattern, limit in self.host_limits.items():
+            if fnmatch.fnmatchcase(host, pattern.lower()):
+                return limit
+
+        return self.host_limit
+
+    def _host(self, url: str) -> str:
+        host = urlparse(url).hostname or ""
+        if host not in self.hosts:
+            self.hosts[host] = FairSemaphore(self.limit_of(host))
+        return host
+
+    def capacity(self, url: str) -> int:
+        """Max number of simultaneous requests to URL. Zero means no limit."""
+        host = urlparse(url).hostname or ""
+        limits = [limit for limit in (self.total.limit, self.limit_of(host)) if limit]
+        return min(limits, default=0)
+
+    def try_acquire(self, url: str) -> bool:
+        """Take a slot without waiting, if it's free right now."""
+        host = self._host(url)
+        if not self.hosts[host].try_acquire():
+            if self.hosts[host].idle():
+                self._drop(host)
+            return False
+
+        if not self.total.try_acquire():
+            self._release_host(host)
+            return False
+
+        return True
+
+    async def acquire(self, url: str, owner: Any):
+        host = self._host(url)
+        semaphore = self.hosts[host]
+        waited = await semaphore.acquire(owner)
+        try:
+            waited += await self.total.acquire(owner)
+        except BaseException:
+            self._release_host(host)
+            raise
+
+        if waited:
+            log.debug(
+                "Waited %.3fs for connection to %s. Host: %s active, %s waiting. "
+                "Total: %s active, %s waiting",
+                waited,
+                host,
+                semaphore.active,
+                semaphore.waiting,
+                self.total.active,
+                self.total.waiting,
+            )
+
+    def release(self, url: str):
+        self.total.release()
+        self._release_host(urlparse(url).hostname or "")
+
+    def _release_host(self, host: str):
+        semaphore = self.hosts[host]
+        semaphore.release()
+        if semaphore.idle():
+            self._drop(host)
+
+    def _drop(self, host: str):
+        semaphore = self.hosts.pop(host)
+        waits, wait_time = self.history.get(host, (0, 0.0))
+        self.history[host] = (
+            waits + semaphore.waits,
+            wait_time + semaphore.wait_time,
+        )
+
+    def stats(self) -> dict[str, Any]:
+        """Occupancy of slots and time spent waiting for them."""
+        hosts: dict[str, Any] = {}
+        for host in dict.fromkeys([*self.history, *self.hosts]):
+            semaphore = self.hosts.get(host) or FairSemaphore(self.limit_of(host))
+            waits, wait_time = self.history.get(host, (0, 0.0))
+            hosts[host] = {
+                "limit": semaphore.limit,
+                "active": semaphore.active,
+                "waiting": semaphore.waiting,
+                "waits": waits + semaphore.waits,
+                "wait_time": wait_time + semaphore.wait_time,
+            }
+
+        return {
+            "active": self.total.active,
+            "waiting": self.total.waiting,
+            "waits": self.total.waits,
+            "wait_time": self.total.wait_time,
+            "hosts": hosts,
+        }
+
+
+def upstream_limits(app: App) -> UpstreamLimits:
+    """Connection slots of the current worker."""
+    if app.ctx.upstream_limits is None:
+        config = app.config
+        app.ctx.upstream_limits = UpstreamLimits(
+            config.FPX_UPSTREAM_LIMIT,
+            config.FPX_UPSTREAM_HOST_LIMIT,
+            config.FPX_UPSTREAM_HOST_LIMITS,
+        )
+
+    return app.ctx.upstream_limits
+
+
+async def report_upstream_stats(app: App):
+    """Log usage of upstream slots periodically, if it's enabled."""
+    interval = app.config.FPX_UPSTREAM_STATS_INTERVAL
+    if not interval:
+        return
+
+    while True:
+        await asyncio.sleep(interval)
+        log.info("Upstream slots: %s", upstream_limits(app).stats())
+
+
+class MemoryBudget:
+    """Bytes of content buffered by the worker.
+
+    Content that is held in memory until it's consumed draws from the budget
+    and returns its part once it's consumed. Requests that do not fit wait
+    in FIFO order, so a fast producer has to wait for slow consumers. Zero
+    limit means that memory is only counted.
+
+    Owners marked as preferred take memory without waiting, even if the
+    budget is exceeded. Content that is consumed right now must never wait
+    for content that is consumed later, otherwise they block each other.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._waiters: deque[tuple[int, Any, asyncio.Future[None]]] = deque()
+        self._preferred: set[Any] = set()
+
+    def available(self) -> int:
+        return max(self.limit - self.used, 0)
+
+    def fits(self, size: int) -> bool:
+        # request bigger than the limit is served when nothing else is used
+        return not self.limit or self.used + size <= self.limit or not self.used
+
+    def try_acquire(self, size: int) -> bool:
+        """Take memory if it's available without waiting."""
+        if self._waiters or not self.fits(size):
+            return False
+
+        self.used += size
+        return True
+
+    def charge(self, size: int):
+        """Take memory unconditionally."""
+        self.used += size
+
+    async def acquire(self, size: int, owner: Any = None):
+        """Take memory, waiting until it's released by others if necessary."""
+        if owner is not None and owner in self._preferred:
+            self.charge(size)
+            return
+
+        if self.try_acquire(size):
+            return
+
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        entry = (size, owner, waiter)
+        self._waiters.append(entry)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # memory was granted right before cancellation
+                self.release(size)
+            else:
+                with contextlib.suppress(ValueError):
+                    self._waiters.remove(entry)
+                self._wake()
+            raise
+
+    def release(self, size: int):
+        self.used -= size
+        self._wake()
+
+    def prefer(self, owner: Any):
+        """Let the owner take memory without waiting, until it's forgotten."""
+        self._preferred.add(owner)
+        for entry in [entry for entry in self._waiters if entry[1] is owner]:
+            self._waiters.remove(entry)
+            size, _owner, waiter = entry
+            if not waiter.done():
+                self.charge(size)
+                waiter.set_result(None)
+
+        self._wake()
+
+    def forget(self, owner: Any):
+        self._preferred.discard(owner)
+
+    def _wake(self):
+        while self._waiters and self.fits(self._waiters[0][0]):
+            size, _owner, waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+
+            self.charge(size)
+            waiter.set_result(None)
+
+
+def memory_budget(app: App) -> MemoryBudget:
+    """Memory budget of the current worker."""
+    if app.ctx.memory_budget is None:
+        app.ctx.memory_budget = MemoryBudget(app.config.FPX_MEMORY_BUDGET)
+
+    return app.ctx.memory_budget
+
+
+class SpooledBuffer:
+    """Temporary file that keeps up to `max_size` bytes of content in memory.
+
+    Memory is taken from the budget without waiting, because readers of the
+    buffer may be blocked by its writer. Content that does not fit into the
+    budget is moved to disk instead. `read` is blocking and must be called
+    in executor.
+    """
+
+    def __init__(self, max_size: int, budget: MemoryBudget | None = None):
+        self.max_size = max_size
+        self.budget = budget or MemoryBudget(0)
+        self.length = 0
+        self.charged = 0
+        self.on_disk = False
+        self._file = tempfile.SpooledTemporaryFile(max_size)  # noqa: SIM115
+        self._lock = threading.Lock()
+
+    def _write(self, data: bytes, reset: bool, rollover: bool):
+        with self._lock:
+            if reset:
+                self._file.seek(0)
+                self._file.truncate()
+            if rollover:
+                self._file.rollover()
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(data)
+
+    async def write(self, data: bytes, reset: bool = False):
+        """Append data, optionally dropping the previous content."""
+        if reset:
+            self.length = 0
+            self.budget.release(self.charged)
+            self.charged = 0
+
+        size = len(data)
+        if not self.on_disk:
+            if self.length + size <= self.max_size and self.budget.try_acquire(size):
+                self.charged += size
+            else:
+                self.on_disk = True
+                self.budget.release(self.charged)
+                self.charged = 0
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, data, reset, self.on_disk)
+        self.length += size
+
+    def read(self, offset: int, size: int) -> bytes:
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+        self.budget.release(self.charged)
+        self.charged = 0
+
+
+async def probe_many(
+    request: Request,
+    items: Iterable[dict[str, Any] | str],
+    concurrency: int,
+) -> list[ItemInfo | None]:
+    """Probe multiple items simultaneously.
+
+    Duplicated items are probed only once.
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    probes: dict[str, asyncio.Future[ItemInfo | None]] = {}
+
+    async def probe(item: dict[str, Any] | str):
+        async with semaphore:
+            source = await choose(request, item)
+            return await source.probe()
+
+    async def probe_once(item: dict[str, Any] | str):
+        details = make_details(item)
+        key = details.source_key()
+        if key not in probes:
+            probes[key] = asyncio.ensure_future(probe(item))
+
+        info = await probes[key]
+        if info is None:
+            return None
+
+        return dataclasses.replace(
+            info,
+            path=details.path,
+            name=details.name or info.name,
+        )
+
+    return await asyncio.gather(*[probe_once(item) for item in items])
+
+
+def _name_from_url(url: str) -> str:
+    parsed = urlparse(url)
+    name = parsed.path.rstrip("/")
+
+    if not name:
+        name = parsed.hostname
+
+    if not name:
+        name = url
+
+    return os.path.basename(name)
+
+
+def _guess_url_type(url: str) -> UrlType:
+    parsed = urlparse(url)
+
+    if parsed.scheme == "file":
+        return UrlType.File
+
+    if host := parsed.hostname:
+        if host.endswith(".blob.core.windows.net"):
+            return UrlType.AzureBlob
+
+    return UrlType.Generic
+
+
+def _size_from_headers(status: int, headers: Mapping[str, str]) -> int | None:
+    """Compute size of the content using response headers."""
+    if headers.get("content-encoding", "identity") != "identity":
+        # transports decode content, so its size is unknown
+        return None
+
+    if status == 206:  # noqa: PLR2004
+        total = headers.get("content-range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+
+    length = headers.get("content-length", "")
+    return int(length) if length.isdigit() else None
+
+
+def _range_from_headers(
+    status: int,
+    headers: Mapping[str, str],
+) -> tuple[int, int] | None:
+    """Inclusive range of bytes in the partial response."""
+    if status != 206:  # noqa: PLR2004
+        return None
+
+    spec = headers.get("content-range", "").partition(" ")[2].partition("/")[0]
+    first, _sep, last = spec.partition("-")
+    if not first.isdigit() or not last.isdigit():
+        return None
+
+    return int(first), int(last)
+
+
+def local_path(url: str, roots: Iterable[str]) -> str:
+    """Path of the file referenced by file:// URL.
+
+    Symlinks are resolved and the file must be located inside one of
+    `roots`, otherwise UrlNotAvailableError is raised.
+    """
+    parsed = urlparse(url)
+    if parsed.netloc not in ("", "localhost"):
+        log.warning("Remote host in file URL is not supported: %s", url)
+        raise UrlNotAvailableError(404)
+
+    path = os.path.realpath(unquote(parsed.path))
+    for root in map(os.path.realpath, roots):
+        if os.path.commonpath([root, path]) == root:
+            return path
+
+    log.warning("File %s is outside of allowed roots", path)
+    raise UrlNotAvailableError(403)
+
+
+def _validator(headers: Mapping[str, str]) -> str | None:
+    """Value of If-Range header that protects the rest of the content."""
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+
+    return headers.get("last-modified")
+
+
+async def slice_content(
+    content: AsyncIterable[bytes],
+    start: int,
+    end: int,
+) -> AsyncIterable[bytes]:
+    """Select inclusive range of bytes from content."""
+    position = 0
+    async for chunk in content:
+        size = len(chunk)
+        if position + size > start:
+            yield chunk[max(start - position, 0) : end + 1 - position]
+
+        position += size
+        if position > end:
+            break
+
+
+class Transport:
+    # failures that are reported without interrupting download of the ticket
+    request_errors: tuple[type[BaseException], ...] = (
+        TransportError,
+        asyncio.TimeoutError,
+    )
+
+    # failures that may disappear if request is repeated
+    resumable_errors: tuple[type[BaseException], ...] = (
+        asyncio.TimeoutError,
+        ConnectionError,
+    )
+
+    @classmethod
+    def create(cls, request: Request, details: ItemDetails) -> Transport:
+        """Transport for the item requested by the client."""
+        return cls(details, **transport_options(request))
+
+    @classmethod
+    async def open_clients(cls, app: App):
+        """Create clients shared by all transports of the worker."""
+
+    @classmethod
+    async def close_clients(cls, app: App):
+        """Close clients shared by all transports of the worker."""
+
+    def __init__(
+        self,
+        details: ItemDetails,
+        cache: ResponseCache | None = None,
+        client: Any = None,
+        *,
+        limits: UpstreamLimits | None = None,
+        owner: Any = None,
+        retries: int = 0,
+        backoff: float = 1.0,
+        connections: int = 1,
+        threshold: int = 0,
+        segment_size: int = 8 * CHUNK_SIZE,
+        timeouts: Timeouts | None = None,
+        budget: MemoryBudget | None = None,
+    ):
+        self.exit_callbacks: list[Callable[[], Coroutine[Any, Any, None]]] = []
+        self.details = details
+        self.cache = cache
+
+        # connection slots of the worker. Waiters with the same owner share
+        # one place in the line
+        self.limits = limits
+        self.owner = owner
+
+        # content is requested again from the last received byte up to
+        # `retries` times, after exponentially growing delay
+        self.retries = retries
+        self.backoff = backoff
+
+        # content bigger than `threshold` is downloaded in segments, using
+        # up to `connections` simultaneous requests
+        self.connections = connections
+        self.threshold = threshold
+        self.segment_size = segment_size
+        self.holds_slot = False
+
+        # global timeouts, overridden by the item
+        self.timeouts = dataclasses.replace(
+            timeouts or Timeouts(),
+            **details.timeouts,
+        )
+
+        # buffered content of the worker. Size of chunks follows throughput
+        # of the upstream, measured in bytes per second
+        self.budget = budget or MemoryBudget(0)
+        self.rate = 0.0
+
+        # HTTP client shared by the worker. When it's missing, transport
+        # creates its own client
+        self.client = client
+        self.cached: CachedResponse | None = None
+
+        # details of the item taken from the response to the content request
+        self.received: ItemInfo | None = None
+
+    async def get(
+        self, url: str, headers: dict[str, Any], timeout: int
+    ) -> tuple[AsyncIterable[bytes], str | None, str]:
+        raise NotImplementedError
+
+    async def info(self, url: str, headers: dict[str, Any], timeout: int) -> ItemInfo:
+        raise NotImplementedError
+
+    async def probe(self) -> ItemInfo | None:
+        """Get details of the item without downloading its content."""
+        details = self.details
+        await self.acquire_slot()
+        try:
+            log.debug("Probe %s", details.url)
+            return await self.info(
+                details.url,
+                headers=details.headers,
+                timeout=self.timeouts.total,
+            )
+
+        except self.request_errors:
+            log.exception("Cannot probe %s", details.url)
+
+        finally:
+            await self.release_slot()
+
+        return None
+
+    async def acquire_slot(self):
+        if self.limits:
+            await self.limits.acquire(self.details.url, self.owner)
+            self.holds_slot = True
+
+    async def release_slot(self):
+        if self.limits and self.holds_slot:
+            self.holds_slot = False
+            self.limits.release(self.details.url)
+
+    def parallel(self) -> bool:
+        """Whether content can be downloaded using simultaneous requests."""
+        if self.connections < 2 or not self.threshold:  # noqa: PLR2004
+            return False
+
+        # the only slot of the upstream is taken by the transport itself
+        capacity = self.limits.capacity(self.details.url) if self.limits else 0
+        return capacity != 1
+
+    @contextlib.asynccontextmanager
+    async def segment_slots(
+        self,
+        busy: bool = False,
+    ) -> AsyncIterator[asyncio.Semaphore]:
+        """Connection slots shared by segments of the item.
+
+        Segments use the slot of the transport and additional slots that
+        are free right now. They never wait for slots of other transports:
+        items of the same ticket hold slots while their content waits for
+        its turn, so waiting segments could block the whole ticket. When the
+        slot of the transport is `busy` with the original response, it's
+        handed over to segments by releasing the semaphore.
+        """
+        extra = self.connections - 1
+        if self.limits:
+            extra = 0
+            while extra < self.connections - 1 and self.limits.try_acquire(
+                self.details.url,
+            ):
+                extra += 1
+
+        slots = asyncio.Semaphore(extra if busy else extra + 1)
+        try:
+            yield slots
+
+        finally:
+            if self.limits:
+                for _ in range(extra):
+                    self.limits.release(self.details.url)
+
+    async def __aenter__(
+        self,
+    ) -> tuple[str, str, AsyncIterable[bytes], str | None] | None:
+        await self.acquire_slot()
+        self.exit_callbacks.append(self.release_slot)
+        try:
+            return await self.open()
+        except BaseException:
+            await self.__aexit__()
+            raise
+
+    async def open(self) -> tuple[str, str, AsyncIterable[bytes], str | None] | None:
+        details = self.details
+
+        if self.cache:
+            loop = asyncio.get_running_loop()
+            self.cached = await loop.run_in_executor(
+                None,
+                self.cache.lookup,
+                details.url,
+                details.headers,
+            )
+            if self.cached:
+                self.exit_callbacks.append(self.cached.close)
+
+        try:
+            log.debug("Fetch a file from %s", details.url)
+            content, content_type, name = await self.get(
+                details.url,
+                headers=self.request_headers(),
+                timeout=self.timeouts.total,
+            )
+
+            return (details.path, name, content, content_type)
+
+        except self.request_errors:
+            log.exception("Failed on %s", details.url)
+
+    async def __aexit__(self, *args: Any):
+        for cb in reversed(self.exit_callbacks):
+            await cb()
+
+    def name_from_resp(self, resp: Any, default_name: str) -> str | None:
+        return self.name_from_headers(resp.headers, default_name)
+
+    def name_from_headers(
+        self,
+        headers: Mapping[str, str],
+        default_name: str,
+    ) -> str | None:
+        disposition = headers.get("content-disposition")
+        if disposition and not default_name:
+            match = disposition_re.match(disposition)
+            if match:
+                return match.group(1)
+            return None
+
+        return None
+
+    def request_headers(self) -> dict[str, Any]:
+        headers = self.details.headers
+        if self.details.byte_range:
+            start, end = self.details.byte_range
+            headers = dict(headers, range=f"bytes={start}-{end}")
+
+        if self.cached:
+            headers = dict(headers, **self.cached.conditions())
+
+        return headers
+
+    def check_status(self, status: int, headers: Mapping[str, str]):
+        """Verify that response contains requested content."""
+        if status == 200:  # noqa: PLR2004
+            return
+
+        if status == 206 and "range" in self.details.headers:  # noqa: PLR2004
+            # range is requested by the caller, who is responsible for it
+            return
+
+        if status == 206 and self.details.byte_range:  # noqa: PLR2004
+            start, _end = self.details.byte_range
+            first = headers.get("content-range", "").partition(" ")[2].partition("-")[0]
+            if first == str(start):
+                return
+
+            log.error("Unexpected content range: %s", headers.get("content-range"))
+
+        raise UrlNotAvailableError(status)
+
+    def select_range(
+        self,
+        content: AsyncIterable[bytes],
+        status: int,
+    ) -> AsyncIterable[bytes]:
+        """Cut requested range from content, if server ignored Range header."""
+        if self.details.byte_range and status == 200:  # noqa: PLR2004
+            log.debug("Range is not supported by %s", self.details.url)
+            return slice_content(content, *self.details.byte_range)
+
+        return content
+
+    def from_cache(self) -> tuple[AsyncIterable[bytes], str | None, str]:
+        """Use cached content after upstream confirmed it's not modified."""
+        cached = cast(CachedResponse, self.cached)
+        log.debug("Use cached content of %s", self.details.url)
+        name = self.name_from_headers(cached.headers, self.details.name)
+        self.received = ItemInfo(
+            self.details.path,
+            name or self.details.name,
+            cached.size,
+            cached.headers.get("content-type"),
+            cached.headers.get("etag"),
+            self.details.byte_range,
+        )
+        return (
+            cached.content(self.details.byte_range),
+            self.received.content_type,
+            self.received.name,
+        )
+
+    def to_cache(
+        self,
+        content: AsyncIterable[bytes],
+        status: int,
+        headers: Mapping[str, str],
+    ) -> AsyncIterable[bytes]:
+        """Save complete content into cache while it's consumed."""
+        if not self.cache or self.details.byte_range or status != 200:  # noqa: PLR2004
+            return content
+
+        size = _size_from_headers(status, headers)
+        if not self.cache.is_cacheable(headers, size):
+            return content
+
+        return self.cache.store(
+            self.details.url,
+            self.details.headers,
+            headers,
+            content,
+            size,
+        )
+
+    async def send(
+        self,
+        url: str,
+        headers: dict[str, Any],
+        timeout: int,
+    ) -> tuple[int, Mapping[str, str], AsyncIterable[bytes]]:
+        """Request content and return status, headers and body of response."""
+        raise NotImplementedError
+
+    async def closing(
+        self,
+        content: AsyncIterable[bytes],
+        close: Callable[[], Coroutine[Any, Any, None]],
+    ) -> AsyncIterable[bytes]:
+        """Close response as soon as its content is consumed or broken.
+
+        Resumed and segmented downloads make many requests, so connections
+        of finished responses are not held until transport exits.
+        """
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            await self.close_response(close)
+
+    async def close_response(self, close: Callable[[], Coroutine[Any, Any, None]]):
+        """Close response before transport exits."""
+        with contextlib.suppress(ValueError):
+            self.exit_callbacks.remove(close)
+        await close()
+
+    def chunk_size(self) -> int:
+        """Size of the next chunk of content.
+
+        Chunks start small and grow with the measured throughput, so slow
+        upstream does not hold data back while the chunk is filled. Chunks
+        also shrink when the memory budget is running out, letting other
+        downloads continue.
+        """
+        size = int(self.rate * CHUNK_TIME)
+        if self.budget.limit:
+            size = min(size, self.budget.available() // MEMORY_SHARE)
+
+        return min(max(size, MIN_CHUNK_SIZE), CHUNK_SIZE)
+
+    async def chunked(self, content: AsyncIterable[bytes]) -> AsyncIterable[bytes]:
+        """Combine pieces of content as they arrive into chunks of adaptive size.
+
+        Incomplete chunk is released when it waits for the rest of data
+        longer than `CHUNK_TIME` seconds. Throughput is measured only while
+        waiting for upstream, so slow consumer does not make chunks smaller.
+        Piece bigger than the chunk size is passed as is.
+        """
+        loop = asyncio.get_running_loop()
+        reader = utils.ChunkReader(content)
+        pending: list[bytes] = []
+        buffered = 0
+        waited = 0.0
+        deadline = 0.0
+        size = self.chunk_size()
+        try:
+            while True:
+                started = loop.time()
+                try:
+                    piece = await reader.next(deadline - started if pending else None)
+                except StopAsyncIteration:
+                    break
+
+                waited += loop.time() - started
+                if piece is not None:
+                    if not pending:
+                        deadline = loop.time() + CHUNK_TIME
+
+                    pending.append(piece)
+                    buffered += len(piece)
+                    if buffered < size:
+                        continue
+
+                rate = buffered / max(waited, 1e-3)
+                self.rate = rate if not self.rate else (self.rate + rate) / 2
+                yield pending[0] if len(pending) == 1 else b"".join(pending)
+                pending = []
+                buffered = 0
+                waited = 0.0
+                size = self.chunk_size()
+
+        finally:
+            reader.close()
+
+        if pending:
+            yield b"".join(pending)
+
+    def reserve_segment(self, size: int, scheduled: int) -> bool:
+        """Take memory for the segment that is requested in advance.
+
+        The nearest segment is always requested, so download continues even
+        if memory is exhausted. Further segments must fit into the budget.
+        """
+        if not scheduled:
+            self.budget.charge(size)
+            return True
+
+        return self.budget.try_acquire(size)
+
+    async def watch(
+        self,
+        content: AsyncIterable[bytes],
+        received: Callable[[], int] | None = None,
+    ) -> AsyncIterable[bytes]:
+        """Interrupt content that stops arriving or arrives too slowly.
+
+        Only time spent waiting for upstream is measured, so slow consumer
+        does not make download stalled. Optional `received` reports number
+        of bytes that arrived from upstream, including those that are not
+        yet combined into a chunk.
+        """
+        idle = self.timeouts.idle
+        rate = self.timeouts.stall_rate
+        period = self.timeouts.stall_period
+        if not idle and not (rate and period):
+            async for chunk in content:
+                yield chunk
+            return
+
+        loop = asyncio.get_running_loop()
+        interval = min(value for value in (1, idle, period) if value)
+        iterator = content.__aiter__()
+
+        # bytes and waiting time of the current measurement period
+        got = 0
+        waited = 0.0
+        pending: asyncio.Future[bytes] | None = None
+        try:
+            while True:
+                started = last_change = loop.time()
+                base = seen = received() if received else 0
+                pending = asyncio.ensure_future(iterator.__anext__())
+                while not (await asyncio.wait({pending}, timeout=interval))[0]:
+                    now = loop.time()
+                    if received and (current := received()) != seen:
+                        seen, last_change = current, now
+
+                    self._check_progress(
+                        now - last_change,
+                        got + seen - base,
+                        waited + now - started,
+                    )
+
+                try:
+                    chunk = pending.result()
+                except StopAsyncIteration:
+                    return
+
+                pending = None
+                got += len(chunk)
+                waited += loop.time() - started
+                if rate and waited >= period:
+                    self._check_progress(0, got, waited)
+                    got, waited = 0, 0.0
+
+                yield chunk
+
+        finally:
+            if pending:
+                pending.cancel()
+
+    def _check_progress(self, idle: float, size: int, elapsed: float):
+        """Raise StallError if download is idle or slow for too long."""
+        timeouts = self.timeouts
+        if timeouts.idle and idle >= timeouts.idle:
+            msg = f"No data from {self.details.url} for {idle:.1f} seconds"
+            raise StallError(msg)
+
+        rate = timeouts.stall_rate
+        period = timeouts.stall_period
+        if rate and period and elapsed >= period and size / elapsed < rate:
+            msg = (
+                f"{self.details.url} sent {size} bytes in {elapsed:.1f} seconds,"
+                f" that is below {rate} bytes per second"
+            )
+            raise StallError(msg)
+
+    async def resumable(
+        self,
+        content: AsyncIterable[bytes],
+        status: int,
+        headers: Mapping[str, str],
+        timeout: int,
+    ) -> AsyncIterable[bytes]:
+        """Continue download from the last received byte after failure.
+
+        The rest of content is requested with `Range` and `If-Range` headers.
+        Download is not resumed when response has no strong validator or
+        its content is encoded, because offsets of decoded content are not
+        known to upstream.
+        """
+        validator = _validator(headers)
+        if headers.get("content-encoding", "identity") != "identity":
+            validator = None
+
+        first, last = _range_from_headers(status, headers) or (0, None)
+        if last is None and (size := _size_from_headers(status, headers)):
+            last = size - 1
+
+        position = first
+        attempt = 0
+        while True:
+            try:
+                async for chunk in content:
+                    position += len(chunk)
+                    yield chunk
+                return
+
+            except self.resumable_errors:
+                if not validator or attempt >= self.retries:
+                    raise
+
+                attempt += 1
+                log.warning(
+                    "Failed on %s after %s bytes. Resume, attempt %s of %s",
+                    self.details.url,
+                    position - first,
+                    attempt,
+                    self.retries,
+                    exc_info=True,
+                )
+
+            if last is not None and position > last:
+                return
+
+            content = self._resume(position, last, validator, attempt, timeout)
+
+    async def _resume(
+        self,
+        position: int,
+        last: int | None,
+        validator: str,
+        attempt: int,
+        timeout: int,
+    ) -> AsyncIterable[bytes]:
+        await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+        _status, _headers, content = await self.send_range(
+            position,
+            last,
+            validator,
+            timeout,
+        )
+        async for chunk in content:
+            yield chunk
+
+    async def send_range(
+        self,
+        start: int,
+        end: int | None,
+        validator: str,
+        timeout: int,
+    ) -> tuple[int, Mapping[str, str], AsyncIterable[bytes]]:
+        """Request part of the content that has not changed."""
+        headers = dict(
+            self.details.headers,
+            range=f"bytes={start}-{'' if end is None else end}",
+        )
+        headers["if-range"] = validator
+        status, resp_headers, content = await self.send(
+            self.details.url,
+            headers,
+            timeout,
+        )
+
+        # the whole content is sent instead of the range when If-Range does
+        # not match
+        if status in (200, 206) and _validator(resp_headers) != validator:
+            msg = f"{self.details.url} was modified"
+            log.error("Content changed during download: %s", msg)
+            raise TransportError({"etag": msg})
+
+        byte_range = _range_from_headers(status, resp_headers)
+        if not byte_range or byte_range[0] != start:
+            log.error(
+                "Cannot get part of %s: %s response with %s range",
+                self.details.url,
+                status,
+                resp_headers.get("content-range"),
+            )
+            raise UrlNotAvailableError(status)
+
+        return status, resp_headers, content
+
+    def segmented_size(self, status: int, headers: Mapping[str, str]) -> int | None:
+        """Size of the content, if it can be downloaded in segments."""
+        if not self.parallel() or status != 200:  # noqa: PLR2004
+            return None
+
+        if self.details.byte_range or "range" in self.details.headers:
+            return None
+
+        if headers.get("accept-ranges") != "bytes" or not _validator(headers):
+            return None
+
+        if headers.get("content-encoding", "identity") != "identity":
+            return None
+
+        size = _size_from_headers(status, headers)
+        if size is None or size < max(self.threshold, self.segment_size * 2):
+            return None
+
+        return size
+
+    async def segmented(
+        self,
+        content: AsyncIterable[bytes],
+        headers: Mapping[str, str],
+        size: int,
+        timeout: int,
+        close: Callable[[], Coroutine[Any, Any, None]],
+    ) -> AsyncIterable[bytes]:
+        """Download content in segments, using simultaneous requests.
+
+        The first segment is taken from the original response, that is
+        closed afterwards and its connection slot is handed over to the rest
+        of segments. They are requested with `Range` header and kept in
+        memory until all previous segments are sent, so no more than
+        `connections - 1` segments are buffered at once.
+        """
+        validator = cast(str, _validator(headers))
+        step = self.segment_size
+        ranges = deque(
+            (start, min(start + step, size) - 1) for start in range(step, size, step)
+        )
+        log.debug(
+            "Download %s in %s segments, %s at once",
+            self.details.url,
+            len(ranges) + 1,
+            self.connections,
+        )
+
+        segments: deque[asyncio.Future[bytes]] = deque()
+
+        # memory taken by scheduled segments that are not yet consumed
+        held: deque[int] = deque()
+
+        def schedule(slots: asyncio.Semaphore):
+            while ranges and len(segments) < self.connections - 1:
+                start, end = ranges[0]
+                if not self.reserve_segment(end + 1 - start, len(segments)):
+                    return
+
+                ranges.popleft()
+                held.append(end + 1 - start)
+                segments.append(
+                    asyncio.ensure_future(
+                        self._segment(start, end, validator, timeout, slots),
+                    ),
+                )
+
+        async with self.segment_slots(busy=True) as slots:
+            try:
+                schedule(slots)
+                async for chunk in slice_content(content, 0, step - 1):
+                    yield chunk
+
+                # the rest of the original response is not needed
+                await self.close_response(close)
+                slots.release()
+
+                while segments:
+                    data = await segments.popleft()
+                    schedule(slots)
+                    yield data
+                    self.budget.release(held.popleft())
+
+            finally:
+                for segment in segments:
+                    segment.cancel()
+                self.budget.release(sum(held))
+
+    async def _segment(
+        self,
+        start: int,
+        end: int,
+        validator: str,
+        timeout: int,
+        slots: asyncio.Semaphore,
+    ) -> bytes:
+        async with slots:
+            status, headers, content = await self.send_range(
+                start,
+                end,
+                validator,
+                timeout,
+            )
+            content = self.resumable(content, status, headers, timeout)
+            data = b"".join([chunk async for chunk in content])
+
+        if len(data) != end + 1 - start:
+            msg = f"Segment {start}-{end} of {self.details.url} has {len(data)} bytes"
+            log.error("Incomplete segment: %s", msg)
+            raise SizeMismatchError({"size": msg})
+
+        return data
+
+    def make_info(
+        self,
+        resp: Any,
+        size: int | None,
+        byte_range: tuple[int, int] | None = None,
+    ) -> ItemInfo:
+        return ItemInfo(
+            self.details.path,
+            self.name_from_resp(resp, self.details.name) or self.details.name,
+            size,
+            resp.headers.get("content-type"),
+            resp.headers.get("etag"),
+            byte_range,
+        )
+
+    def unquote_name(self, name: str) -> str:
+        try:
+            return os.path.basename(
+                unquote_plus(unquote_plus(unquote_plus(name))),
+            )
+        except Exception:
+            log.exception("Cannot simplify name: %s", name)
+            return name
+
+    def content_iterator(self, resp: Any) -> AsyncIterable[bytes]:
+        raise NotImplementedError
+
+
+class FileTransport(Transport):
+    """Read items from the local filesystem.
+
+    Files are opened, inspected and read in large blocks with `pread` by the
+    default executor, so slow network filesystems do not block the event
+    loop.
+    """
+
+    @classmethod
+    def create(cls, request: Request, details: ItemDetails) -> Transport:
+        return cls(details, request.app.config.FPX_FILE_ROOTS)
+
+    def __init__(self, details: ItemDetails, roots: Iterable[str], **kwargs: Any):
+        super().__init__(details, **kwargs)
+        self.roots = roots
+
+    def _open(self, url: str) -> IO[bytes]:
+        path = local_path(url, self.roots)
+        # directories and special files are not available
+        if not os.path.isfile(path):
+            raise UrlNotAvailableError(404)
+
+        try:
+            return open(path, "rb")  # noqa: SIM115
+        except OSError as err:
+            raise UrlNotAvailableError(403) from err
+
+    def open_with_info(self, url: str) -> tuple[IO[bytes], ItemInfo]:
+        """Open the file and inspect it. Blocking, meant for the executor."""
+        fileobj = self._open(url)
+        try:
+            return fileobj, self._info(fileobj)
+        except BaseException:
+            fileobj.close()
+            raise
+
+    def _stat(self, url: str) -> ItemInfo:
+        with self._open(url) as fileobj:
+            return self._info(fileobj)
+
+    def _info(self, fileobj: IO[bytes]) -> ItemInfo:
+        stat = os.fstat(fileobj.fileno())
+        content_type, _encoding = mimetypes.guess_type(fileobj.name)
+        return ItemInfo(
+            self.details.path,
+            self.details.name or os.path.basename(fileobj.name),
+            stat.st_size,
+            content_type,
+            f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+        )
+
+    def _requested_range(self, info: ItemInfo) -> tuple[int, int] | None:
+        if self.details.byte_range:
+            return self.details.byte_range
+
+        # range forwarded by the caller, as if file is served by HTTP server
+        headers = self.details.headers
+        header = headers.get("range")
+        if not header or headers.get("if-range", info.etag) != info.etag:
+            return None
+
+        try:
+            return utils.parse_range(header, cast(int, info.size))
+        except RangeError:
+            return None
+
+    async def get(
+        self,
+        url: str,
+        headers: dict[str, Any],
+        timeout: int,
+    ) -> tuple[AsyncIterable[bytes], str | None, str]:
+        loop = asyncio.get_running_loop()
+        fileobj, self.received = await loop.run_in_executor(
+            None,
+            self.open_with_info,
+            url,
+        )
+
+        async def close():
+            await loop.run_in_executor(None, fileobj.close)
+
+        self.exit_callbacks.append(close)
+
+        self.received.byte_range = self._requested_range(self.received)
+        start, end = self.received.byte_range or (0, cast(int, self.received.size) - 1)
+        log.debug("Read %s-%s bytes from %s", start, end, fileobj.name)
+
+        return (
+            cache.read(fileobj.fileno(), start, end, CHUNK_SIZE),
+            self.received.content_type,
+            self.received.name,
+        )
+
+    async def info(self, url: str, headers: dict[str, Any], timeout: int) -> ItemInfo:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._stat, url)
@@ -0,0 +1,281 @@
+"""Transport for Azure Blob Storage.
+
+Requires `azure-storage-blob` package(`azure` extra).
+
+"""
+from __future__ import annotations
+
+import asyncio
+import ipaddress
+import logging
+import os
+from collections import deque
+from typing import Any, AsyncIterable, cast
+from urllib.parse import parse_qsl, unquote, urlencode, urlparse
+
+import aiohttp
+from azure.core import MatchConditions
+from azure.core.exceptions import ClientAuthenticationError, ResourceModifiedError
+from azure.storage.blob.aio import BlobClient
+
+from fpx.exception import SizeMismatchError, TransportError, UrlNotAvailableError
+from fpx.types import App, Request
+
+from . import CHUNK_SIZE, ItemDetails, ItemInfo, Transport, transport_options
+
+log = logging.getLogger(__name__)
+
+
+def _path_style(host: str) -> bool:
+    """Whether account is the first part of the path(storage emulator)."""
+    if host == "localhost":
+        return True
+
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+
+    return True
+
+
+def _blob_location(url: str) -> tuple[str, str, str, dict[str, str]]:
+    """Split blob URL into account URL, container, blob name and options.
+
+    SAS token is moved from the URL into `credential` option, so the
+    account URL is the same for all blobs of the account. When host is an
+    IP address or `localhost`, account name is the first part of the path,
+    like in URLs of Azurite.
+    """
+    parsed = urlparse(url)
+    parts = parsed.path.lstrip("/").split("/")
+    account = f"{parsed.scheme}://{parsed.netloc}"
+    if _path_style(parsed.hostname or "") and parts[0]:
+        account += "/" + parts.pop(0)
+
+    if len(parts) < 2 or not parts[0] or not parts[-1]:  # noqa: PLR2004
+        raise ValueError(url)
+
+    query = dict(parse_qsl(parsed.query))
+    options = {
+        key: query.pop(param)
+        for key, param in [("snapshot", "snapshot"), ("version_id", "versionid")]
+        if param in query
+    }
+    if query:
+        options["credential"] = urlencode(query)
+
+    return account, unquote(parts[0]), unquote("/".join(parts[1:])), options
+
+
+class AzureBlobTransport(Transport):
+    """Download blobs via sessions shared by all items of the account.
+
+    `clients` maps account URL to HTTP session. Every blob gets its own
+    client with the SAS token of the item, but requests go through the
+    session of the account, so connections are reused. When `clients` are
+    not provided, every item uses its own session.
+    Blobs bigger than `threshold` are downloaded in segments, using up
+    to `connections` simultaneous requests.
+    """
+
+    RETRY_ATTEMPTS = 5
+
+    @classmethod
+    def create(cls, request: Request, details: ItemDetails) -> Transport:
+        return cls(
+            details,
+            clients=request.app.ctx.azure_clients,
+            **transport_options(request),
+        )
+
+    @classmethod
+    async def close_clients(cls, app: App):
+        while app.ctx.azure_clients:
+            _account, session = app.ctx.azure_clients.popitem()
+            await session.close()
+
+    def __init__(
+        self,
+        details: ItemDetails,
+        *,
+        clients: dict[str, aiohttp.ClientSession] | None = None,
+        **kwargs: Any,
+    ):
+        super().__init__(details, **kwargs)
+        self.clients = clients
+
+    def blob_client(self, url: str) -> BlobClient:
+        if self.clients is None:
+            return BlobClient.from_blob_url(url, max_chunk_get_size=CHUNK_SIZE)
+
+        account, container, name, options = _blob_location(url)
+        if account not in self.clients:
+            log.debug("Create session for %s", account)
+            # the same settings as the session created by azure SDK
+            self.clients[account] = aiohttp.ClientSession(
+                cookie_jar=aiohttp.DummyCookieJar(),
+                auto_decompress=False,
+                trust_env=True,
+            )
+
+        return BlobClient(
+            account,
+            container,
+            name,
+            session=self.clients[account],
+            session_owner=False,
+            max_chunk_get_size=CHUNK_SIZE,
+            **options,
+        )
+
+    async def get(
+        self, url: str, headers: dict[str, Any], timeout: int
+    ) -> tuple[AsyncIterable[bytes], str | None, str]:
+        blob = self.blob_client(url)
+        self.exit_callbacks.append(blob.close)
+
+        try:
+            props = await blob.get_blob_properties()
+        except ClientAuthenticationError:
+            raise UrlNotAvailableError(403)
+
+        self.received = ItemInfo(
+            self.details.path,
+            os.path.basename(props["name"]),
+            props["size"],
+            props["content_settings"]["content_type"],
+            props["etag"],
+            self.details.byte_range,
+        )
+        return (
+            self.content_iterator(blob),
+            self.received.content_type,
+            self.received.name,
+        )
+
+    async def info(
+        self, url: str, headers: dict[str, Any], timeout: int
+    ) -> ItemInfo:
+        async with self.blob_client(url) as blob:
+            try:
+                props = await blob.get_blob_properties()
+            except ClientAuthenticationError:
+                raise UrlNotAvailableError(403)
+
+        return ItemInfo(
+            self.details.path,
+            os.path.basename(props["name"]),
+            props["size"],
+            props["content_settings"]["content_type"],
+            props["etag"],
+        )
+
+    async def content_iterator(self, resp: BlobClient) -> AsyncIterable[bytes]:
+        info = cast(ItemInfo, self.received)
+        start, end = self.details.byte_range or (0, info.size - 1)
+        size = end + 1 - start
+        if not self.parallel() or size < max(self.threshold, self.segment_size * 2):
+            async for chunk in self.download(resp, start, end, info.etag):
+                yield chunk
+            return
+
+        step = self.segment_size
+        ranges = deque(
+            (offset, min(offset + step, end + 1) - 1)
+            for offset in range(start, end + 1, step)
+        )
+        log.debug(
+            "Download %s in %s segments, %s at once",
+            resp.blob_name,
+            len(ranges),
+            self.connections,
+        )
+
+        segments: deque[asyncio.Future[bytes]] = deque()
+        held: deque[int] = deque()
+        async with self.segment_slots() as slots:
+            try:
+                while ranges or segments:
+                    while ranges and len(segments) < self.connections:
+                        first, last = ranges[0]
+                        if not self.reserve_segment(last + 1 - first, len(segments)):
+                            break
+
+                        ranges.popleft()
+                        held.append(last + 1 - first)
+                        segments.append(
+                            asyncio.ensure_future(
+                                self._segment(resp, first, last, info.etag, slots),
+                            ),
+                        )
+                    yield await segments.popleft()
+                    self.budget.release(held.popleft())
+
+            finally:
+                for segment in segments:
+                    segment.cancel()
+                self.budget.release(sum(held))
+
+    async def _segment(
+        self,
+        resp: BlobClient,
+        start: int,
+        end: int,
+        etag: str | None,
+        slots: asyncio.Semaphore,
+    ) -> bytes:
+        async with slots:
+            content = self.download(resp, start, end, etag)
+            data = b"".join([chunk async for chunk in content])
+
+        if len(data) != end + 1 - start:
+            msg = f"Segment {start}-{end} of {resp.blob_name} has {len(data)} bytes"
+            log.error("Incomplete segment: %s", msg)
+            raise SizeMismatchError({"size": msg})
+
+        return data
+
+    async def download(
+        self,
+        resp: BlobClient,
+        offset: int,
+        end: int,
+        etag: str | None,
+    ) -> AsyncIterable[bytes]:
+        """Download range of the blob, continuing from the last received byte."""
+        conditions: dict[str, Any] = {}
+        if etag:
+            conditions = {
+                "etag": etag,
+                "match_condition": MatchConditions.IfNotModified,
+            }
+
+        attempt = 0
+        while True:
+            try:
+                length = end + 1 - offset
+                stream = await resp.download_blob(offset, length, **conditions)
+                async for chunk in self.watch(stream.chunks()):
+                    offset += len(chunk)
+                    yield chunk
+
+            except ResourceModifiedError as err:
+                msg = f"{resp.blob_name} was modified"
+                raise TransportError({"etag": msg}) from err
+
+            except Exception:
+                attempt += 1
+                log.exception(
+                    "Error during %s(out of %s) attempt to download %s. Downloaded %s bytes",
+                    attempt,
+                    self.RETRY_ATTEMPTS,
+                    resp.blob_name,
+                    offset,
+                )
+                if attempt > self.RETRY_ATTEMPTS:
+                    raise UrlNotAvailableError(500)
+                else:
+                    continue
+            else:
+                break
@@ -0,0 +1,179 @@
+"""HTTP transport based on aiohttp."""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Mapping
+
+import aiohttp
+
+from fpx.cache import upstream_cache
+from fpx.exception import UrlNotAvailableError
+from fpx.types import App, Request
+
+from . import (
+    ItemDetails,
+    ItemInfo,
+    Transport,
+    _range_from_headers,
+    _size_from_headers,
+    transport_options,
+)
+
+log = logging.getLogger(__name__)
+
+
+class AioHttpTransport(Transport):
+    client: aiohttp.ClientSession | None
+
+    request_errors = (*Transport.request_errors, aiohttp.ClientError)
+    resumable_errors = (*Transport.resumable_errors, aiohttp.ClientError)
+
+    @classmethod
+    def create(cls, request: Request, details: ItemDetails) -> Transport:
+        return cls(
+            details,
+            upstream_cache(request.app),
+            request.app.ctx.aiohttp_session,
+            **transport_options(request),
+        )
+
+    @classmethod
+    async def open_clients(cls, app: App):
+        config = app.config
+        # session is shared by all tickets, so cookies set by upstream for
+        # one of them must not be sent with requests of others
+        app.ctx.aiohttp_session = aiohttp.ClientSession(
+            cookie_jar=aiohttp.DummyCookieJar(),
+            connector=aiohttp.TCPConnector(
+                limit=config.FPX_HTTP_POOL_SIZE,
+                limit_per_host=config.FPX_HTTP_POOL_SIZE_PER_HOST,
+                keepalive_timeout=config.FPX_HTTP_KEEPALIVE,
+                use_dns_cache=bool(config.FPX_HTTP_DNS_CACHE_TTL),
+                ttl_dns_cache=config.FPX_HTTP_DNS_CACHE_TTL or None,
+            ),
+        )
+
+    @classmethod
+    async def close_clients(cls, app: App):
+        if app.ctx.aiohttp_session is not None:
+            await app.ctx.aiohttp_session.close()
+            app.ctx.aiohttp_session = None
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncIterator[aiohttp.ClientSession]:
+        if self.client:
+            yield self.client
+            return
+
+        async with aiohttp.ClientSession() as session:
+            yield session
+
+    async def get(
+        self,
+        url: str,
+        headers: dict[str, Any],
+        timeout: int,
+    ) -> tuple[AsyncIterable[bytes], str | None, str]:
+        resp = await self.response(url, headers, timeout)
+
+        if resp.status == 304 and self.cached:  # noqa: PLR2004
+            return self.from_cache()
+
+        self.check_status(resp.status, resp.headers)
+
+        self.received = self.make_info(
+            resp,
+            _size_from_headers(resp.status, resp.headers),
+            _range_from_headers(resp.status, resp.headers),
+        )
+        content = self.resumable(
+            self.content_iterator(resp),
+            resp.status,
+            resp.headers,
+            timeout,
+        )
+        if size := self.segmented_size(resp.status, resp.headers):
+            content = self.segmented(content, resp.headers, size, timeout, resp.release)
+
+        content = self.select_range(content, resp.status)
+        return (
+            self.to_cache(content, resp.status, resp.headers),
+            self.received.content_type,
+            self.received.name,
+        )
+
+    async def response(
+        self,
+        url: str,
+        headers: dict[str, Any],
+        timeout: int,
+    ) -> aiohttp.ClientResponse:
+        if not self.client:
+            self.client = aiohttp.ClientSession()
+            self.exit_callbacks.append(self.client.close)
+
+        resp = await asyncio.wait_for(
+            self.client.get(
+                url,
+                headers=headers,
+                timeout=self.client_timeout(timeout),
+            ),
+            self.timeouts.ttfb or None,
+        )
+        log.info("Got a %s(%s) response from %s", resp.status, resp.reason, url)
+
+        self.exit_callbacks.append(resp.release)
+        return resp
+
+    async def send(
+        self,
+        url: str,
+        headers: dict[str, Any],
+        timeout: int,
+    ) -> tuple[int, Mapping[str, str], AsyncIterable[bytes]]:
+        resp = await self.response(url, headers, timeout)
+        return resp.status, resp.headers, self.content_iterator(resp)
+
+    def content_iterator(self, resp: aiohttp.ClientResponse):
+        content = self.watch(
+            self.chunked(resp.content.iter_any()),
+            lambda: resp.content.total_bytes,
+        )
+        return self.closing(content, resp.release)
+
+    def client_timeout(self, timeout: int, read: float = 0) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(
+            total=timeout,
+            sock_connect=self.timeouts.connect or None,
+            sock_read=read or None,
+        )
+
+    async def info(self, url: str, headers: dict[str, Any], timeout: int) -> ItemInfo:
+        # response without body is expected, so every read waits for headers
+        client_timeout = self.client_timeout(timeout, self.timeouts.ttfb)
+        async with self.session() as session:
+            async with session.head(
+                url,
+                headers=headers,
+                allow_redirects=True,
+                timeout=client_timeout,
+            ) as resp:
+                size = _size_from_headers(resp.status, resp.headers)
+                if resp.status == 200 and size is not None:  # noqa: PLR2004
+                    return self.make_info(resp, size)
+
+            # some servers do not support HEAD requests
+            async with session.get(
+                url,
+                headers=dict(headers, range="bytes=0-0"),
+                timeout=client_timeout,
+            ) as resp:
+                if resp.status not in (200, 206):
+                    raise UrlNotAvailableError(resp.status)
+
+                return self.make_info(
+                    resp,
+                    _size_from_headers(resp.status, resp.headers),
+                )
@@ -0,0 +1,315 @@
+"""HTTP transport based on httpx.
+
+When `FPX_HTTP2` is enabled, requests to the same origin are multiplexed
+over a single HTTP/2 connection, if upstream supports it.
+
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Any, AsyncIterable, AsyncIterator, Mapping
+
+import httpx
+
+from fpx.cache import upstream_cache
+from fpx.exception import UrlNotAvailableError
+from fpx.types import App, Request
+
+from . import (
+    CHUNK_SIZE,
+    ItemDetails,
+    ItemInfo,
+    MemoryBudget,
+    SpooledBuffer,
+    Transport,
+    _range_from_headers,
+    _size_from_headers,
+    transport_options,
+)
+
+log = logging.getLogger(__name__)
+
+
+class StreamBuffer:
+    """Read content of HTTP/2 stream as soon as it arrives.
+
+    Streams of HTTP/2 connection share its flow-control window. Data that is
+    received but not consumed occupies the window, so an item that waits for
+    its turn(e.g., prefetched item of ZIP archive) can block the item that
+    is currently consumed from the same connection. Buffer reads the stream
+    in background and keeps up to `max_size` bytes in memory, while they fit
+    into the memory budget, and the rest in temporary file.
+
+    When temporary file holds `max_disk` bytes beyond `max_size`, stream is
+    not read until the whole buffer is consumed. Then the file is emptied
+    and reused. Zero `max_disk` removes the limit.
+    """
+
+    def __init__(
+        self,
+        content: AsyncIterable[bytes],
+        max_size: int,
+        max_disk: int = 0,
+        budget: MemoryBudget | None = None,
+    ):
+        self.size = 0
+        self.consumed = 0
+        self.done = False
+        self.error: BaseException | None = None
+        self.limit = max_size + max_disk if max_disk else 0
+        self._file = SpooledBuffer(max_size, budget)
+        # offset of the first byte of the file in the stream
+        self._base = 0
+        self._changed = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._task = asyncio.ensure_future(self._fill(content))
+
+    def _full(self) -> bool:
+        return bool(self.limit) and self.size - self._base >= self.limit
+
+    def _read(self, offset: int, size: int) -> bytes:
+        return self._file.read(offset - self._base, size)
+
+    async def _fill(self, content: AsyncIterable[bytes]):
+        try:
+            async for chunk in content:
+                while self._full() and self.consumed < self.size:
+                    self._drained.clear()
+                    await self._drained.wait()
+
+                # reader doesn't touch the file when everything is consumed,
+                # so it can be emptied together with the next write
+                reset = self.consumed == self.size > self._base
+                await self._file.write(chunk, reset)
+                if reset:
+                    self._base = self.size
+                self.size += len(chunk)
+                self._changed.set()
+
+        except Exception as err:  # noqa: BLE001
+            self.error = err
+
+        finally:
+            self.done = True
+            self._changed.set()
+
+    async def content(self) -> AsyncIterable[bytes]:
+        loop = asyncio.get_running_loop()
+        offset = 0
+        while True:
+            if offset < self.size:
+                chunk = await loop.run_in_executor(
+                    None,
+                    self._read,
+                    offset,
+                    min(self.size - offset, CHUNK_SIZE),
+                )
+                offset += len(chunk)
+                self.consumed = offset
+                self._drained.set()
+                yield chunk
+
+            elif self.done:
+                if self.error:
+                    raise self.error
+                return
+
+            else:
+                self._changed.clear()
+                await self._changed.wait()
+
+    async def close(self):
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+
+        self._file.close()
+
+
+class HttpxTransport(Transport):
+    client: httpx.AsyncClient | None
+
+    request_errors = (*Transport.request_errors, httpx.HTTPError)
+    resumable_errors = (*Transport.resumable_errors, httpx.TransportError)
+
+    def __init__(
+        self,
+        details: ItemDetails,
+        *args: Any,
+        stream_buffer: int = 8 * CHUNK_SIZE,
+        stream_disk_buffer: int = 0,
+        **kwargs: Any,
+    ):
+        super().__init__(details, *args, **kwargs)
+
+        # memory used by content of HTTP/2 stream before it's moved to disk
+        self.stream_buffer = stream_buffer
+        # disk space used by content of HTTP/2 stream before reading pauses
+        self.stream_disk_buffer = stream_disk_buffer
+
+    @classmethod
+    def create(cls, request: Request, details: ItemDetails) -> Transport:
+        return cls(
+            details,
+            upstream_cache(request.app),
+            request.app.ctx.httpx_client,
+            stream_buffer=request.app.config.FPX_HTTP2_BUFFER_SIZE,
+            stream_disk_buffer=request.app.config.FPX_HTTP2_DISK_BUFFER_SIZE,
+            **transport_options(request),
+        )
+
+    @classmethod
+    async def open_clients(cls, app: App):
+        config = app.config
+        # client is shared by all tickets, so cookies set by upstream for one
+        # of them must not be sent with requests of others
+        app.ctx.httpx_client = httpx.AsyncClient(
+            cookies=CookieJar(DefaultCookiePolicy(allowed_domains=[])),
+            http2=config.FPX_HTTP2,
+            limits=httpx.Limits(
+                max_connections=config.FPX_HTTP_POOL_SIZE or None,
+                max_keepalive_connections=config.FPX_HTTP_POOL_SIZE or None,
+                keepalive_expiry=config.FPX_HTTP_KEEPALIVE,
+            ),
+        )
+
+    @classmethod
+    async def close_clients(cls, app: App):
+        if app.ctx.httpx_client is not None:
+            await app.ctx.httpx_client.aclose()
+            app.ctx.httpx_client = None
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncIterator[httpx.AsyncClient]:
+        if self.client:
+            yield self.client
+            return
+
+        async with httpx.AsyncClient() as client:
+            yield client
+
+    async def get(
+        self,
+        url: str,
+        headers: dict[str, Any],
+        timeout: int,
+    ) -> tuple[AsyncIterable[bytes], str | None, str]:
+        resp = await self.response(url, headers, timeout)
+
+        if resp.status_code == 304 and self.cached:  # noqa: PLR2004
+            return self.from_cache()
+
+        self.check_status(resp.status_code, resp.headers)
+
+        self.received = self.make_info(
+            resp,
+            _size_from_headers(resp.status_code, resp.headers),
+            _range_from_headers(resp.status_code, resp.headers),
+        )
+        content = self.resumable(
+            self.content_iterator(resp),
+            resp.status_code,
+            resp.headers,
+            timeout,
+        )
+        if size := self.segmented_size(resp.status_code, resp.headers):
+            content = self.segmented(content, resp.headers, size, timeout, resp.aclose)
+
+        content = self.select_range(content, resp.status_code)
+        return (
+            self.to_cache(content, resp.status_code, resp.headers),
+            self.received.content_type,
+            self.received.name,
+        )
+
+    async def response(
+        self,
+        url: str,
+        headers: dict[str, Any],
+        timeout: int,
+    ) -> httpx.Response:
+        if not self.client:
+            self.client = httpx.AsyncClient()
+            self.exit_callbacks.append(self.client.aclose)
+
+        req = self.client.build_request(
+            "GET",
+            url,
+            headers=headers,
+            timeout=self.client_timeout(timeout),
+        )
+        resp = await asyncio.wait_for(
+            self.client.send(req, stream=True),
+            self.timeouts.ttfb or None,
+        )
+        self.client.cookies.clear()
+        log.info(
+            "Got a %s(%s) response from %s", resp.status_code, resp.reason_phrase, url
+        )
+        self.exit_callbacks.append(resp.aclose)
+        return resp
+
+    async def send(
+        self,
+        url: str,
+        headers: dict[str, Any],
+        timeout: int,
+    ) -> tuple[int, Mapping[str, str], AsyncIterable[bytes]]:
+        resp = await self.response(url, headers, timeout)
+        return resp.status_code, resp.headers, self.content_iterator(resp)
+
+    def content_iterator(self, resp: httpx.Response):
+        content = self.closing(
+            self.watch(
+                self.chunked(resp.aiter_bytes()),
+                lambda: resp.num_bytes_downloaded,
+            ),
+            resp.aclose,
+        )
+        if resp.http_version != "HTTP/2":
+            return content
+
+        buffer = StreamBuffer(
+            content,
+            self.stream_buffer,
+            self.stream_disk_buffer,
+            self.budget,
+        )
+        self.exit_callbacks.append(buffer.close)
+        return buffer.content()
+
+    def client_timeout(self, timeout: int, read: float = 0) -> httpx.Timeout:
+        return httpx.Timeout(
+            timeout,
+            connect=self.timeouts.connect or timeout,
+            read=read or timeout,
+        )
+
+    async def info(self, url: str, headers: dict[str, Any], timeout: int) -> ItemInfo:
+        # response without body is expected, so every read waits for headers
+        client_timeout = self.client_timeout(timeout, self.timeouts.ttfb)
+        async with self.session() as client:
+            resp = await client.head(url, headers=headers, timeout=client_timeout)
+            size = _size_from_headers(resp.status_code, resp.headers)
+            if resp.status_code == 200 and size is not None:  # noqa: PLR2004
+                return self.make_info(resp, size)
+
+            # some servers do not support HEAD requests
+            req = client.build_request(
+                "GET",
+                url,
+                headers=dict(headers, range="bytes=0-0"),
+                timeout=client_timeout,
+            )
+            resp = await client.send(req, stream=True)
+            await resp.aclose()
+            if resp.status_code not in (200, 206):
+                raise UrlNotAvailableError(resp.status_code)
+
+            return self.make_info(
+                resp,
+                _size_from_headers(resp.status_code, resp.headers),
+            )
@@ -1,8 +1,19 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+from typing import IO, TYPE_CHECKING, AsyncIterable
 
 from asyncblink import signal
+from sanic.http import Http
+from sanic.response import HTTPResponse
+
+from .exception import RangeError
+from .types import Request
+
+if TYPE_CHECKING:
+    from .pipes import Pipe
+    from .transport import MemoryBudget
 
 log = logging.getLogger(__name__)
 
@@ -10,15 +21,268 @@ on_download_completed = signal("fpx:download-completed")
 on_download_started = signal("fpx:download-started")
 
 
-class ActiveDownload:
-    def __init__(self, downloads, id):
-        self.id = id
-        self.downloads = downloads
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """Convert value of Range header into inclusive range of bytes.
+
+    Only single range is supported. Header with unsupported or invalid
+    value is ignored, just like HTTP specification recommends.
+    """
+    unit, _sep, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+
+    try:
+        if not first:
+            # suffix range: the last N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+
+    except ValueError:
+        return None
+
+    if first and last and end < start:
+        return None
+
+    end = min(end, size - 1)
+
+    if start > end or start >= size:
+        raise RangeError({"range": f"Range {header} is not satisfiable"}, size)
+
+    return start, end
+
+
+def _requested_range(request: Request, size: int, etag: str) -> tuple[int, int] | None:
+    header = request.headers.get("range")
+    if not header:
+        return None
+
+    # range of the outdated representation is replaced by the whole content
+    if_range = request.headers.get("if-range")
+    if if_range and if_range != etag:
+        return None
+
+    return parse_range(header, size)
+
+
+def download_headers(request: Request, pipe: Pipe) -> tuple[int, dict[str, str]]:
+    """Status and headers of the response with the output of the pipe.
+
+    If pipe supports byte ranges and client requested a range, this range is
+    selected in the pipe.
+    """
+    status = 200
+    headers = {"content-disposition": f'attachment; filename="{pipe.filename()}"'}
+
+    length = pipe.content_length()
+    etag = pipe.etag()
+    if length is not None and etag:
+        headers["accept-ranges"] = "bytes"
+        headers["etag"] = etag
+        byte_range = _requested_range(request, length, etag)
+        if byte_range:
+            start, end = byte_range
+            pipe.select_range(start, end)
+            status = 206
+            headers["content-range"] = f"bytes {start}-{end}/{length}"
+            length = pipe.content_length()
+
+    if length is not None:
+        headers["content-length"] = str(length)
+
+    return status, headers
+
+
+class ChunkReader:
+    """Reader of content that waits for the next chunk with a timeout.
+
+    Request of the next chunk survives the timeout and is awaited by the
+    following call, so no data is lost.
+    """
+
+    def __init__(self, content: AsyncIterable[bytes]):
+        self.iterator = content.__aiter__()
+        self.task: asyncio.Future[bytes] | None = None
+
+    async def next(self, timeout: float | None = None) -> bytes | None:
+        """Next chunk or `None` if it's not available within `timeout`.
+
+        `StopAsyncIteration` is raised when content is exhausted.
+        """
+        if timeout is None and self.task is None:
+            return await self.iterator.__anext__()
+
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.iterator.__anext__())
+
+        done, _ = await asyncio.wait(
+            {self.task},
+            timeout=None if timeout is None else max(timeout, 0),
+        )
+        if not done:
+            return None
+
+        task, self.task = self.task, None
+        return task.result()
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+
+class _Pending:
+    """Chunks waiting to be merged, charged to the memory budget."""
+
+    def __init__(self, budget: MemoryBudget | None):
+        self.budget = budget
+        self.chunks: list[bytes] = []
+        self.size = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.chunks)
+
+    def fits(self, size: int) -> bool:
+        return self.budget is None or self.budget.fits(size)
+
+    def add(self, chunk: bytes):
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self.budget:
+            self.budget.charge(len(chunk))
+
+    def merge(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.clear()
+        return data
+
+    def clear(self):
+        if self.budget:
+            self.budget.release(self.size)
+        self.chunks = []
+        self.size = 0
+
+
+async def coalesce(
+    content: AsyncIterable[bytes],
+    size: int,
+    latency: float,
+    budget: MemoryBudget | None = None,
+) -> AsyncIterable[bytes]:
+    """Merge small chunks of content into chunks of at least `size` bytes.
+
+    Merged data is released earlier if the next chunk does not arrive within
+    `latency` seconds after the first pending chunk, so slow content is not
+    delayed for long. Chunks that are large enough are passed as is.
+
+    Pending chunks draw from the memory `budget` without waiting, because
+    content is consumed right now. Chunks are not merged while the budget
+    cannot hold the whole merged chunk.
+    """
+    if size <= 0:
+        async for chunk in content:
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    reader = ChunkReader(content)
+    pending = _Pending(budget)
+    deadline = 0.0
+
+    try:
+        while True:
+            try:
+                chunk = await reader.next(
+                    deadline - loop.time() if pending else None,
+                )
+            except StopAsyncIteration:
+                break
+
+            if chunk is None:
+                yield pending.merge()
+                continue
+
+            if not pending:
+                if len(chunk) >= size or not pending.fits(size):
+                    yield chunk
+                    continue
+
+                deadline = loop.time() + latency
+
+            pending.add(chunk)
+            if pending.size >= size:
+                yield pending.merge()
+
+        if pending:
+            yield pending.merge()
+
+    finally:
+        pending.clear()
+        reader.close()
+
+
+async def sendfile(
+    request: Request,
+    response: HTTPResponse,
+    fileobj: IO[bytes],
+    start: int,
+    end: int,
+) -> bool:
+    """Send inclusive range of bytes from the local file as response body.
+
+    Bytes are passed to the socket by the event loop(using `os.sendfile`
+    when possible), bypassing Sanic. That's possible only for HTTP/1.1
+    response with `Content-Length`, served by the standard asyncio loop.
+    uvloop does not implement `sendfile`. False is returned for other
+    responses, that must be sent as usual.
+    """
+    loop = asyncio.get_running_loop()
+    stream = response.stream
+    count = end + 1 - start
+    if not isinstance(loop, asyncio.BaseEventLoop) or count <= 0:
+        return False
+
+    if not isinstance(stream, Http):
+        return False
+
+    if response.headers.get("content-length") != str(count):
+        return False
+
+    # headers are sent together with the first chunk of the body
+    await response.send(b"")
+    if stream.response_func != stream.http1_response_normal:
+        # HEAD request
+        return True
+
+    sent = await loop.sendfile(request.transport, fileobj, start, count)
+
+    # keep track of the body size, just like Sanic does
+    stream.response_bytes_left -= sent
+    return True
+
 
-    def __enter__(self):
-        self.downloads.append(self.id)
-        on_download_started.send(self.id, downloads=self.downloads)
+async def send_output(request: Request, response: HTTPResponse, pipe: Pipe):
+    """Send output of the pipe as response body."""
+    if local := await pipe.local_file():
+        fileobj = local[0]
+        try:
+            if await sendfile(request, response, *local):
+                log.debug("Sent %s using sendfile", fileobj.name)
+                return
+        finally:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, fileobj.close)
 
-    def __exit__(self, type, value, tb):
-        self.downloads.remove(self.id)
-        on_download_completed.send(self.id, downloads=self.downloads)
+    config = request.app.config
+    async for chunk in coalesce(
+        pipe.chunks(),
+        config.FPX_OUTPUT_CHUNK_SIZE,
+        config.FPX_OUTPUT_LATENCY,
+        pipe.budget,
+    ):
+        await response.send(chunk)